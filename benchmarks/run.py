@@ -0,0 +1,281 @@
+import json
+import logging
+import platform
+import statistics
+import sys
+from base64 import b64encode
+from os import environ, urandom
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+from typing import Callable
+
+from cryptography.fernet import Fernet
+
+from gcp_storage.arg_parser import ArgParser
+from gcp_storage.cloud_storage import GCPCloudStorage
+from gcp_storage.color import Color
+from gcp_storage.encrypt import Cipher
+from gcp_storage.logger import get_logger
+from benchmarks.fake_gcs import FakeGCSServer
+
+
+UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+
+def parse_size(size: str) -> int:
+    """Parse a size like 64KB or 1GB to bytes
+
+    Args:
+        size (str): size with optional unit suffix
+
+    Returns:
+        int: size in bytes
+    """
+    size = size.strip().upper()
+    for unit in ('GB', 'MB', 'KB', 'B'):
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * UNITS[unit])
+    return int(size)
+
+
+def format_size(size: int) -> str:
+    """Format bytes as the shortest exact unit for result keys
+
+    Args:
+        size (int): size in bytes
+
+    Returns:
+        str: size like 64KB
+    """
+    for unit in ('GB', 'MB', 'KB'):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f'{size // UNITS[unit]}{unit}'
+    return f'{size}B'
+
+
+class Benchmark():
+    def __init__(self, sizes: list, count: int = 5, bucket: str = 'gstorage-bench', crypto_max_size: int = 0):
+        """Benchmark GCPCloudStorage operations and the Cipher against a GCS emulator
+
+        Args:
+            sizes (list): object sizes in bytes
+            count (int, optional): objects per size. Defaults to 5.
+            bucket (str, optional): bucket name on the emulator. Defaults to 'gstorage-bench'.
+            crypto_max_size (int, optional): largest size to run the cipher benchmarks for. Fernet holds the whole
+                token in memory, so large sizes take a long time. Defaults to 0 (16MB).
+        """
+        self.sizes = sizes
+        self.count = count
+        self.bucket = bucket
+        self.crypto_max_size = crypto_max_size or 16 * UNITS['MB']
+        self.results: dict = {}
+
+    @staticmethod
+    def make_data(size: int) -> bytes:
+        """Make printable test data so download_object() can decode it as text
+
+        Args:
+            size (int): size in bytes
+
+        Returns:
+            bytes: test data
+        """
+        block = b64encode(urandom(768 * 1024))
+        return (block * (size // len(block) + 1))[:size]
+
+    def record(self, name: str, size: int, timings: list, nbytes: int = 0):
+        """Summarize the timings of one benchmark
+
+        Args:
+            name (str): operation name
+            size (int): object size in bytes
+            timings (list): seconds per call
+            nbytes (int, optional): bytes moved per call for throughput. Defaults to 0.
+        """
+        timings = sorted(timings)
+        total = sum(timings)
+        result = {
+            'operation': name,
+            'size': size,
+            'calls': len(timings),
+            'mean_seconds': total / len(timings),
+            'p50_seconds': statistics.median(timings),
+            'p90_seconds': timings[min(len(timings) - 1, int(len(timings) * 0.9))],
+            'min_seconds': timings[0],
+            'max_seconds': timings[-1],
+        }
+        if nbytes:
+            result['mb_per_second'] = nbytes * len(timings) / total / UNITS['MB'] if total else 0.0
+        key = f'{name}[{format_size(size)}]' if size else name
+        self.results[key] = result
+        Color().print_message(f'{key:40} p50 {result["p50_seconds"] * 1000:10.2f} ms'
+                              + (f' {result["mb_per_second"]:10.1f} MB/s' if nbytes else ''), 'cyan')
+
+    @staticmethod
+    def timed(func: Callable, *args) -> float:
+        """Time a single call that must succeed
+
+        Args:
+            func (Callable): function to call
+
+        Raises:
+            RuntimeError: if the call returned a falsy result
+
+        Returns:
+            float: seconds taken
+        """
+        start = perf_counter()
+        result = func(*args)
+        elapsed = perf_counter() - start
+        if not result and result != []:
+            raise RuntimeError(f'{func.__name__}{args} failed')
+        return elapsed
+
+    def bench_storage(self, work_dir: str):
+        """Benchmark upload, download, list, info and delete for every size
+
+        Args:
+            work_dir (str): directory for the test files
+        """
+        storage = GCPCloudStorage(self.bucket, set_used_bucket=False)
+        for size in self.sizes:
+            label = format_size(size)
+            source = Path(work_dir, f'source-{label}')
+            source.write_bytes(self.make_data(size))
+            names = [f'bench/{label}/object-{i}' for i in range(self.count)]
+            self.record('upload_file', size, [self.timed(storage.upload_file, str(source), n) for n in names], size)
+            target = str(Path(work_dir, 'target'))
+            self.record('download_object_to_file', size,
+                        [self.timed(storage.download_object_to_file, n, target) for n in names], size)
+            if size <= 64 * UNITS['MB']:
+                self.record('download_object', size, [self.timed(storage.download_object, n) for n in names], size)
+            self.record('get_object_info', size, [self.timed(storage.get_object_info, n) for n in names])
+            self.record('list', size, [self.timed(lambda p: list(storage.get_bucket_folder_files(p)), f'bench/{label}/')
+                                       for _ in range(self.count)])
+            self.record('delete_object', size, [self.timed(storage.delete_object, n, True) for n in names])
+            source.unlink()
+
+    def bench_crypto(self):
+        """Benchmark the password XOR cipher and Fernet encryption"""
+        cipher = Cipher()
+        key = Fernet.generate_key()
+        for size in [s for s in self.sizes if s <= self.crypto_max_size]:
+            data = self.make_data(size)
+            self.record('passwd_xor', size, [self.timed(cipher.passwd_xor, data, 'benchmark')
+                                             for _ in range(self.count)], size)
+            token = cipher.encrypt(data, key)
+            self.record('fernet_encrypt', size, [self.timed(cipher.encrypt, data, key)
+                                                 for _ in range(self.count)], size)
+            self.record('fernet_decrypt', size, [self.timed(cipher.decrypt, token, key)
+                                                 for _ in range(self.count)], size)
+
+    def run(self) -> dict:
+        """Run all benchmarks
+
+        Returns:
+            dict: JSON serializable results
+        """
+        with TemporaryDirectory(prefix='gstorage-bench-') as work_dir:
+            self.bench_storage(work_dir)
+        self.bench_crypto()
+        return {
+            'created': time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'emulator': environ.get('STORAGE_EMULATOR_HOST', ''),
+            'count': self.count,
+            'results': self.results,
+        }
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2) -> list:
+    """Compare benchmark results against a baseline run. A benchmark regresses when its p50 latency grew by more
+    than threshold
+
+    Args:
+        results (dict): current results
+        baseline (dict): baseline results
+        threshold (float, optional): allowed relative slowdown. Defaults to 0.2.
+
+    Returns:
+        list: names of the regressed benchmarks
+    """
+    regressions = []
+    for key, result in results['results'].items():
+        base = baseline.get('results', {}).get(key)
+        if not base or not base['p50_seconds']:
+            continue
+        change = result['p50_seconds'] / base['p50_seconds'] - 1
+        color = 'red' if change > threshold else 'green' if change < -threshold else 'white'
+        Color().print_message(f'{key:40} {base["p50_seconds"] * 1000:10.2f} ms -> '
+                              f'{result["p50_seconds"] * 1000:10.2f} ms ({change:+.1%})', color)
+        if change > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main() -> bool:
+    args = ArgParser('GCP Cloud Storage Benchmarks', None, {
+        'sizes': {
+            'short': 's',
+            'help': 'Comma separated object sizes. Default: 1KB,64KB,1MB,16MB,128MB (add 1GB for the large run)',
+            'default': '1KB,64KB,1MB,16MB,128MB',
+        },
+        'count': {
+            'short': 'c',
+            'help': 'Objects (and repetitions) per size. Default: 5',
+            'type': int,
+            'default': 5,
+        },
+        'emulator': {
+            'short': 'e',
+            'help': 'URL of a running GCS emulator. Default: start an in-process fake server',
+        },
+        'output': {
+            'short': 'o',
+            'help': 'Write results JSON to this path',
+        },
+        'baseline': {
+            'short': 'B',
+            'help': 'Compare against this results JSON and exit 1 on regressions',
+        },
+        'threshold': {
+            'short': 't',
+            'help': 'Allowed relative p50 slowdown before a benchmark counts as regressed. Default: 0.2',
+            'type': float,
+            'default': 0.2,
+        },
+        'cryptoMaxSize': {
+            'short': 'cm',
+            'help': 'Largest size to run passwd_xor/Fernet benchmarks for. Default: 16MB',
+            'default': '16MB',
+        },
+    }).set_arguments()
+    get_logger('gcp-storage').addFilter(lambda record: record.levelno >= logging.WARNING)
+    server = None
+    if args.get('emulator'):
+        environ['STORAGE_EMULATOR_HOST'] = args['emulator']
+    else:
+        server = FakeGCSServer().start()
+        environ['STORAGE_EMULATOR_HOST'] = server.url
+    try:
+        results = Benchmark([parse_size(s) for s in args['sizes'].split(',')], args['count'],
+                            crypto_max_size=parse_size(args['cryptoMaxSize'])).run()
+    finally:
+        if server:
+            server.stop()
+    if args.get('output'):
+        with open(args['output'], 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.get('baseline'):
+        with open(args['baseline'], 'r') as file:
+            regressions = compare(results, json.load(file), args['threshold'])
+        if regressions:
+            Color().print_message(f'Regressed: {", ".join(regressions)}', 'red')
+            return False
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
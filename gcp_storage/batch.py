@@ -0,0 +1,266 @@
+import json
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from time import perf_counter
+
+from gcp_storage.cloud_storage import GCPCloudStorage
+from gcp_storage.logger import LogSummary
+from gcp_storage.metrics import instrument
+from gcp_storage.scheduler import scheduler
+
+
+OPERATIONS = ('create', 'get', 'info', 'delete')
+
+
+class BatchRunner(GCPCloudStorage):
+    def __init__(self, bucket: str = 'default', service_account: str = 'default', workers: int = 8):
+        """Run a JSON lines manifest of create, get, info and delete operations on a worker pool with one shared
+        client. Each manifest line uses the options of the matching command, e.g.
+        {"op": "create", "name": "a.txt", "fromFile": "/tmp/a.txt", "compress": "gzip", "bucket": "other"}.
+        Operations run in the bulk class of the transfer scheduler unless they set "priority"
+
+        Args:
+            bucket (str, optional): bucket of operations without a bucket option. Defaults to 'default'.
+            service_account (str, optional): service account to use. Defaults to 'default'.
+            workers (int, optional): concurrent operations. Defaults to 8.
+        """
+        super().__init__(bucket, service_account, set_used_bucket=False)
+        self.workers = max(1, workers)
+        self.__passwd = ''
+        self.__managers: dict = {}
+
+    def _prompt_for_passwd(self, verify: bool = False) -> str:
+        """Get the password entered once for the batch, worker threads never prompt
+
+        Args:
+            verify (bool, optional): unused. Defaults to False.
+
+        Returns:
+            str: batch password
+        """
+        return self.__passwd
+
+    def __manager(self, bucket: str | None) -> GCPCloudStorage:
+        """Get the manager of a bucket sharing the batch client
+
+        Args:
+            bucket (str | None): bucket name or None for the batch bucket
+
+        Returns:
+            GCPCloudStorage: bucket manager
+        """
+        if not bucket:
+            return self
+        if bucket not in self.__managers:
+            self.__managers[bucket] = self.for_bucket(bucket)
+        return self.__managers[bucket]
+
+    @staticmethod
+    def load_manifest(manifest_path: str) -> list:
+        """Load the operations of a manifest. Lines that are not JSON objects become operations that fail with the
+        reason. Operation ids default to the line number
+
+        Args:
+            manifest_path (str): JSON lines manifest, - for stdin
+
+        Raises:
+            OSError: if the manifest cannot be read
+
+        Returns:
+            list: (operation id, operation dict) tuples in manifest order
+        """
+        if manifest_path == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            lines = Path(manifest_path).read_text().splitlines()
+        operations = []
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                operation = json.loads(line)
+                if not isinstance(operation, dict):
+                    raise ValueError('not a JSON object')
+            except ValueError as error:
+                operation = {'op': '', 'invalid': f'Invalid manifest line {number}: {error}'}
+            operations.append((str(operation.get('id', number)), operation))
+        return operations
+
+    @staticmethod
+    def completed_ids(results_path: str) -> set:
+        """Get the ids of the operations recorded as successful in a results file. A partly written last line
+        (after a crash) is ignored
+
+        Args:
+            results_path (str): JSON lines results file
+
+        Returns:
+            set: operation ids
+        """
+        done = set()
+        try:
+            with open(results_path, 'r') as file:
+                for line in file:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(result, dict) and result.get('status') == 'ok':
+                        done.add(str(result.get('id')))
+        except FileNotFoundError:
+            pass
+        return done
+
+    @staticmethod
+    def __ends_partly(results_path: str) -> bool:
+        """Check if a results file ends with a partly written line, as a crash can leave it
+
+        Args:
+            results_path (str): JSON lines results file
+
+        Returns:
+            bool: True if the file does not end with a newline
+        """
+        try:
+            with open(results_path, 'rb') as file:
+                if file.seek(0, 2) == 0:
+                    return False
+                file.seek(-1, 2)
+                return file.read(1) != b'\n'
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def __execute(manager: GCPCloudStorage, operation: dict) -> tuple:
+        """Run one operation with the storage method of the matching command
+
+        Args:
+            manager (GCPCloudStorage): manager of the operation bucket
+            operation (dict): manifest operation
+
+        Raises:
+            ValueError: if the operation or its options are invalid
+
+        Returns:
+            tuple: (success, bytes transferred, extra result fields)
+        """
+        if operation.get('invalid'):
+            raise ValueError(operation['invalid'])
+        kind = operation.get('op')
+        name = operation.get('name', '')
+        if kind not in OPERATIONS:
+            raise ValueError(f'Unknown operation: {kind}. Use one of {", ".join(OPERATIONS)}')
+        if not name and not (kind == 'get' and operation.get('list')):
+            raise ValueError(f'{kind} needs a name')
+        passwd = bool(operation.get('password'))
+        if kind == 'create':
+            options = (passwd, None, operation.get('compress'), operation.get('compressLevel'))
+            skip_unchanged = bool(operation.get('skipUnchanged'))
+            if operation.get('fromFile'):
+                size = Path(operation['fromFile']).stat().st_size
+                return manager.upload_file(operation['fromFile'], name, *options,
+                                           skip_unchanged=skip_unchanged), size, {}
+            if isinstance(operation.get('str'), str):
+                return manager.upload_data(operation['str'], name, *options,
+                                           skip_unchanged=skip_unchanged), len(operation['str'].encode()), {}
+            raise ValueError('create needs fromFile or str')
+        if kind == 'info' or (kind == 'get' and operation.get('info')):
+            info = next(manager.get_objects_info([name], workers=1), {'error': 'info request failed'})
+            return 'error' not in info, 0, {'info': info}
+        if kind == 'get':
+            if operation.get('list'):
+                return True, 0, {'objects': list(manager.get_bucket_folder_files(name))}
+            if not operation.get('toFile'):
+                raise ValueError('get needs toFile, info or list')
+            if manager.download_object_to_file(name, operation['toFile'], passwd):
+                return True, Path(operation['toFile']).stat().st_size, {}
+            return False, 0, {}
+        if not operation.get('force'):
+            raise ValueError('delete needs "force": true in a batch, operations never prompt')
+        return manager.delete_object(name, True), 0, {}
+
+    def __run_operation(self, manager: GCPCloudStorage, operation_id: str, operation: dict) -> dict:
+        """Run one operation and build its result line
+
+        Returns:
+            dict: result with id, op, name, bucket, status, seconds, bytes and error or extra fields
+        """
+        start = perf_counter()
+        result = {'id': operation_id, 'op': operation.get('op'), 'name': operation.get('name', ''),
+                  'bucket': operation.get('bucket') or self.bucket}
+        try:
+            with scheduler.slot(operation.get('priority', 'bulk')):
+                success, size, extra = self.__execute(manager, operation)
+            result.update(status='ok' if success else 'failed', bytes=size if success else 0, **extra)
+        except Exception as error:
+            result.update(status='failed', bytes=0, error=f'{error.__class__.__name__}: {error}')
+        result['seconds'] = round(perf_counter() - start, 6)
+        return result
+
+    @instrument()
+    def run(self, manifest_path: str, results_path: str, resume: bool = False) -> bool:
+        """Run a manifest and write one result line per operation as operations complete. At most two operations
+        per worker are in flight. Operations on the same bucket and name run in manifest order, an operation waits
+        for the previous one on its object to finish. With resume, operations recorded as ok in the results file
+        are skipped and new results are appended, so a crashed batch continues where it stopped
+
+        Args:
+            manifest_path (str): JSON lines manifest, - for stdin
+            results_path (str): JSON lines results file
+            resume (bool, optional): skip operations completed in the results file. Defaults to False.
+
+        Returns:
+            bool: True if every operation succeeded, False otherwise
+        """
+        try:
+            operations = self.load_manifest(manifest_path)
+        except OSError:
+            self.log.exception(f'Failed to load manifest {manifest_path}')
+            return False
+        completed = self.completed_ids(results_path) if resume else set()
+        operations = [(key, operation) for key, operation in operations if key not in completed]
+        if any(operation.get('password') for _, operation in operations):
+            self.__passwd = super()._prompt_for_passwd(True)
+        summary = LogSummary(self.log, 'Ran')
+        try:
+            partial = resume and self.__ends_partly(results_path)
+            with open(results_path, 'a' if resume else 'w') as results:
+                if partial:
+                    results.write('\n')
+                self.__schedule(operations, results, summary)
+        except Exception:
+            self.log.exception(f'Failed to run batch {manifest_path}')
+            return False
+        counts = summary.finish(f'from {manifest_path}, {len(completed)} completed before')
+        return counts['failed'] == 0
+
+    def __schedule(self, operations: list, results, summary: LogSummary):
+        """Submit the operations to the worker pool and write their results as they complete
+
+        Args:
+            operations (list): (operation id, operation dict) tuples
+            results (TextIO): results file
+            summary (LogSummary): batch summary
+        """
+        pending: dict[Future, tuple] = {}
+
+        def collect():
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                result = future.result()
+                results.write(json.dumps(result, default=str) + '\n')
+                results.flush()
+                summary.add(f'{result["op"]} {result["bucket"]}/{result["name"]}: {result["status"]}',
+                            result['bytes'], 'done' if result['status'] == 'ok' else 'failed')
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='gstorage-batch') as pool:
+            for key, operation in operations:
+                manager = self.__manager(operation.get('bucket'))
+                target = (operation.get('bucket') or '', operation.get('name', ''))
+                while pending and (len(pending) >= self.workers * 2 or target in pending.values()):
+                    collect()
+                pending[pool.submit(self.__run_operation, manager, key, operation)] = target
+            while pending:
+                collect()
@@ -0,0 +1,128 @@
+import sys
+import threading
+from contextlib import contextmanager
+from os import environ
+from time import perf_counter
+
+from gcp_storage.metrics import metrics
+
+
+class BudgetClosed(Exception):
+    """Raised to threads waiting on a closed ByteBudget"""
+
+
+class ByteBudget():
+    def __init__(self, limit: int, name: str = ''):
+        """Byte budget shared between threads for backpressure. Producers wait for room before taking more work
+        and charge the bytes they hold, consumers release them once the bytes are handed on
+
+        Args:
+            limit (int): budget in bytes
+            name (str, optional): metric name prefix, a named budget publishes NAME_bytes and NAME_peak_bytes
+                gauges and counts NAME_wait_seconds. Defaults to '' (no metrics).
+        """
+        self.limit = max(1, limit)
+        self.name = name
+        self.used = 0
+        self.peak = 0
+        self.__closed = False
+        self.__condition = threading.Condition()
+        self.__local = threading.local()
+
+    def acquire(self, nbytes: int):
+        """Wait until nbytes fit in the budget and charge them. A request larger than the whole budget is admitted
+        once nothing else is charged, so it cannot wait forever
+
+        Args:
+            nbytes (int): bytes to charge, 0 to only wait until the budget is not exhausted
+
+        Raises:
+            BudgetClosed: if the budget was closed while waiting
+        """
+        with self.__condition:
+            if not self.__closed and not self.__fits(nbytes):
+                started = perf_counter()
+                while not self.__closed and not self.__fits(nbytes):
+                    self.__condition.wait()
+                if self.name:
+                    metrics.inc(f'{self.name}_wait_seconds', perf_counter() - started)
+            if self.__closed:
+                raise BudgetClosed()
+            self.__charge(nbytes)
+
+    def __fits(self, nbytes: int) -> bool:
+        if not self.used:
+            return True
+        return self.used + nbytes <= self.limit if nbytes else self.used < self.limit
+
+    def charge(self, nbytes: int):
+        """Charge bytes without waiting, for data whose size is only known after it arrived
+
+        Args:
+            nbytes (int): bytes to charge
+        """
+        with self.__condition:
+            self.__charge(nbytes)
+
+    def __charge(self, nbytes: int):
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+        self.__report()
+
+    def release(self, nbytes: int):
+        """Return bytes to the budget and wake waiting threads
+
+        Args:
+            nbytes (int): bytes to release
+        """
+        with self.__condition:
+            self.used = max(0, self.used - nbytes)
+            self.__report()
+            self.__condition.notify_all()
+
+    def __report(self):
+        if self.name and metrics.enabled:
+            metrics.set_gauge(f'{self.name}_bytes', self.used)
+            metrics.max_gauge(f'{self.name}_peak_bytes', self.used)
+
+    @contextmanager
+    def hold(self, nbytes: int):
+        """Context manager holding nbytes of the budget for the enclosed block. The bytes are acquired at once, so
+        a transfer never waits while holding part of its buffers. A thread already holding bytes is charged without
+        waiting, so nested stages of one transfer never wait on the transfer itself
+
+        Args:
+            nbytes (int): bytes to hold
+
+        Yields:
+            int: bytes held
+        """
+        nbytes = max(0, nbytes)
+        depth = getattr(self.__local, 'depth', 0)
+        if depth:
+            self.charge(nbytes)
+        else:
+            self.acquire(nbytes)
+        self.__local.depth = depth + 1
+        try:
+            yield nbytes
+        finally:
+            self.__local.depth = depth
+            self.release(nbytes)
+
+    def close(self):
+        """Wake all waiting threads with BudgetClosed, for example when the consumer stopped early"""
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+
+def _env_budget() -> int:
+    try:
+        limit = float(environ.get('GSTORAGE_MEMORY_BUDGET_MB', 512))
+    except ValueError:
+        limit = 512
+    return int(limit * 1024 * 1024) if limit > 0 else sys.maxsize
+
+
+memory_budget = ByteBudget(_env_budget(), 'memory_budget')
@@ -0,0 +1,216 @@
+import base64
+import struct
+from hashlib import md5 as md5_hash
+from os import environ
+
+import google_crc32c
+
+
+CHECKSUM_READ_SIZE = 4 * 1024 * 1024
+SOURCE_CRC32C_METADATA_KEY = 'gstorage-source-crc32c'
+SOURCE_MD5_METADATA_KEY = 'gstorage-source-md5'
+CRC32C_POLYNOMIAL = 0x82F63B78
+
+
+class ChecksumMismatch(ValueError):
+    """Raised when transferred data does not match the checksum of the object"""
+
+
+def encode_crc32c(value: int) -> str:
+    """Encode a crc32c value the way Cloud Storage reports it (base64 of the big-endian bytes)
+
+    Args:
+        value (int): crc32c value
+
+    Returns:
+        str: encoded checksum
+    """
+    return base64.b64encode(struct.pack('>I', value)).decode()
+
+
+def data_crc32c(data: bytes) -> str:
+    """Get the encoded crc32c of in memory data
+
+    Args:
+        data (bytes): data to checksum
+
+    Returns:
+        str: encoded checksum
+    """
+    return encode_crc32c(google_crc32c.value(data))
+
+
+def file_crc32c(file_path: str, read_size: int = CHECKSUM_READ_SIZE) -> str:
+    """Get the encoded crc32c of a file. The file is read read_size bytes at a time and checksummed by the C
+    extension, so memory stays at one chunk whatever the file size
+
+    Args:
+        file_path (str): file to checksum
+        read_size (int, optional): read size. Defaults to 4MB.
+
+    Returns:
+        str: encoded checksum
+    """
+    checksum = google_crc32c.Checksum()
+    with open(file_path, 'rb', buffering=0) as file:
+        for chunk in iter(lambda: file.read(read_size), b''):
+            checksum.update(chunk)
+    return encode_crc32c(int.from_bytes(checksum.digest(), 'big'))
+
+
+def _gf2_times(matrix: list, vector: int) -> int:
+    total = 0
+    for row in matrix:
+        if not vector:
+            break
+        if vector & 1:
+            total ^= row
+        vector >>= 1
+    return total
+
+
+def combine_crc32c(first: int, second: int, second_length: int) -> int:
+    """Get the crc32c of two concatenated pieces of data from the crc32c of each piece, the way zlib combines crc32
+    values, so the checksums of slices transferred in parallel give the checksum of the whole object
+
+    Args:
+        first (int): crc32c of the first piece
+        second (int): crc32c of the second piece
+        second_length (int): size of the second piece in bytes
+
+    Returns:
+        int: crc32c of the concatenation
+    """
+    if second_length <= 0:
+        return first
+    odd = [CRC32C_POLYNOMIAL] + [1 << bit for bit in range(31)]
+    even = [_gf2_times(odd, row) for row in odd]
+    odd = [_gf2_times(even, row) for row in even]
+    while second_length:
+        even = [_gf2_times(odd, row) for row in odd]
+        if second_length & 1:
+            first = _gf2_times(even, first)
+        second_length >>= 1
+        if not second_length:
+            break
+        odd = [_gf2_times(even, row) for row in even]
+        if second_length & 1:
+            first = _gf2_times(odd, first)
+        second_length >>= 1
+    return first ^ second
+
+
+class StreamChecksum():
+    def __init__(self, md5: bool | None = None):
+        """Incremental crc32c and optional md5 of a stream, updated chunk by chunk as the data flows through a
+        transfer so no second pass over the data is needed. It is also a pass-through transform stage, so it can
+        sit at either end of a stage chain to checksum the plaintext or the stored bytes
+
+        Args:
+            md5 (bool | None, optional): also compute the md5. Defaults to None (GSTORAGE_CHECKSUM_MD5 set).
+        """
+        if md5 is None:
+            md5 = environ.get('GSTORAGE_CHECKSUM_MD5', '').lower() in ('1', 'true', 'yes', 'on')
+        self.bytes = 0
+        self.__crc32c = google_crc32c.Checksum()
+        self.__md5 = md5_hash(usedforsecurity=False) if md5 else None
+
+    def update(self, data: bytes) -> bytes:
+        """Add a chunk to the checksums. Bytes chunks are hashed in place, without a copy
+
+        Args:
+            data (bytes | bytearray | memoryview): chunk
+
+        Returns:
+            bytes: the chunk unchanged
+        """
+        with memoryview(data) as view:
+            if self.__md5 is not None:
+                self.__md5.update(view)
+            # The crc32c extension only takes bytes objects, other buffers are copied for it
+            self.__crc32c.update(data if isinstance(data, bytes) else view.tobytes())
+            self.bytes += view.nbytes
+        return data
+
+    def flush(self) -> bytes:
+        """The checksum stage keeps no buffered data
+
+        Returns:
+            bytes: empty bytes
+        """
+        return b''
+
+    @property
+    def value(self) -> int:
+        return int.from_bytes(self.__crc32c.digest(), 'big')
+
+    @property
+    def crc32c(self) -> str:
+        return encode_crc32c(self.value)
+
+    @property
+    def md5(self) -> str:
+        """Get the base64 md5 the way Cloud Storage reports it
+
+        Returns:
+            str: encoded md5 or '' if md5 is not computed
+        """
+        return base64.b64encode(self.__md5.digest()).decode() if self.__md5 is not None else ''
+
+    def metadata(self) -> dict:
+        """Get the custom metadata recording the checksums as the source checksums of an object
+
+        Returns:
+            dict: metadata key to encoded checksum
+        """
+        metadata = {SOURCE_CRC32C_METADATA_KEY: self.crc32c}
+        if self.md5:
+            metadata[SOURCE_MD5_METADATA_KEY] = self.md5
+        return metadata
+
+    def verify(self, what: str, crc32c: str | None, md5: str | None = None):
+        """Check the checksums against expected values. Missing expected values are not checked
+
+        Args:
+            what (str): description of the data for the error message
+            crc32c (str | None): expected encoded crc32c
+            md5 (str | None, optional): expected base64 md5. Defaults to None.
+
+        Raises:
+            ChecksumMismatch: if a checksum does not match
+        """
+        if crc32c and crc32c != self.crc32c:
+            raise ChecksumMismatch(f'{what} crc32c mismatch: expected {crc32c}, got {self.crc32c}')
+        if md5 and self.md5 and md5 != self.md5:
+            raise ChecksumMismatch(f'{what} md5 mismatch: expected {md5}, got {self.md5}')
+
+    @staticmethod
+    def verify_slices(what: str, slices: list, crc32c: str | None):
+        """Check the checksums of consecutive slices transferred in parallel against the crc32c of the whole data
+
+        Args:
+            what (str): description of the data for the error message
+            slices (list): StreamChecksum of each slice in data order
+            crc32c (str | None): expected encoded crc32c of the whole data
+
+        Raises:
+            ChecksumMismatch: if the combined checksum does not match
+        """
+        value = slices[0].value if slices else 0
+        for checksum in slices[1:]:
+            value = combine_crc32c(value, checksum.value, checksum.bytes)
+        if crc32c and crc32c != encode_crc32c(value):
+            raise ChecksumMismatch(f'{what} crc32c mismatch: expected {crc32c}, got {encode_crc32c(value)}')
+
+    def verify_source(self, what: str, metadata: dict | None):
+        """Check the checksums against the source checksums recorded in object metadata, if there are any
+
+        Args:
+            what (str): description of the data for the error message
+            metadata (dict | None): custom object metadata
+
+        Raises:
+            ChecksumMismatch: if a checksum does not match
+        """
+        metadata = metadata or {}
+        self.verify(what, metadata.get(SOURCE_CRC32C_METADATA_KEY), metadata.get(SOURCE_MD5_METADATA_KEY))
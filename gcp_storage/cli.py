@@ -1,7 +1,26 @@
 from argparse import REMAINDER
+from typing import Callable
 
 from gcp_storage.arg_parser import ArgParser
 from gcp_storage.cloud_storage import GCPCloudStorage
+from gcp_storage.progress import ProgressBar
+
+
+def run_command(parse_func: Callable, args: dict) -> bool:
+    """Run a parsed command, wrapped in the profiler when --profile is set
+
+    Args:
+        parse_func (Callable): parse function of the command
+        args (dict): parsed arguments
+
+    Returns:
+        bool: result of the parse function
+    """
+    if not args.get('profile'):
+        return parse_func(args)
+    from gcp_storage.profiler import Profiler
+    with Profiler(args['profile']):
+        return parse_func(args)
 
 
 def parse_parent_args(args: dict):
@@ -13,10 +32,18 @@ def parse_parent_args(args: dict):
         return storage_get(args['get'])
     if args.get('delete'):
         return storage_delete(args['delete'])
+    if args.get('copy'):
+        return storage_copy(args['copy'])
     if args.get('serviceAccounts'):
         return storage_service_account(args['serviceAccounts'])
     if args.get('buckets'):
         return storage_buckets(args['buckets'])
+    if args.get('backup'):
+        return storage_backup(args['backup'])
+    if args.get('pack'):
+        return storage_pack(args['pack'])
+    if args.get('batch'):
+        return storage_batch(args['batch'])
     return True
 
 
@@ -51,9 +78,35 @@ def storage_parent():
             'short': 'd',
             'help': 'Delete a storage object (gstorage-delete)',
             'nargs': REMAINDER
-        }
+        },
+        'copy': {
+            'short': 'C',
+            'help': 'Copy or move objects server side (gstorage-copy)',
+            'nargs': REMAINDER
+        },
+        'backup': {
+            'short': 'B',
+            'help': 'Deduplicated backup commands (gstorage-backup)',
+            'nargs': REMAINDER
+        },
+        'pack': {
+            'short': 'p',
+            'help': 'Small file pack commands (gstorage-pack)',
+            'nargs': REMAINDER
+        },
+        'batch': {
+            'short': 'j',
+            'help': 'Run a JSON lines manifest of operations (gstorage-batch)',
+            'nargs': REMAINDER
+        },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
     }).set_arguments()
-    if not parse_parent_args(args):
+    if not run_command(parse_parent_args, args):
         exit(1)
     exit(0)
 
@@ -81,20 +134,42 @@ def storage_init(parent_args: list = None):
             'short': 'F',
             'help': 'Force action',
             'action': 'store_true',
-        }
+        },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
     }).set_arguments()
-    if not parse_init_args(args):
+    if not run_command(parse_init_args, args):
         exit(1)
     exit(0)
 
 
 def parse_create_args(args: dict):
+    progress = ProgressBar() if args.get('progress') else None
+    buckets = args['bucket']
+    if len(buckets) > 1:
+        storage = GCPCloudStorage(buckets[0], args['serviceAccount'])
+        if args.get('fromFile'):
+            return all(storage.upload_file_to_buckets(
+                args['fromFile'], args['name'], buckets, args['password'], progress, args.get('compress'),
+                args.get('compressLevel'), strategy=args['fanOut']).values())
+        if args.get('str'):
+            return all(storage.upload_data_to_buckets(
+                args['str'], args['name'], buckets, args['password'], args.get('compress'),
+                args.get('compressLevel')).values())
+        return True
     if args.get('fromFile'):
-        return GCPCloudStorage(args['bucket'], args['serviceAccount']).upload_file(
-            args['fromFile'], args['name'], args['password'])
+        return GCPCloudStorage(buckets[0], args['serviceAccount']).upload_file(
+            args['fromFile'], args['name'], args['password'], progress, args.get('compress'), args.get('compressLevel'),
+            skip_unchanged=args['skipUnchanged'], strategy=args['strategy'],
+            chunk_size=int((args.get('chunkSize') or 0) * 1024 * 1024), explain=args['explain'])
     if args.get('str'):
-        return GCPCloudStorage(args['bucket'], args['serviceAccount']).upload_data(
-            args['str'], args['name'], args['password'])
+        return GCPCloudStorage(buckets[0], args['serviceAccount']).upload_data(
+            args['str'], args['name'], args['password'], progress, args.get('compress'), args.get('compressLevel'),
+            args['skipUnchanged'])
     return True
 
 
@@ -124,18 +199,84 @@ def storage_create(parent_args: list = None):
             'help': 'Password to encrypt object',
             'action': 'store_true',
         },
+        'progress': {
+            'short': 'P',
+            'help': 'Show transfer progress (progress bar on a terminal, periodic log lines otherwise)',
+            'action': 'store_true',
+        },
+        'compress': {
+            'short': 'c',
+            'help': 'Compress the object while uploading (gzip, zstd or auto). Downloads decompress it '
+                    'transparently. Default CODEC: auto (zstd if installed, gzip otherwise)',
+            'nargs': '?',
+            'const': 'auto',
+        },
+        'compressLevel': {
+            'short': 'cl',
+            'help': 'Compression level. Default: 6 for gzip, 3 for zstd',
+            'type': int,
+        },
+        'skipUnchanged': {
+            'short': 'su',
+            'help': 'Skip the upload if the object already holds the same data (crc32c comparison) and only replace '
+                    'the compared object generation otherwise. Single bucket uploads only',
+            'action': 'store_true',
+        },
+        'strategy': {
+            'short': 'st',
+            'help': 'Upload strategy of --fromFile: single (one request, up to 8MB), resumable (chunked), composite '
+                    '(parallel parts composed into the object, not with --password or --compress) or auto (planned '
+                    'from the file size and the measured bandwidth and round trip time, composite only with '
+                    'GSTORAGE_COMPOSITE_UPLOADS=1). Default: auto',
+            'choices': ['auto', 'single', 'resumable', 'composite'],
+            'default': 'auto',
+        },
+        'chunkSize': {
+            'short': 'cs',
+            'help': 'Resumable chunk size in MB instead of the planned one (multiple of 0.25)',
+            'type': float,
+        },
+        'explain': {
+            'short': 'ex',
+            'help': 'Log the transfer plan of --fromFile: strategy, chunk size, parallel parts and the time estimate '
+                    'of each strategy',
+            'action': 'store_true',
+        },
         'bucket': {
             'short': 'b',
-            'help': 'Bucket name. Default: default',
-            'default': 'default',
-        }
+            'help': 'Bucket name. Several buckets upload the object to each of them, reading and transforming the '
+                    'source once. Default: default',
+            'nargs': '+',
+            'default': ['default'],
+        },
+        'fanOut': {
+            'short': 'fo',
+            'help': 'How to upload to several buckets: tee (parallel uploads of the same chunks), rewrite (upload to '
+                    'the first bucket and copy server side) or auto. Default: auto',
+            'choices': ['auto', 'tee', 'rewrite'],
+            'default': 'auto',
+        },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
     }).set_arguments()
-    if not parse_create_args(args):
+    if not run_command(parse_create_args, args):
         exit(1)
     exit(0)
 
 
 def parse_get_args(args: dict):
+    if args.get('infoFrom'):
+        return GCPCloudStorage(args['bucket'], args['serviceAccount']).export_objects_info(
+            args['infoFrom'], args.get('toFile', ''), workers=args['workers'])
+    if args.get('watch') is not None:
+        if not args.get('list') and not args.get('name'):
+            return GCPCloudStorage.display_error('--watch needs --name or --list')
+        return GCPCloudStorage(args['bucket'], args['serviceAccount']).display_watch(
+            args.get('name') or '', args['watch'], args['password'], bool(args.get('list')))
     if args.get('list'):
         return GCPCloudStorage(args['bucket'], args['serviceAccount']).display_bucket_folder_files(args.get('name'))
     if args.get('name'):
@@ -143,7 +284,8 @@ def parse_get_args(args: dict):
             return GCPCloudStorage(args['bucket'], args['serviceAccount']).display_object_info(args['name'])
         if args.get('toFile'):
             return GCPCloudStorage(args['bucket'], args['serviceAccount']).download_object_to_file(
-                args['name'], args['toFile'], args['password'])
+                args['name'], args['toFile'], args['password'], ProgressBar() if args.get('progress') else None,
+                args['strategy'], args['explain'])
         return GCPCloudStorage(args['bucket'], args['serviceAccount']).display_downloaded_object(
             args['name'], args['password'])
     return True
@@ -169,23 +311,67 @@ def storage_get(parent_args: list = None):
             'help': 'Get object info',
             'action': 'store_true',
         },
+        'infoFrom': {
+            'short': 'if',
+            'help': 'Get the info of the objects named in this file (one per line, - for stdin) as JSON lines on '
+                    'stdout or in --toFile. Missing objects are reported with an error',
+        },
+        'workers': {
+            'short': 'w',
+            'help': 'Concurrent batch requests for --infoFrom. Default: 4',
+            'type': int,
+            'default': 4,
+        },
         'list': {
             'short': 'l',
             'help': 'List all objects in bucket. Use with --name (-n) to filter by prefix or folder name',
             'action': 'store_true',
         },
+        'watch': {
+            'short': 'W',
+            'help': 'Poll every WATCH seconds and show the object each time it changes, or with --list the changed '
+                    'objects as JSON lines, until Ctrl+C. Default WATCH: 5',
+            'type': float,
+            'nargs': '?',
+            'const': 5.0,
+        },
         'password': {
             'short': 'p',
             'help': 'Password to decrypt object data',
             'action': 'store_true',
         },
+        'progress': {
+            'short': 'P',
+            'help': 'Show download progress with --toFile (progress bar on a terminal, periodic log lines otherwise)',
+            'action': 'store_true',
+        },
+        'strategy': {
+            'short': 'st',
+            'help': 'Download strategy of --toFile: single (one stream), sliced (parallel ranged requests, not with '
+                    '--password or compressed objects) or auto (planned from the object size and the measured '
+                    'bandwidth and round trip time). Default: auto',
+            'choices': ['auto', 'single', 'sliced'],
+            'default': 'auto',
+        },
+        'explain': {
+            'short': 'ex',
+            'help': 'Log the transfer plan of --toFile: strategy, parallel slices and the time estimate of each '
+                    'strategy',
+            'action': 'store_true',
+        },
         'bucket': {
             'short': 'b',
             'help': 'Bucket name. Default: default',
             'default': 'default',
-        }
+        },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
     }).set_arguments()
-    if not parse_get_args(args):
+    if not run_command(parse_get_args, args):
         exit(1)
     exit(0)
 
@@ -216,9 +402,79 @@ def storage_delete(parent_args: list = None):
             'short': 'b',
             'help': 'Bucket name. Default: default',
             'default': 'default',
-        }
+        },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
     }).set_arguments()
-    if not parse_delete_args(args):
+    if not run_command(parse_delete_args, args):
+        exit(1)
+    exit(0)
+
+
+def parse_copy_args(args: dict):
+    if args.get('source') and args.get('destination') is not None:
+        storage = GCPCloudStorage(args['bucket'], args['serviceAccount'])
+        if args.get('move'):
+            return storage.move_prefix(args['source'], args['destination'], args['destBucket'], args['workers'],
+                                       not args.get('noClobber'))
+        return storage.copy_prefix(args['source'], args['destination'], args['destBucket'], args['workers'],
+                                   not args.get('noClobber'))
+    return True
+
+
+def storage_copy(parent_args: list = None):
+    args = ArgParser('GCP Cloud Storage Copy', parent_args, {
+        'serviceAccount': {
+            'short': 'sa',
+            'help': 'Service account name. Default: default',
+            'default': 'default',
+        },
+        'source': {
+            'short': 'n',
+            'help': 'Source prefix (folder with suffix "/") or object name',
+        },
+        'destination': {
+            'short': 'D',
+            'help': 'Destination prefix replacing the source prefix',
+        },
+        'destBucket': {
+            'short': 'db',
+            'help': 'Destination bucket name. Default: the source bucket',
+            'default': '',
+        },
+        'move': {
+            'short': 'm',
+            'help': 'Delete each source object after its copy is verified',
+            'action': 'store_true',
+        },
+        'noClobber': {
+            'short': 'nc',
+            'help': 'Skip objects that already exist at the destination',
+            'action': 'store_true',
+        },
+        'workers': {
+            'short': 'w',
+            'help': 'Concurrent server side copies. Default: 8',
+            'type': int,
+            'default': 8,
+        },
+        'bucket': {
+            'short': 'b',
+            'help': 'Bucket name. Default: default',
+            'default': 'default',
+        },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
+    }).set_arguments()
+    if not run_command(parse_copy_args, args):
         exit(1)
     exit(0)
 
@@ -254,8 +510,14 @@ def storage_service_account(parent_args: list = None):
             'short': 'R',
             'help': 'Remove service account by name',
         },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
     }).set_arguments()
-    if not parse_service_account_args(args):
+    if not run_command(parse_service_account_args, args):
         exit(1)
     exit(0)
 
@@ -285,7 +547,255 @@ def storage_buckets(parent_args: list = None):
             'short': 'R',
             'help': 'Remove used bucket name',
         },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
+    }).set_arguments()
+    if not run_command(parse_bucket_args, args):
+        exit(1)
+    exit(0)
+
+
+def parse_backup_args(args: dict):
+    from gcp_storage.dedup import DedupStore
+    store = DedupStore(args['bucket'], args['serviceAccount'], args['prefix'], args['workers'], args.get('compress'),
+                       args.get('compressLevel'))
+    progress = ProgressBar() if args.get('progress') else None
+    if args.get('list'):
+        return store.display_snapshots(args['name'])
+    if args.get('fromFile'):
+        return bool(store.backup(args['fromFile'], args['name'], progress))
+    if args.get('toFile'):
+        return store.restore(args['name'], args['toFile'], args.get('snapshot', ''), progress)
+    return True
+
+
+def storage_backup(parent_args: list = None):
+    args = ArgParser('GCP Cloud Storage Deduplicated Backups', parent_args, {
+        'serviceAccount': {
+            'short': 'sa',
+            'help': 'Service account name. Default: default',
+            'default': 'default',
+        },
+        'name': {
+            'short': 'n',
+            'help': 'Backup name. Every backup of a name is a new snapshot',
+            'required': True,
+        },
+        'fromFile': {
+            'short': 'ff',
+            'help': 'Back up this file (full path to file). Only chunks not already stored are uploaded',
+        },
+        'toFile': {
+            'short': 'tf',
+            'help': 'Restore a snapshot to this file',
+        },
+        'snapshot': {
+            'short': 'S',
+            'help': 'Snapshot id to restore. Default: latest snapshot',
+            'default': '',
+        },
+        'list': {
+            'short': 'l',
+            'help': 'List the snapshots of the backup name',
+            'action': 'store_true',
+        },
+        'workers': {
+            'short': 'w',
+            'help': 'Parallel chunk uploads/downloads. Default: 8',
+            'type': int,
+            'default': 8,
+        },
+        'compress': {
+            'short': 'c',
+            'help': 'Compress new chunks (gzip, zstd or auto). Default CODEC: auto',
+            'nargs': '?',
+            'const': 'auto',
+        },
+        'compressLevel': {
+            'short': 'cl',
+            'help': 'Compression level. Default: 6 for gzip, 3 for zstd',
+            'type': int,
+        },
+        'prefix': {
+            'short': 'pf',
+            'help': 'Object prefix of the backup store. Default: dedup',
+            'default': 'dedup',
+        },
+        'progress': {
+            'short': 'P',
+            'help': 'Show transfer progress (progress bar on a terminal, periodic log lines otherwise)',
+            'action': 'store_true',
+        },
+        'bucket': {
+            'short': 'b',
+            'help': 'Bucket name. Default: default',
+            'default': 'default',
+        },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
+    }).set_arguments()
+    if not run_command(parse_backup_args, args):
+        exit(1)
+    exit(0)
+
+
+def parse_pack_args(args: dict):
+    from gcp_storage.pack import PackStore
+    store = PackStore(args['bucket'], args['serviceAccount'], args['prefix'], args['packSize'] * 1024 * 1024)
+    if args.get('rebuild'):
+        return store.rebuild_index()
+    if args.get('add'):
+        return store.add_files(args['add'], args.get('baseDir', ''))
+    if args.get('delete'):
+        return store.delete_files(args['delete'])
+    if args.get('repack'):
+        return store.repack(args['minLive'])
+    if args.get('list') is not None:
+        return store.display_files(args['list'])
+    if args.get('name'):
+        if args.get('toFile'):
+            return store.read_to_file(args['name'], args['toFile'])
+        return store.display_file(args['name'])
+    return True
+
+
+def storage_pack(parent_args: list = None):
+    args = ArgParser('GCP Cloud Storage Small File Packs', parent_args, {
+        'serviceAccount': {
+            'short': 'sa',
+            'help': 'Service account name. Default: default',
+            'default': 'default',
+        },
+        'add': {
+            'short': 'a',
+            'help': 'Pack files or directories (recursively)',
+            'nargs': '+',
+        },
+        'baseDir': {
+            'short': 'bd',
+            'help': 'Directory the packed file names are relative to. Default: each added directory',
+            'default': '',
+        },
+        'name': {
+            'short': 'n',
+            'help': 'Packed file name to read',
+        },
+        'toFile': {
+            'short': 'tf',
+            'help': 'Save the packed file read with --name to this file',
+        },
+        'list': {
+            'short': 'l',
+            'help': 'List packed file names from the index, optionally filtered by PREFIX',
+            'nargs': '?',
+            'const': '',
+        },
+        'delete': {
+            'short': 'd',
+            'help': 'Remove packed files from the index (bytes are reclaimed by --repack)',
+            'nargs': '+',
+        },
+        'repack': {
+            'short': 'r',
+            'help': 'Compact packs with less than --minLive of their bytes still indexed',
+            'action': 'store_true',
+        },
+        'minLive': {
+            'short': 'ml',
+            'help': 'Live byte ratio below which --repack compacts a pack. Default: 0.5',
+            'type': float,
+            'default': 0.5,
+        },
+        'rebuild': {
+            'short': 'R',
+            'help': 'Rebuild the index from the pack footers',
+            'action': 'store_true',
+        },
+        'packSize': {
+            'short': 'ps',
+            'help': 'Target pack object size in MB. Default: 64',
+            'type': int,
+            'default': 64,
+        },
+        'prefix': {
+            'short': 'pf',
+            'help': 'Object prefix of the pack store. Default: packs',
+            'default': 'packs',
+        },
+        'bucket': {
+            'short': 'b',
+            'help': 'Bucket name. Default: default',
+            'default': 'default',
+        },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
+    }).set_arguments()
+    if not run_command(parse_pack_args, args):
+        exit(1)
+    exit(0)
+
+
+def parse_batch_args(args: dict):
+    if args.get('manifest'):
+        from gcp_storage.batch import BatchRunner
+        results = args.get('results')
+        if not results:
+            results = 'batch.results.jsonl' if args['manifest'] == '-' else f'{args["manifest"]}.results.jsonl'
+        return BatchRunner(args['bucket'], args['serviceAccount'], args['workers']).run(
+            args['manifest'], results, args.get('resume'))
+    return True
+
+
+def storage_batch(parent_args: list = None):
+    args = ArgParser('GCP Cloud Storage Batch', parent_args, {
+        'serviceAccount': {
+            'short': 'sa',
+            'help': 'Service account name. Default: default',
+            'default': 'default',
+        },
+        'manifest': {
+            'short': 'm',
+            'help': 'JSON lines manifest of create, get, info and delete operations (- for stdin)',
+        },
+        'results': {
+            'short': 'r',
+            'help': 'JSON lines results file. Default: MANIFEST.results.jsonl',
+        },
+        'resume': {
+            'short': 'R',
+            'help': 'Skip operations recorded as ok in the results file and append to it',
+            'action': 'store_true',
+        },
+        'workers': {
+            'short': 'w',
+            'help': 'Concurrent operations. Default: 8',
+            'type': int,
+            'default': 8,
+        },
+        'bucket': {
+            'short': 'b',
+            'help': 'Bucket of operations without a bucket option. Default: default',
+            'default': 'default',
+        },
+        'profile': {
+            'help': 'Profile the command. Writes PROFILE.pstats, PROFILE.folded (flamegraph stacks) and '
+                    'PROFILE.spans.json. Default PROFILE: gstorage-profile',
+            'nargs': '?',
+            'const': 'gstorage-profile',
+        },
     }).set_arguments()
-    if not parse_bucket_args(args):
+    if not run_command(parse_batch_args, args):
         exit(1)
     exit(0)
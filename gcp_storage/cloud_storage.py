@@ -1,60 +1,138 @@
 import json
 import pickle
+import sys
+import warnings
+from copy import copy
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import BytesIO
+from itertools import islice
 from pathlib import Path
 from getpass import getpass
-from os import remove
+from os import environ, fstat, remove
+from time import perf_counter
+from typing import BinaryIO, Callable, Iterable
+from uuid import uuid4
 
+from google.auth.credentials import AnonymousCredentials
 from google.cloud import storage
-from google.api_core.exceptions import NotFound
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
 from google.oauth2 import service_account
-
-from gcp_storage.encrypt import Cipher
+from requests.adapters import HTTPAdapter
+
+from gcp_storage.compress import (CODEC_CONTENT_TYPES, CODEC_METADATA_KEY, CONTENT_TYPE_METADATA_KEY, CompressStage,
+                                  DecompressStage, resolve_codec)
+from gcp_storage.budget import BudgetClosed, ByteBudget, memory_budget
+from gcp_storage.checksum import (SOURCE_CRC32C_METADATA_KEY, ChecksumMismatch, StreamChecksum, data_crc32c,
+                                  file_crc32c)
+from gcp_storage.encrypt import Cipher, PasswdXorStage
 from gcp_storage.color import Color
-from gcp_storage.logger import get_logger
+from gcp_storage.logger import LogSummary, get_logger
+from gcp_storage.metrics import instrument, metrics
+from gcp_storage.offload import offloader
+from gcp_storage.planner import MAX_CHUNK_SIZE, PlanError, TransferPlan, planner
+from gcp_storage.profiler import span
+from gcp_storage.scheduler import TransferSlot, scheduler
+from gcp_storage.state import StateStore, state_store
+from gcp_storage.token_cache import TokenCache, TokenRefresher
+from gcp_storage.watch import Watcher
+from gcp_storage.progress import make_progress
+from gcp_storage.streams import (ChunkReader, ChunkWriter, FileSlice, MappedReader, MemoryWriter, QueueSource,
+                                 RangeReader, TransformReader, TransformWriter, apply_stages)
+
+
+TRANSFORM_WINDOW_SIZE = 16 * 1024 * 1024
+RESUMABLE_CHUNK_ALIGNMENT = 256 * 1024
+MULTIPART_MAX_SIZE = 8 * 1024 * 1024
+FAN_OUT_TEE_MAX_SIZE = 256 * 1024 * 1024
+PREFIX_WATCH_FIELDS = 'items(name,generation,updated,size),nextPageToken'
+PLANNER_SETTING = 'transfer_planner'
 
 
 class GCPCloudStorage():
-    def __init__(self, bucket: str = 'default', service_account: str = 'default', set_used_bucket: bool = True):
+    def __init__(self, bucket: str = 'default', service_account: str = 'default', set_used_bucket: bool = True,
+                 priority: str = 'normal'):
         """GCP Cloud Storage manager
 
         Args:
             bucket (str, optional): bucket name to use. Defaults to 'default' and will pull the default bucket name.
             service_account (str, optional): service account to use. Defaults to 'default' and will pull default SA.
             set_used_bucket (bool, optional): option to add bucket to used bucket tracker. Defaults to True.
+            priority (str, optional): transfer scheduler class of the manager transfers (interactive, normal or
+                bulk). Small reads of interactive and normal managers take the fast lane. Defaults to 'normal'.
         """
         self.log = get_logger('gcp-storage')
         self.service_account = service_account
+        self.priority = scheduler.classify(priority)
         self.__bucket = bucket
         self.__client: storage.Client | None = None
         self.__cipher: Cipher | None = None
+        self.__pool_size = 0
+        self.__token_refresher: TokenRefresher | None = None
         if set_used_bucket and bucket != 'default':
             self._add_bucket_to_used_buckets(bucket)
 
+    @property
+    def state(self) -> StateStore:
+        """Get the local state store holding the default service account and bucket, the used buckets and the
+        service account registry
+
+        Returns:
+            StateStore: state store shared by the process
+        """
+        return state_store()
+
+    @property
+    def default_sa_name(self) -> str:
+        """Get the default service account name, kept in the state store
+
+        Returns:
+            str: default service account name or empty string if not set
+        """
+        return self.state.get_setting('default_sa')
+
+    @property
+    def default_bucket_name(self) -> str:
+        """Get the default bucket name, kept in the state store
+
+        Returns:
+            str: default bucket name or empty string if not set
+        """
+        return self.state.get_setting('default_bucket')
+
     @property
     def default_sa(self) -> str:
-        """Get the default service account file path
+        """Deprecated: the default service account is kept in the state store, use default_sa_name. Get the default
+        service account file path of older versions, which is only read to import it
 
         Returns:
             str: default service account file path
         """
+        warnings.warn('default_sa is deprecated, the default service account is kept in the state store, use '
+                      'default_sa_name', DeprecationWarning, stacklevel=2)
         return f'{Path(__file__).parent}/gcp_env/default_sa'
 
     @property
     def default_bucket(self) -> str:
-        """Default bucket file path
+        """Deprecated: the default bucket is kept in the state store, use default_bucket_name. Get the default bucket
+        file path of older versions, which is only read to import it
 
         Returns:
             str: default bucket file path
         """
+        warnings.warn('default_bucket is deprecated, the default bucket is kept in the state store, use '
+                      'default_bucket_name', DeprecationWarning, stacklevel=2)
         return f'{Path(__file__).parent}/gcp_env/default_bucket'
 
     @property
     def used_buckets_file(self) -> str:
-        """Get the used buckets file path
+        """Deprecated: the used buckets are kept in the state store, read them with state.used_buckets(). Get the
+        used buckets file path of older versions, which is only read to import it
 
         Returns:
             str: used buckets file path
         """
+        warnings.warn('used_buckets_file is deprecated, the used buckets are kept in the state store, use '
+                      'state.used_buckets()', DeprecationWarning, stacklevel=2)
         return f'{Path(__file__).parent}/gcp_env/.used_buckets'
 
     @property
@@ -98,27 +176,54 @@ class GCPCloudStorage():
             service_account.Credentials | None: service account credentials object or None on failure
         """
         try:
-            with open(self.sa_file, 'rb') as file:
-                __creds: dict = pickle.loads(self.cipher.decrypt(file.read(), self.cipher.load_key()))
-            return service_account.Credentials.from_service_account_info(__creds)
+            with span('creds'):
+                with open(self.sa_file, 'rb') as file:
+                    __creds: dict = pickle.loads(self.cipher.decrypt(file.read(), self.cipher.load_key()))
+                return service_account.Credentials.from_service_account_info(__creds)
         except Exception:
             self.log.exception('Failed to load credentials')
         return None
 
     @property
     def client(self) -> storage.Client | None:
-        """Get the storage manager client object
+        """Get the storage manager client object. When STORAGE_EMULATOR_HOST is set the client talks to that
+        emulator with anonymous credentials instead of loading the service account. Otherwise a valid access token
+        cached by an earlier process is reused instead of a token exchange, and a background thread refreshes the
+        token ahead of expiry
 
         Returns:
             storage.Client | None: storage manager client object or None on failure
         """
         if self.__client is None:
             try:
-                self.__client = storage.Client(credentials=self.creds)
+                with span('client'):
+                    if environ.get('STORAGE_EMULATOR_HOST'):
+                        self.__client = storage.Client(
+                            project=environ.get('GSTORAGE_EMULATOR_PROJECT', 'emulator'),
+                            credentials=AnonymousCredentials())
+                    else:
+                        self.__client = storage.Client(credentials=self.creds)
+                        self.__start_token_refresher(self.__client)
             except Exception:
                 self.log.exception('Failed to load cloud storage client')
         return self.__client
 
+    def __start_token_refresher(self, client: storage.Client):
+        """Load or fetch the access token of the client credentials and start refreshing it in the background. On
+        failure the client fetches the token on its first request as usual
+
+        Args:
+            client (storage.Client): client with service account credentials
+        """
+        try:
+            with span('token'):
+                cache = TokenCache(self.state, self.cipher, self.service_account)
+                self.__token_refresher = TokenRefresher(client._credentials, cache, self.log)
+                self.__token_refresher.ensure_token()
+                self.__token_refresher.start()
+        except Exception as error:
+            self.log.warning(f'Failed to prepare access token: {error}')
+
     @staticmethod
     def display_success(msg: str) -> bool:
         """Display a success message to console and return True
@@ -152,8 +257,10 @@ class GCPCloudStorage():
             str: default service account name or empty string if failed
         """
         try:
-            with open(self.default_sa, 'r') as file:
-                return file.read().strip()
+            default = self.state.get_setting('default_sa')
+            if default:
+                return default
+            self.log.error('No default service account set')
         except Exception:
             self.log.exception('Failed to load default service account')
         return ''
@@ -165,66 +272,461 @@ class GCPCloudStorage():
             str: default bucket name or empty string if failed
         """
         try:
-            with open(self.default_bucket, 'r') as file:
-                return file.read().strip()
+            default = self.state.get_setting('default_bucket')
+            if default:
+                return default
+            self.log.error('No default bucket set')
         except Exception:
-            self.log.exception('Failed to load default service account')
+            self.log.exception('Failed to load default bucket')
         return ''
 
-    def __upload_from_raw(self, data: str | bytes, bucket_path: str, content_type: str = 'text/plain') -> bool:
-        """Upload provided data to bucket path
+    def __upload_from_raw(self, data: str | bytes, bucket_path: str, content_type: str = 'text/plain',
+                          progress: Callable | None = None, metadata: dict | None = None,
+                          generation: int | None = None) -> bool:
+        """Upload provided data to bucket path. The data and the request copy of it are held in the memory budget
+        while the upload runs
 
         Args:
             data (str | bytes): data to upload
             bucket_path (str): the path to save the data in the bucket
             content_type (str, optional): the content type tag. Defaults to 'text/plain'.
+            progress (Callable | None, optional): progress callback or Progress object. Defaults to None.
+            metadata (dict | None, optional): custom object metadata. Defaults to None.
+            generation (int | None, optional): only replace this object generation (0 to only create the object).
+                Defaults to None (no precondition).
 
         Returns:
             bool: True if successful, False otherwise
         """
         if isinstance(data, bytes) and content_type == 'text/plain':
             content_type = 'application/octet-stream'
+        if isinstance(data, str):
+            data = data.encode()
         blob = self.get_blob(bucket_path)
         if blob:
             try:
-                blob.upload_from_string(data, content_type=content_type)
+                tracker = make_progress(progress, len(data), bucket_path)
+                if metadata:
+                    blob.metadata = metadata
+                wire = StreamChecksum()
+                with scheduler.slot(self.priority), memory_budget.hold(2 * len(data)), span('transfer'):
+                    blob.upload_from_file(ChunkReader(BytesIO(data), tracker, wire), size=len(data),
+                                          content_type=content_type, if_generation_match=generation, checksum=None)
+                self.__verify_upload(blob, wire)
+                if tracker:
+                    tracker.finish()
                 self.log.info(f'Successfully uploaded data to {bucket_path}')
                 return True
+            except PreconditionFailed:
+                self.log.error(f'Failed to upload data to {bucket_path}: the object was changed by another writer')
+            except ChecksumMismatch as error:
+                self.log.error(f'Failed to upload data to {bucket_path}: {error}')
             except Exception:
                 self.log.exception(f'Failed to upload data to {bucket_path}')
         else:
             self.log.error(f'Failed to upload data to {bucket_path}')
         return False
 
-    def __upload_from_file(self, file_path: str, bucket_path: str, content_type: str = 'text/plain') -> bool:
-        """Upload file to bucket from file path
+    def __upload_from_file(self, file_path: str, bucket_path: str, content_type: str = 'text/plain',
+                           progress: Callable | None = None, stages: list | None = None,
+                           metadata: dict | None = None, window_size: int = TRANSFORM_WINDOW_SIZE,
+                           bucket_name: str = '', generation: int | None = None, strategy: str = 'auto',
+                           chunk_size: int = 0, explain: bool = False) -> bool:
+        """Upload file to bucket from file path with the strategy of the transfer planner. The file is read chunk
+        by chunk as the upload sends it, in one request, as a chunked resumable upload or as parallel parts composed
+        into the object. With transform stages (compression, encryption) the file is read through mmap one window at
+        a time and the transformed stream has no known size, so files over the multipart limit go up as a chunked
+        resumable upload with chunks of at most a window. Peak memory is a few windows whatever the file size
 
         Args:
             file_path (str): file path to upload
             bucket_path (str): the path to save the file in the bucket
             content_type (str, optional): the content type tag. Defaults to 'text/plain'.
+            progress (Callable | None, optional): progress callback or Progress object. Defaults to None.
+            stages (list | None, optional): transform stages to pass the file through. Defaults to None.
+            metadata (dict | None, optional): custom object metadata. Defaults to None.
+            window_size (int, optional): mmap window and resumable chunk size for transformed uploads.
+                Defaults to TRANSFORM_WINDOW_SIZE.
+            bucket_name (str, optional): bucket to use instead of the instance bucket. Defaults to ''.
+            generation (int | None, optional): only replace this object generation (0 to only create the object).
+                Defaults to None (no precondition).
+            strategy (str, optional): 'auto', 'single', 'resumable' or 'composite'. Defaults to 'auto'.
+            chunk_size (int, optional): resumable chunk size instead of the planned one. Defaults to 0.
+            explain (bool, optional): log the transfer plan. Defaults to False.
 
         Returns:
             bool: True if successful, False otherwise
         """
-        blob = self.get_blob(bucket_path)
+        blob = self.get_blob(bucket_path, bucket_name)
         if blob:
             try:
-                blob.upload_from_filename(file_path, content_type=content_type)
+                if metadata:
+                    blob.metadata = metadata
+                wire = StreamChecksum()
+                window = max(1, window_size // RESUMABLE_CHUNK_ALIGNMENT) * RESUMABLE_CHUNK_ALIGNMENT
+                with open(file_path, 'rb') as file, MappedReader(file, window) as source:
+                    size = fstat(file.fileno()).st_size
+                    plan = self.plan_upload(size, bool(stages), strategy, chunk_size, window)
+                    if explain:
+                        self.log.info(f'Transfer plan for {bucket_path}:\n{plan.explain()}')
+                    tracker = make_progress(progress, size, bucket_path)
+                    started = perf_counter()
+                    with scheduler.slot(self.priority), memory_budget.hold(self.__upload_memory(plan, bool(stages))), \
+                            span('transfer'):
+                        if plan.strategy == 'composite':
+                            self.__upload_composite(blob, file, plan, content_type, tracker, generation)
+                        elif stages and plan.strategy == 'single':
+                            data = TransformReader(source, [*stages, wire], tracker).read()
+                            blob.metadata = {**(metadata or {}), **self.__source_metadata(stages)}
+                            blob.upload_from_file(BytesIO(data), size=len(data), content_type=content_type,
+                                                  if_generation_match=generation, checksum=None)
+                        elif stages:
+                            blob.chunk_size = plan.chunk_size
+                            reader = TransformReader(source, offloader.stages([*stages, wire], size), tracker,
+                                                     rewind=plan.chunk_size)
+                            blob.upload_from_file(reader, content_type=content_type, if_generation_match=generation,
+                                                  checksum=None)
+                        else:
+                            blob.chunk_size = plan.chunk_size or None
+                            blob.upload_from_file(ChunkReader(file, tracker, wire), size=size,
+                                                  content_type=content_type, if_generation_match=generation,
+                                                  checksum=None)
+                    if plan.strategy != 'composite':
+                        self.__verify_upload(blob, wire, stages)
+                        self.__observe_transfer(size, perf_counter() - started)
+                if tracker:
+                    tracker.finish()
                 self.log.info(f'Successfully uploaded file {file_path} to {bucket_path}')
                 return True
+            except PreconditionFailed:
+                self.log.error(f'Failed to upload file to {bucket_path}: the object was changed by another writer')
+            except (ChecksumMismatch, PlanError) as error:
+                self.log.error(f'Failed to upload file to {bucket_path}: {error}')
             except Exception:
                 self.log.exception(f'Failed to upload file to {bucket_path}')
         else:
             self.log.error(f'Failed to upload file {file_path} to {bucket_path}')
         return False
 
-    def __download_object_to_file(self, bucket_path: str, destination_path: str) -> bool:
-        """Download file from bucket and save to destination path
+    def __upload_transform(self, content_type: str, passwd: bool, compress: str | None,
+                           level: int | None) -> tuple:
+        """Build the transform stages of an upload. Data is compressed first and then encrypted, as encrypted data
+        does not compress. The codec and original content type are recorded in the object metadata so downloads
+        can decompress transparently. Transformed uploads start with a checksum stage of the plaintext, recorded in
+        the object metadata so downloads can verify the decoded data
+
+        Args:
+            content_type (str): content type of the untransformed data
+            passwd (bool): True if the data should be encrypted
+            compress (str | None): compression codec ('gzip', 'zstd' or 'auto') or None
+            level (int | None): compression level or None for the codec default
+
+        Raises:
+            ValueError: if the codec is unknown or not installed
+
+        Returns:
+            tuple: (stages list, content type, metadata dict)
+        """
+        stages = []
+        metadata = {}
+        codec = resolve_codec(compress)
+        if codec:
+            stages.append(CompressStage(codec, level))
+            metadata = {CODEC_METADATA_KEY: codec, CONTENT_TYPE_METADATA_KEY: content_type}
+            content_type = CODEC_CONTENT_TYPES[codec]
+        if passwd:
+            stages.append(PasswdXorStage(self._prompt_for_passwd(True)))
+            content_type = 'application/octet-stream'
+        if stages:
+            stages.insert(0, StreamChecksum())
+        return stages, content_type, metadata
+
+    @staticmethod
+    def __source_metadata(stages: list | None) -> dict:
+        """Get the plaintext checksum metadata of a transformed upload once its source was read
+
+        Args:
+            stages (list | None): transform stages built by __upload_transform
+
+        Returns:
+            dict: source checksum metadata, empty if the upload is not transformed
+        """
+        if stages and isinstance(stages[0], StreamChecksum):
+            return stages[0].metadata()
+        return {}
+
+    def __verify_upload(self, blob: storage.Blob, wire: StreamChecksum, stages: list | None = None):
+        """Check the bytes sent against the checksums the service computed for the new object. Streamed transformed
+        uploads only know the plaintext checksums once the source was read, they are recorded with a metadata patch
+        unless the upload already sent them
+
+        Args:
+            blob (storage.Blob): uploaded blob
+            wire (StreamChecksum): checksum of the bytes sent
+            stages (list | None, optional): transform stages of the upload. Defaults to None.
+
+        Raises:
+            ChecksumMismatch: if the object checksums do not match the bytes sent
+        """
+        wire.verify(f'Uploaded object {blob.name}', blob.crc32c, blob.md5_hash)
+        recorded = self.__source_metadata(stages)
+        metadata = blob.metadata or {}
+        if any(metadata.get(key) != value for key, value in recorded.items()):
+            blob.metadata = {**metadata, **recorded}
+            blob.patch(if_metageneration_match=blob.metageneration)
+
+    def __compare_remote(self, bucket_path: str, checksum: str, content_type: str, metadata: dict,
+                         transformed: bool) -> tuple:
+        """Compare the crc32c of the source of an upload with the remote object. Plain uploads compare with the
+        object crc32c. Compressed or encrypted uploads compare with the source crc32c recorded in the metadata by
+        the previous upload, which must have used the same codec and content type
+
+        Args:
+            bucket_path (str): object path in the bucket
+            checksum (str): encoded crc32c of the source
+            content_type (str): content type of the upload
+            metadata (dict): metadata of the upload
+            transformed (bool): True if the upload is compressed or encrypted
+
+        Returns:
+            tuple: (True if the object is unchanged, generation of the object or 0 if there is none)
+        """
+        remote = self.client.bucket(self.bucket).get_blob(bucket_path)
+        if remote is None:
+            return False, 0
+        unchanged = remote.content_type == content_type
+        if transformed:
+            remote_metadata = remote.metadata or {}
+            unchanged = (unchanged and remote_metadata.get(SOURCE_CRC32C_METADATA_KEY) == checksum
+                         and remote_metadata.get(CODEC_METADATA_KEY) == metadata.get(CODEC_METADATA_KEY))
+        else:
+            unchanged = unchanged and remote.crc32c == checksum
+        return unchanged, remote.generation
+
+    def __skip_unchanged(self, source: str | bytes, bucket_path: str, content_type: str, metadata: dict,
+                         transformed: bool) -> tuple:
+        """Check if an upload can be skipped because the remote object is unchanged. The source crc32c is added to
+        the upload metadata for the next comparison
+
+        Args:
+            source (str | bytes): file path or data to upload
+            bucket_path (str): object path in the bucket
+            content_type (str): content type of the upload
+            metadata (dict): metadata of the upload, updated with the source crc32c
+            transformed (bool): True if the upload is compressed or encrypted
+
+        Returns:
+            tuple: (True to skip, generation precondition of the upload or None if the check failed)
+        """
+        name = source if isinstance(source, str) else 'data'
+        try:
+            checksum = file_crc32c(source) if isinstance(source, str) else data_crc32c(source)
+            metadata[SOURCE_CRC32C_METADATA_KEY] = checksum
+            unchanged, generation = self.__compare_remote(bucket_path, checksum, content_type, metadata, transformed)
+        except Exception:
+            self.log.exception(f'Failed to compare {name} with {bucket_path}')
+            return False, None
+        if unchanged:
+            metrics.inc('uploads_skipped_unchanged')
+            self.log.info(f'Skipped unchanged object {bucket_path}')
+        return unchanged, generation
+
+    def __observe_transfer(self, nbytes: int, seconds: float):
+        """Record the bandwidth of a transfer for the planner and keep the measurements for the next process
+
+        Args:
+            nbytes (int): bytes moved by one stream
+            seconds (float): transfer time
+        """
+        if not planner.observe_transfer(nbytes, seconds):
+            return None
+        try:
+            self.state.set_setting(PLANNER_SETTING, json.dumps(planner.measurements()))
+        except Exception as error:
+            self.log.debug(f'Failed to save transfer measurements: {error}')
+
+    @staticmethod
+    def __upload_memory(plan: TransferPlan, transformed: bool) -> int:
+        """Get the memory an upload buffers at once, held in the memory budget while it runs. Single request uploads
+        hold the data and the request body, resumable uploads the chunk being sent, plus the rewind history and
+        the transform output for compressed or encrypted data. The parts of composite uploads hold their own
+
+        Args:
+            plan (TransferPlan): upload plan
+            transformed (bool): the data is compressed or encrypted while it uploads
+
+        Returns:
+            int: bytes
+        """
+        if plan.strategy == 'composite':
+            return 0
+        if plan.strategy == 'single':
+            return 2 * plan.size
+        return (3 if transformed else 1) * min(plan.chunk_size, max(plan.size, 0))
+
+    def __upload_composite(self, blob: storage.Blob, file: BinaryIO, plan: TransferPlan, content_type: str,
+                           progress: Callable | None, generation: int | None):
+        """Upload the slices of a file in parallel as temporary part objects next to the destination and compose
+        them into it. Each part is verified against its own crc32c and the object against the combined crc32c of the
+        parts (composite objects have no md5). The parts are deleted whatever the outcome. The parts run under the
+        transfer slot of the upload, the bytes they send are added to the metrics of the calling thread
+
+        Args:
+            blob (storage.Blob): destination blob with its metadata set
+            file (BinaryIO): source file
+            plan (TransferPlan): composite upload plan
+            content_type (str): content type of the object
+            progress (Callable | None): progress of the upload
+            generation (int | None): only replace this object generation (0 to only create the object)
+
+        Raises:
+            ChecksumMismatch: if a part or the object does not match the data sent
+        """
+        slices = plan.slices()
+        token = uuid4().hex[:12]
+        parts = [blob.bucket.blob(f'{blob.name}.gstorage-part-{token}-{index:02d}') for index in range(len(slices))]
+        checksums = [StreamChecksum(md5=False) for _ in slices]
+        ticket = scheduler.current
+
+        def upload(index: int):
+            start, length = slices[index]
+            part = parts[index]
+            part.chunk_size = plan.chunk_size if length > MULTIPART_MAX_SIZE else None
+            started = perf_counter()
+            with scheduler.attach(ticket), memory_budget.hold(part.chunk_size or 2 * length):
+                part.upload_from_file(ChunkReader(FileSlice(file.fileno(), start, length), progress, checksums[index]),
+                                      size=length, content_type='application/octet-stream', if_generation_match=0,
+                                      checksum=None)
+            checksums[index].verify(f'Uploaded part {part.name}', part.crc32c)
+            self.__observe_transfer(length, perf_counter() - started)
+
+        try:
+            self._ensure_pool(len(parts))
+            try:
+                with ThreadPoolExecutor(len(parts), thread_name_prefix='gstorage-part') as pool:
+                    list(pool.map(upload, range(len(parts))))
+            finally:
+                metrics.add_bytes(sum(checksum.bytes for checksum in checksums))
+            blob.content_type = content_type
+            blob.compose(parts, if_generation_match=generation)
+        finally:
+            try:
+                blob.bucket.delete_blobs(parts, on_error=lambda part: None)
+            except Exception as error:
+                self.log.warning(f'Failed to delete the upload parts of {blob.name}: {error}')
+        StreamChecksum.verify_slices(f'Uploaded object {blob.name}', checksums, blob.crc32c)
+
+    def __download_sliced(self, blob: storage.Blob, sink: BinaryIO, plan: TransferPlan, progress: Callable | None):
+        """Download the slices of an object in parallel with ranged requests pinned to its generation, each written
+        in place into the file, and verify the combined crc32c of the slices. The slices run under the transfer slot
+        of the download, the bytes they receive are added to the metrics of the calling thread
+
+        Args:
+            blob (storage.Blob): blob with its metadata loaded
+            sink (BinaryIO): destination file
+            plan (TransferPlan): sliced download plan
+            progress (Callable | None): progress of the download
+
+        Raises:
+            ChecksumMismatch: if the data does not match the object crc32c
+        """
+        slices = plan.slices()
+        checksums = [StreamChecksum(md5=False) for _ in slices]
+        sink.truncate(plan.size)
+        ticket = scheduler.current
+
+        def fetch(index: int):
+            start, length = slices[index]
+            started = perf_counter()
+            with scheduler.attach(ticket):
+                blob.download_to_file(ChunkWriter(FileSlice(sink.fileno(), start, length), progress, checksums[index]),
+                                      start=start, end=start + length - 1, if_generation_match=blob.generation,
+                                      checksum=None)
+            self.__observe_transfer(length, perf_counter() - started)
+
+        self._ensure_pool(len(slices))
+        try:
+            with ThreadPoolExecutor(len(slices), thread_name_prefix='gstorage-slice') as pool:
+                list(pool.map(fetch, range(len(slices))))
+        finally:
+            metrics.add_bytes(sum(checksum.bytes for checksum in checksums))
+        StreamChecksum.verify_slices(f'Downloaded object {blob.name}', checksums, blob.crc32c)
+
+    def __download_to_stream(self, blob: storage.Blob, sink: BinaryIO, passwd: bool = False,
+                             progress: Callable | None = None, if_generation_not_match: int | None = None,
+                             strategy: str = '', explain: bool = False, in_memory: bool = False):
+        """Download a blob into a stream. The object metadata is loaded first for the codec and size, then the
+        response chunks are decrypted and decompressed as they arrive. Small objects take the fast lane of the
+        transfer scheduler. The received bytes are checksummed as they arrive and checked against the object, and
+        decoded data against the plaintext checksum recorded by the upload. With a strategy, files are downloaded
+        as planned by the transfer planner, in one stream or as parallel slices
+
+        Args:
+            blob (storage.Blob): blob to download
+            sink (BinaryIO): stream to write the data to
+            passwd (bool, optional): option to provide password for decrypt. Defaults to False.
+            progress (Callable | None, optional): progress callback or Progress object. Defaults to None.
+            if_generation_not_match (int | None, optional): raise NotModified from the metadata request, before any
+                data is sent, if the object still has this generation. Defaults to None.
+            strategy (str, optional): planner strategy ('auto', 'single' or 'sliced') for a file sink. Defaults to
+                '' (one stream, not planned).
+            explain (bool, optional): log the transfer plan. Defaults to False.
+            in_memory (bool, optional): the sink is an in-memory buffer, the object size is held in the memory budget
+                while it downloads. Defaults to False.
+
+        Raises:
+            ValueError: if the strategy is not possible for the object
+            ChecksumMismatch: if the received or decoded data does not match the object checksums
+        """
+        started = perf_counter()
+        blob.reload(if_generation_not_match=if_generation_not_match)
+        planner.observe_request(perf_counter() - started)
+        tracker = make_progress(progress, blob.size, blob.name)
+        stages = []
+        if passwd:
+            stages.append(PasswdXorStage(self._prompt_for_passwd(False)))
+        codec = (blob.metadata or {}).get(CODEC_METADATA_KEY)
+        if codec:
+            stages.append(DecompressStage(codec))
+        plan = self.plan_download(blob.size or 0, bool(stages), strategy) if strategy else None
+        if plan and explain:
+            self.log.info(f'Transfer plan for {blob.name}:\n{plan.explain()}')
+        wire = StreamChecksum()
+        source = StreamChecksum() if stages else None
+        started = perf_counter()
+        reserve = (blob.size or 0) if in_memory else 0
+        with scheduler.slot(self.priority, blob.size if blob.size is not None else -1), memory_budget.hold(reserve), \
+                span('transfer'):
+            if plan and plan.strategy == 'sliced':
+                self.__download_sliced(blob, sink, plan, tracker)
+            elif stages:
+                writer = TransformWriter(sink, offloader.stages([wire, *stages, source], blob.size or 0), tracker)
+                blob.download_to_file(writer, checksum=None)
+                writer.finish()
+            else:
+                blob.download_to_file(ChunkWriter(sink, tracker, wire), checksum=None)
+        if not plan or plan.strategy == 'single':
+            wire.verify(f'Downloaded object {blob.name}', blob.crc32c, blob.md5_hash)
+            self.__observe_transfer(blob.size or 0, perf_counter() - started)
+        if source is not None:
+            source.verify_source(f'Decoded object {blob.name}{" (wrong password?)" if passwd else ""}', blob.metadata)
+        if tracker:
+            tracker.finish()
+
+    def __download_object_to_file(self, bucket_path: str, destination_path: str, passwd: bool = False,
+                                  progress: Callable | None = None, strategy: str = 'auto',
+                                  explain: bool = False) -> bool:
+        """Download file from bucket and save to destination path. Response chunks are written to the file as they
+        arrive, from one stream or from parallel slices as planned by the transfer planner. A partially written file
+        is removed on failure
 
         Args:
             bucket_path (str): bucket path to file to download
             destination_path (str): save file to this path
+            passwd (bool, optional): option to provide password for decrypt. Defaults to False.
+            progress (Callable | None, optional): progress callback or Progress object. Defaults to None.
+            strategy (str, optional): 'auto', 'single' or 'sliced'. Defaults to 'auto'.
+            explain (bool, optional): log the transfer plan. Defaults to False.
 
         Returns:
             bool: True if successful, False otherwise
@@ -232,11 +734,17 @@ class GCPCloudStorage():
         blob = self.get_blob(bucket_path)
         if blob:
             try:
-                blob.download_to_filename(destination_path)
+                with open(destination_path, 'wb') as file:
+                    self.__download_to_stream(blob, file, passwd, progress, strategy=strategy, explain=explain)
                 self.log.info(f'Successfully downloaded object to file {destination_path}')
                 return True
-            except Exception:
-                self.log.exception(f'Failed to download file: {bucket_path}')
+            except Exception as error:
+                if isinstance(error, (ChecksumMismatch, PlanError)):
+                    self.log.error(f'Failed to download file: {bucket_path}: {error}')
+                else:
+                    self.log.exception(f'Failed to download file: {bucket_path}')
+                if Path(destination_path).exists():
+                    remove(destination_path)
         else:
             self.log.error(f'Failed to download file: {bucket_path}')
         return False
@@ -248,8 +756,7 @@ class GCPCloudStorage():
             list: list of used bucket names
         """
         try:
-            with open(self.used_buckets_file, 'r') as file:
-                return json.load(file)
+            return self.state.used_buckets()
         except Exception:
             self.log.exception('Failed to get used buckets')
         return []
@@ -297,12 +804,8 @@ class GCPCloudStorage():
         Returns:
             bool: True if successful, False otherwise
         """
-        used_buckets = self.__get_used_buckets()
         try:
-            if bucket_name not in used_buckets:
-                used_buckets.append(bucket_name)
-                with open(self.used_buckets_file, 'w') as file:
-                    json.dump(used_buckets, file)
+            self.state.add_used_bucket(bucket_name)
             return True
         except Exception:
             self.log.exception('Failed to add bucket to used buckets')
@@ -332,21 +835,44 @@ class GCPCloudStorage():
             self.log.error('Password prompt cancelled')
             exit(1)
 
-    def get_blob(self, blob_path: str) -> storage.Blob | None:
+    def for_bucket(self, bucket: str) -> 'GCPCloudStorage':
+        """Get a manager of the same class for another bucket sharing this client, its connection pool and token
+        refresher
+
+        Args:
+            bucket (str): bucket name, 'default' for the default bucket
+
+        Returns:
+            GCPCloudStorage: manager for the bucket
+        """
+        manager = copy(self)
+        manager.__bucket = bucket
+        manager.__client = self.client
+        return manager
+
+    @instrument()
+    def get_blob(self, blob_path: str, bucket_name: str = '') -> storage.Blob | None:
         """Get blob object from bucket
 
         Args:
             blob_path (str): bucket path to the blob
+            bucket_name (str, optional): bucket to use instead of the instance bucket. Defaults to ''.
 
         Returns:
             storage.Blob: the blob object or None if failed
         """
         try:
-            return self.client.get_bucket(self.bucket).blob(blob_path)
+            client = self.client
+            started = perf_counter()
+            with span('bucket_lookup'):
+                bucket = client.get_bucket(bucket_name or self.bucket)
+            planner.observe_request(perf_counter() - started)
+            return bucket.blob(blob_path)
         except Exception:
             self.log.exception('Failed to get blob object')
         return None
 
+    @instrument()
     def upload_data_as_json(self, data_obj: object, bucket_path: str) -> bool:
         """Upload data as json to bucket. This will convert the object to json string before uploading then
         set the content type to 'application/json' for the data upload
@@ -365,46 +891,410 @@ class GCPCloudStorage():
             return False
         return self.__upload_from_raw(data_str, bucket_path, 'application/json')
 
-    def upload_data(self, data: str, bucket_path: str, passwd: bool = False) -> bool:
-        """Upload data as text to bucket. This will set the content type to 'text/plain' for the data upload
+    @instrument()
+    def upload_data(self, data: str, bucket_path: str, passwd: bool = False, progress: Callable | None = None,
+                    compress: str | None = None, level: int | None = None, skip_unchanged: bool = False) -> bool:
+        """Upload data as text to bucket. This will set the content type to 'text/plain' for the data upload. With
+        skip_unchanged the upload is skipped when the object already holds the same data (see upload_file)
 
         Args:
             data (str): the string data to save as text file in the bucket
             bucket_path (str): the path to save the data in the bucket
             passwd (bool, optional): True if the data should be encrypted. Defaults to False.
+            progress (Callable | None, optional): progress callback or Progress object. Defaults to None.
+            compress (str | None, optional): compression codec ('gzip', 'zstd' or 'auto'). Defaults to None.
+            level (int | None, optional): compression level. Defaults to None (codec default).
+            skip_unchanged (bool, optional): skip the upload if the object holds the same data and otherwise only
+                replace the object generation that was compared. Defaults to False.
 
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if successful or skipped, False otherwise
         """
-        content_type = 'text/plain'
-        if passwd:
-            data: bytes = self.cipher.passwd_xor(data.encode(), self._prompt_for_passwd(True))
-            content_type = 'application/octet-stream'
-        return self.__upload_from_raw(data, bucket_path, content_type)
-
-    def upload_file(self, file_path: str, bucket_path: str, passwd: bool = False) -> bool:
-        """Upload text file to bucket. This will set the content type to 'text/plain' for the data upload
+        try:
+            stages, content_type, metadata = self.__upload_transform('text/plain', passwd, compress, level)
+        except ValueError as error:
+            self.log.error(str(error))
+            return False
+        generation = None
+        if skip_unchanged:
+            skip, generation = self.__skip_unchanged(data.encode(), bucket_path, content_type, metadata, bool(stages))
+            if skip or generation is None:
+                return skip
+        if stages:
+            payload = data.encode()
+            with memory_budget.hold(2 * len(payload)):
+                data: bytes = apply_stages(offloader.stages(stages, len(payload)), payload, final=True)
+            del payload
+            metadata.update(self.__source_metadata(stages))
+        return self.__upload_from_raw(data, bucket_path, content_type, progress, metadata, generation)
+
+    @instrument()
+    def upload_file(self, file_path: str, bucket_path: str, passwd: bool = False,
+                    progress: Callable | None = None, compress: str | None = None, level: int | None = None,
+                    window_size: int = TRANSFORM_WINDOW_SIZE, skip_unchanged: bool = False, strategy: str = 'auto',
+                    chunk_size: int = 0, explain: bool = False) -> bool:
+        """Upload text file to bucket. This will set the content type to 'text/plain' for the data upload. With
+        skip_unchanged the crc32c of the file is computed first and compared with the remote object (or, for
+        compressed and encrypted uploads, with the file crc32c recorded by the previous upload), and identical files
+        are not sent again. Changed files are uploaded with a generation precondition, so an object replaced by
+        another writer since the comparison is not overwritten. The upload strategy and chunk size are picked by
+        plan_upload() unless given
 
         Args:
             file_path (str): the file path to upload
             bucket_path (str): the path to save the file in the bucket
             passwd (bool, optional): True if the data should be encrypted. Defaults to False.
+            progress (Callable | None, optional): progress callback or Progress object called with the bytes done,
+                rates and ETA while the upload runs. Defaults to None.
+            compress (str | None, optional): compression codec ('gzip', 'zstd' or 'auto'). The file is compressed
+                chunk by chunk while it uploads. Defaults to None.
+            level (int | None, optional): compression level. Defaults to None (codec default).
+            window_size (int, optional): with passwd or compress the file is read through mmap windows of this size
+                and uploaded in chunks of this size, bounding peak memory to a few windows. Defaults to 16MB.
+            skip_unchanged (bool, optional): skip the upload if the object holds the same data and otherwise only
+                replace the object generation that was compared. Defaults to False.
+            strategy (str, optional): 'auto' (planned), 'single', 'resumable' or 'composite'. Defaults to 'auto'.
+            chunk_size (int, optional): resumable chunk size instead of the planned one. Defaults to 0.
+            explain (bool, optional): log the transfer plan and the estimates it was picked from. Defaults to False.
+
+        Returns:
+            bool: True if successful or skipped, False otherwise
+        """
+        content_type = 'application/json' if file_path.endswith('.json') else 'text/plain'
+        try:
+            stages, content_type, metadata = self.__upload_transform(content_type, passwd, compress, level)
+        except ValueError as error:
+            self.log.error(str(error))
+            return False
+        generation = None
+        if skip_unchanged:
+            skip, generation = self.__skip_unchanged(file_path, bucket_path, content_type, metadata, bool(stages))
+            if skip or generation is None:
+                return skip
+        return self.__upload_from_file(file_path, bucket_path, content_type, progress, stages, metadata, window_size,
+                                       generation=generation, strategy=strategy, chunk_size=chunk_size, explain=explain)
+
+    def __restore_planner(self):
+        """Load the transfer measurements of previous processes into the planner once"""
+        if planner.restored:
+            return None
+        try:
+            planner.restore(json.loads(self.state.get_setting(PLANNER_SETTING) or '{}'))
+        except Exception as error:
+            planner.restored = True
+            self.log.debug(f'Failed to load transfer measurements: {error}')
+
+    @instrument()
+    def plan_upload(self, size: int, transformed: bool = False, strategy: str = 'auto', chunk_size: int = 0,
+                    max_chunk_size: int = TRANSFORM_WINDOW_SIZE) -> TransferPlan:
+        """Plan a file upload: one request for small files, a chunked resumable upload, or parallel parts composed
+        into the object for large files that are not compressed or encrypted. The chunk size is about two seconds of
+        transfer at the bandwidth measured on recent transfers, which are kept in the local state for the next
+        process, and at most a quarter of the memory budget. 'auto' only picks composite uploads when
+        GSTORAGE_COMPOSITE_UPLOADS is set. GSTORAGE_PLAN_WORKERS sets the parallel parts (default 8)
+
+        Args:
+            size (int): file size in bytes
+            transformed (bool, optional): the file is compressed or encrypted while it uploads. Defaults to False.
+            strategy (str, optional): 'auto', 'single', 'resumable' or 'composite'. Defaults to 'auto'.
+            chunk_size (int, optional): resumable chunk size instead of the planned one. Defaults to 0.
+            max_chunk_size (int, optional): upper bound of the chunk size of transformed uploads, their memory
+                window. Defaults to TRANSFORM_WINDOW_SIZE.
+
+        Raises:
+            PlanError: if the strategy is unknown or not possible for the upload
+
+        Returns:
+            TransferPlan: upload plan
+        """
+        self.__restore_planner()
+        max_chunk_size = min(max_chunk_size if transformed else MAX_CHUNK_SIZE,
+                             max(RESUMABLE_CHUNK_ALIGNMENT, memory_budget.limit // 4))
+        return planner.plan_upload(size, transformed, strategy, chunk_size, max_chunk_size)
+
+    @instrument()
+    def plan_download(self, size: int, transformed: bool = False, strategy: str = 'auto') -> TransferPlan:
+        """Plan a file download: one stream, or parallel ranged requests for large objects that are not compressed
+        or encrypted, from the same measurements as plan_upload()
+
+        Args:
+            size (int): object size in bytes
+            transformed (bool, optional): the object is decrypted or decompressed while it downloads.
+                Defaults to False.
+            strategy (str, optional): 'auto', 'single' or 'sliced'. Defaults to 'auto'.
+
+        Raises:
+            PlanError: if the strategy is unknown or not possible for the download
+
+        Returns:
+            TransferPlan: download plan
+        """
+        self.__restore_planner()
+        return planner.plan_download(size, transformed, strategy)
+
+    @instrument()
+    def plan_fan_out(self, size: int, buckets: list, strategy: str = 'auto') -> str:
+        """Pick how an upload reaches several buckets. 'tee' reads and transforms the source once and streams the
+        chunks to one upload per bucket, sending the data once per bucket. 'rewrite' uploads to the first bucket and
+        copies server side to the others, sending the data once. Small objects are teed, one request per bucket
+        beats an upload followed by copies. Larger objects are rewritten when all buckets share the location and
+        storage class of the first, where the service copies without moving data, or when they are too large to
+        send several times (FAN_OUT_TEE_MAX_SIZE). Otherwise parallel uploads land every copy in about the time
+        of one and the objects are teed
+
+        Args:
+            size (int): source size in bytes
+            buckets (list): destination buckets, the first is the primary
+            strategy (str, optional): 'auto', 'tee' or 'rewrite'. Defaults to 'auto'.
+
+        Returns:
+            str: 'tee' or 'rewrite'
+        """
+        if strategy in ('tee', 'rewrite'):
+            return strategy
+        if size <= MULTIPART_MAX_SIZE:
+            return 'tee'
+        if size > FAN_OUT_TEE_MAX_SIZE:
+            return 'rewrite'
+        try:
+            kinds = {(bucket.location, bucket.storage_class) for bucket in map(self.client.get_bucket, buckets)}
+        except Exception as error:
+            self.log.warning(f'Failed to load bucket locations, teeing the upload: {error}')
+            return 'tee'
+        return 'rewrite' if len(kinds) == 1 else 'tee'
+
+    def __fan_out_raw(self, data: bytes, bucket_path: str, buckets: list, content_type: str,
+                      metadata: dict | None) -> dict:
+        """Upload the same in memory data to several buckets in parallel. Each upload holds the size of its request
+        body in the memory budget. The bytes sent are added to the metrics of the calling thread
+
+        Returns:
+            dict: bucket name to upload result
+        """
+        wires = {name: StreamChecksum() for name in buckets}
+
+        def upload(name: str) -> bool:
+            try:
+                blob = self.get_blob(bucket_path, name)
+                if blob is None:
+                    raise ValueError(f'Bucket not available: {name}')
+                if metadata:
+                    blob.metadata = metadata
+                with scheduler.slot(self.priority), memory_budget.hold(len(data)), span('transfer'):
+                    blob.upload_from_file(ChunkReader(BytesIO(data), None, wires[name]), size=len(data),
+                                          content_type=content_type, checksum=None)
+                self.__verify_upload(blob, wires[name])
+                return True
+            except ChecksumMismatch as error:
+                self.log.error(f'Failed to upload {bucket_path} to bucket {name}: {error}')
+            except Exception:
+                self.log.exception(f'Failed to upload {bucket_path} to bucket {name}')
+            return False
+
+        self._ensure_pool(len(buckets))
+        try:
+            with ThreadPoolExecutor(len(buckets), thread_name_prefix='gstorage-tee') as pool:
+                return dict(zip(buckets, pool.map(upload, buckets)))
+        finally:
+            metrics.add_bytes(sum(wire.bytes for wire in wires.values()))
+
+    def __tee_destination(self, bucket_name: str, bucket_path: str, source: QueueSource, content_type: str,
+                          metadata: dict | None, chunk_size: int, size: int | None,
+                          ticket: TransferSlot | None, stages: list, wire: StreamChecksum) -> bool:
+        """Upload one destination of a tee from its queue of shared chunks, under the transfer slot of the tee. The
+        chunks are checksummed into wire as they are sent, every destination is verified against its own object
 
         Returns:
             bool: True if successful, False otherwise
         """
-        if passwd:
+        try:
+            blob = self.get_blob(bucket_path, bucket_name)
+            if blob is None:
+                raise ValueError(f'Bucket not available: {bucket_name}')
+            if metadata:
+                blob.metadata = metadata
+            blob.chunk_size = chunk_size
+            with scheduler.attach(ticket), span('transfer'):
+                blob.upload_from_file(TransformReader(source, [wire], chunk_size=chunk_size, rewind=chunk_size),
+                                      size=size, content_type=content_type, checksum=None)
+            self.__verify_upload(blob, wire, stages)
+            return True
+        except ChecksumMismatch as error:
+            self.log.error(f'Failed to upload {bucket_path} to bucket {bucket_name}: {error}')
+        except Exception:
+            source.abandon()
+            self.log.exception(f'Failed to upload {bucket_path} to bucket {bucket_name}')
+        return False
+
+    def __tee_file(self, file_path: str, bucket_path: str, buckets: list, content_type: str,
+                   progress: Callable | None, stages: list, metadata: dict | None, window_size: int) -> dict:
+        """Read and transform a file once and stream the chunks to one upload per bucket. Each destination queues
+        two chunks and keeps one for retries, so the source is read at the pace of the slowest destination with about
+        four windows per destination in memory, held in the memory budget. The tee holds one transfer slot for all
+        destinations, as they can only advance together. The bytes sent are added to the metrics of the calling thread
+
+        Returns:
+            dict: bucket name to upload result
+        """
+        chunk_size = max(1, window_size // RESUMABLE_CHUNK_ALIGNMENT) * RESUMABLE_CHUNK_ALIGNMENT
+        with open(file_path, 'rb') as file, MappedReader(file, chunk_size) as source:
+            size = fstat(file.fileno()).st_size
+            tracker = make_progress(progress, size, bucket_path)
+            if size <= min(MULTIPART_MAX_SIZE, chunk_size):
+                data = TransformReader(source, stages, tracker).read()
+                if tracker:
+                    tracker.finish()
+                return self.__fan_out_raw(data, bucket_path, buckets, content_type,
+                                          {**(metadata or {}), **self.__source_metadata(stages)})
+            queues = {name: QueueSource() for name in buckets}
+            wires = {name: StreamChecksum() for name in buckets}
+            chain = offloader.stages(stages, size)
+            self._ensure_pool(len(buckets))
+            with scheduler.slot(self.priority) as ticket, memory_budget.hold(4 * chunk_size * len(buckets)), \
+                    ThreadPoolExecutor(len(buckets), thread_name_prefix='gstorage-tee') as pool:
+                futures = {name: pool.submit(self.__tee_destination, name, bucket_path, queue, content_type, metadata,
+                                             chunk_size, None if stages else size, ticket, stages, wires[name])
+                           for name, queue in queues.items()}
+                try:
+                    while not all(queue.abandoned for queue in queues.values()):
+                        chunk = source.read(chunk_size)
+                        data = apply_stages(chain, chunk, final=not chunk)
+                        if data:
+                            for queue in queues.values():
+                                queue.put(data)
+                        if not chunk:
+                            break
+                        if tracker:
+                            tracker.update(len(chunk))
+                    end = None
+                except Exception as error:
+                    self.log.exception(f'Failed to read file {file_path}')
+                    end = error
+                for queue in queues.values():
+                    queue.put(end)
+            metrics.add_bytes(sum(wire.bytes for wire in wires.values()))
+            if tracker:
+                tracker.finish()
+        return {name: future.result() for name, future in futures.items()}
+
+    def __rewrite_fan_out(self, file_path: str, bucket_path: str, buckets: list, content_type: str,
+                          progress: Callable | None, stages: list, metadata: dict | None, window_size: int) -> dict:
+        """Upload a file to the first bucket and copy it server side to the other buckets in parallel
+
+        Returns:
+            dict: bucket name to upload result
+        """
+        primary, replicas = buckets[0], buckets[1:]
+        results = {name: False for name in buckets}
+        if not self.__upload_from_file(file_path, bucket_path, content_type, progress, stages, metadata, window_size,
+                                       primary):
+            return results
+        results[primary] = True
+        try:
+            source = self.client.bucket(primary).get_blob(bucket_path)
+        except Exception:
+            self.log.exception(f'Failed to load uploaded object {primary}/{bucket_path}')
+            return results
+
+        def copy(name: str) -> bool:
             try:
-                with open(file_path, 'rb') as file:
-                    data = self.cipher.passwd_xor(file.read(), self._prompt_for_passwd(True))
+                self.__rewrite_object(source, self.client.bucket(name).blob(bucket_path))
+                return True
             except Exception:
-                self.log.exception('Failed to read file')
-                return False
-            return self.__upload_from_raw(data, bucket_path, 'application/octet-stream')
-        if file_path.endswith('.json'):
-            return self.__upload_from_file(file_path, bucket_path, 'application/json')
-        return self.__upload_from_file(file_path, bucket_path, 'text/plain')
+                self.log.exception(f'Failed to copy {primary}/{bucket_path} to bucket {name}')
+            return False
+
+        self._ensure_pool(len(replicas))
+        with ThreadPoolExecutor(max(1, len(replicas)), thread_name_prefix='gstorage-rewrite') as pool:
+            results.update(zip(replicas, pool.map(copy, replicas)))
+        return results
+
+    def __report_fan_out(self, bucket_path: str, results: dict):
+        for name, result in results.items():
+            if result:
+                self.log.info(f'Successfully uploaded {bucket_path} to bucket {name}')
+            else:
+                self.log.error(f'Failed to upload {bucket_path} to bucket {name}')
+
+    @instrument()
+    def upload_file_to_buckets(self, file_path: str, bucket_path: str, buckets: list, passwd: bool = False,
+                               progress: Callable | None = None, compress: str | None = None,
+                               level: int | None = None, window_size: int = TRANSFORM_WINDOW_SIZE,
+                               strategy: str = 'auto') -> dict:
+        """Upload a file to the same path in several buckets. The file is read, compressed and encrypted once,
+        then either teed to parallel uploads or uploaded to the first bucket and copied server side to the others,
+        as picked by plan_fan_out()
+
+        Args:
+            file_path (str): the file path to upload
+            bucket_path (str): the path to save the file in each bucket
+            buckets (list): destination bucket names, the first is the primary. 'default' is the instance bucket
+            passwd (bool, optional): True if the data should be encrypted. Defaults to False.
+            progress (Callable | None, optional): progress callback or Progress object. Defaults to None.
+            compress (str | None, optional): compression codec ('gzip', 'zstd' or 'auto'). Defaults to None.
+            level (int | None, optional): compression level. Defaults to None (codec default).
+            window_size (int, optional): mmap window and resumable chunk size. Defaults to 16MB.
+            strategy (str, optional): 'auto', 'tee' or 'rewrite'. Defaults to 'auto'.
+
+        Returns:
+            dict: bucket name to upload result (True if successful, False otherwise)
+        """
+        buckets = list(dict.fromkeys(self.bucket if name == 'default' else name for name in buckets))
+        content_type = 'application/json' if file_path.endswith('.json') else 'text/plain'
+        try:
+            size = Path(file_path).stat().st_size
+            stages, content_type, metadata = self.__upload_transform(content_type, passwd, compress, level)
+        except (OSError, ValueError) as error:
+            self.log.error(str(error))
+            return {name: False for name in buckets}
+        plan = self.plan_fan_out(size, buckets, strategy)
+        self.log.info(f'Uploading {file_path} to {len(buckets)} buckets ({plan})')
+        try:
+            if plan == 'rewrite' and len(buckets) > 1:
+                results = self.__rewrite_fan_out(file_path, bucket_path, buckets, content_type, progress, stages,
+                                                 metadata, window_size)
+            else:
+                results = self.__tee_file(file_path, bucket_path, buckets, content_type, progress, stages, metadata,
+                                          window_size)
+        except Exception:
+            self.log.exception(f'Failed to upload file {file_path}')
+            results = {name: False for name in buckets}
+        self.__report_fan_out(bucket_path, results)
+        return results
+
+    @instrument()
+    def upload_data_to_buckets(self, data: str, bucket_path: str, buckets: list, passwd: bool = False,
+                               compress: str | None = None, level: int | None = None) -> dict:
+        """Upload data as text to the same path in several buckets in parallel. The data is compressed and
+        encrypted once
+
+        Args:
+            data (str): the string data to save as text file in the buckets
+            bucket_path (str): the path to save the data in each bucket
+            buckets (list): destination bucket names. 'default' is the instance bucket
+            passwd (bool, optional): True if the data should be encrypted. Defaults to False.
+            compress (str | None, optional): compression codec ('gzip', 'zstd' or 'auto'). Defaults to None.
+            level (int | None, optional): compression level. Defaults to None (codec default).
 
+        Returns:
+            dict: bucket name to upload result (True if successful, False otherwise)
+        """
+        buckets = list(dict.fromkeys(self.bucket if name == 'default' else name for name in buckets))
+        try:
+            stages, content_type, metadata = self.__upload_transform('text/plain', passwd, compress, level)
+        except ValueError as error:
+            self.log.error(str(error))
+            return {name: False for name in buckets}
+        payload = data.encode()
+        with memory_budget.hold(2 * len(payload) if stages else 0):
+            data: bytes = apply_stages(offloader.stages(stages, len(payload)), payload, final=True)
+        del payload
+        metadata.update(self.__source_metadata(stages))
+        results = self.__fan_out_raw(data, bucket_path, buckets, content_type, metadata)
+        self.__report_fan_out(bucket_path, results)
+        return results
+
+    @instrument()
     def get_bucket_folder_files(self, folder_path: str):
         """Get all files in a folder in the bucket
 
@@ -422,6 +1312,7 @@ class GCPCloudStorage():
             self.log.exception('Failed to list files')
         return None
 
+    @instrument()
     def get_object_info(self, file_path: str) -> dict:
         """Get the info of a file in the bucket. The info includes the file name, size, checksum and created date
 
@@ -446,36 +1337,165 @@ class GCPCloudStorage():
             self.log.error(f'File not found: {file_path}')
         return {}
 
-    def download_object_to_file(self, bucket_path: str, destination_path: str, passwd: bool = False) -> bool:
+    @staticmethod
+    def __resource_info(resource: dict) -> dict:
+        """Convert an object resource to a JSON serializable info dictionary
+
+        Args:
+            resource (dict): object resource from the JSON API
+
+        Returns:
+            dict: object info
+        """
+        return {
+            'name': resource.get('name'),
+            'size': int(resource['size']) if 'size' in resource else None,
+            'checksum': resource.get('crc32c'),
+            'md5': resource.get('md5Hash'),
+            'generation': resource.get('generation'),
+            'content_type': resource.get('contentType'),
+            'created': resource.get('timeCreated'),
+            'updated': resource.get('updated'),
+            'metadata': resource.get('metadata', {}),
+        }
+
+    def __batch_info(self, bucket: storage.Bucket, names: list) -> list:
+        """Fetch the metadata of up to 100 objects with one batch request. The batch is used directly instead of
+        as a context manager, as the context manager pushes it on a client wide stack that other threads would
+        see. Missing objects and failed sub-requests are reported as entries with an error
+
+        Args:
+            bucket (storage.Bucket): bucket object
+            names (list): object names
+
+        Returns:
+            list: info dictionaries in name order
+        """
+        batch = self.client.batch(raise_exception=False)
+        for name in names:
+            batch.api_request(method='GET', path=bucket.blob(name).path, query_params={'projection': 'noAcl'})
+        results = []
+        for name, response in zip(names, batch.finish(raise_exception=False)):
+            if 200 <= response.status_code < 300:
+                results.append(self.__resource_info(response.json()))
+            elif response.status_code == 404:
+                results.append({'name': name, 'error': 'not found'})
+            else:
+                results.append({'name': name, 'error': f'{response.status_code} {response.reason}'})
+        return results
+
+    @instrument()
+    def get_objects_info(self, names: Iterable[str], batch_size: int = 100, workers: int = 4):
+        """Get the info of many objects. Metadata GETs are grouped into batch requests of up to batch_size names and
+        several batches run concurrently. Missing objects are yielded with an 'error' key instead of failing the run
+
+        Args:
+            names (Iterable[str]): object names, consumed lazily
+            batch_size (int, optional): names per batch request, at most 100. Defaults to 100.
+            workers (int, optional): concurrent batch requests. Defaults to 4.
+
+        yield:
+            dict: object info, or {'name': ..., 'error': ...} for missing objects, as batches complete
+        """
+        try:
+            bucket = self.client.bucket(self.bucket)
+        except Exception:
+            self.log.exception('Failed to get bucket')
+            return None
+        names = iter(names)
+        batch_size = max(1, min(batch_size, 100))
+
+        def run(batch: list) -> list:
+            try:
+                return self.__batch_info(bucket, batch)
+            except Exception as error:
+                self.log.exception(f'Failed batch info request for {len(batch)} objects')
+                return [{'name': name, 'error': str(error)} for name in batch]
+
+        with ThreadPoolExecutor(max(1, workers), thread_name_prefix='gstorage-info') as pool:
+            pending = set()
+            while True:
+                while len(pending) < workers * 2:
+                    batch = list(islice(names, batch_size))
+                    if not batch:
+                        break
+                    pending.add(pool.submit(run, batch))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        return None
+
+    @instrument()
+    def export_objects_info(self, names_file: str, destination_path: str = '', batch_size: int = 100,
+                            workers: int = 4) -> bool:
+        """Write the info of the objects named in a file (one name per line, '-' for stdin) as JSON lines
+
+        Args:
+            names_file (str): file with one object name per line or '-' for stdin
+            destination_path (str, optional): JSON lines output file. Defaults to '' (stdout).
+            batch_size (int, optional): names per batch request. Defaults to 100.
+            workers (int, optional): concurrent batch requests. Defaults to 4.
+
+        Returns:
+            bool: True if the run completed, missing objects included, False otherwise
+        """
+        try:
+            source = sys.stdin if names_file == '-' else open(names_file, 'r')
+            output = open(destination_path, 'w') if destination_path else sys.stdout
+        except Exception:
+            self.log.exception('Failed to open names or output file')
+            return False
+        total = missing = 0
+        try:
+            names = (line.strip() for line in source if line.strip())
+            for info in self.get_objects_info(names, batch_size, workers):
+                total += 1
+                if 'error' in info:
+                    missing += 1
+                output.write(json.dumps(info) + '\n')
+            self.log.info(f'Wrote info of {total} objects, {missing} missing or failed')
+            return True
+        except Exception:
+            self.log.exception('Failed to export object info')
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if output is not sys.stdout:
+                output.close()
+        return False
+
+    @instrument()
+    def download_object_to_file(self, bucket_path: str, destination_path: str, passwd: bool = False,
+                                progress: Callable | None = None, strategy: str = 'auto',
+                                explain: bool = False) -> bool:
         """Download file from bucket and save to destination path. If passwd is True, password input prompt is provided
-        to decrypt the data before saving to file.
+        to decrypt the data before saving to file. Compressed objects are decompressed while they download. Large
+        objects that are not compressed or encrypted can be downloaded as parallel slices (see plan_download)
 
         Args:
             bucket_path (str): bucket path to file to download
             destination_path (str): save file to this path
             passwd (bool, optional): option to provide password for decrypt. Defaults to False.
+            progress (Callable | None, optional): progress callback or Progress object called with the bytes done,
+                rates and ETA while the download runs. Defaults to None.
+            strategy (str, optional): 'auto' (planned), 'single' or 'sliced'. Defaults to 'auto'.
+            explain (bool, optional): log the transfer plan and the estimates it was picked from. Defaults to False.
 
         Returns:
             bool: True if successful, False otherwise
         """
-        if passwd:
-            data = self.download_object(bucket_path, passwd)
-            try:
-                with open(destination_path, 'w') as file:
-                    file.write(data)
-                self.log.info(f'Successfully downloaded object to file {destination_path}')
-                return True
-            except Exception:
-                self.log.exception('Failed to save file')
-                return False
-        return self.__download_object_to_file(bucket_path, destination_path)
+        return self.__download_object_to_file(bucket_path, destination_path, passwd, progress, strategy, explain)
 
-    def download_object(self, bucket_path: str, passwd: bool = False) -> str:
-        """Download data from bucket
+    @instrument()
+    def download_object(self, bucket_path: str, passwd: bool = False, progress: Callable | None = None) -> str:
+        """Download data from bucket. Compressed objects are decompressed while they download
 
         Args:
             bucket_path (str): bucket path to file to download
             passwd (bool, optional): option to provide password for decrypt. Defaults to False.
+            progress (Callable | None, optional): progress callback or Progress object. Defaults to None.
 
         Returns:
             str: the downloaded data as string
@@ -483,21 +1503,519 @@ class GCPCloudStorage():
         blob = self.get_blob(bucket_path)
         if blob:
             try:
-                data = blob.download_as_bytes()
-                if passwd:
-                    return self.cipher.passwd_xor(data, self._prompt_for_passwd(False)).decode()
-                return data.decode()
+                buffer = BytesIO()
+                self.__download_to_stream(blob, buffer, passwd, progress, in_memory=True)
+                with buffer.getbuffer() as view:
+                    return str(view, 'utf-8')
             except UnicodeDecodeError:
                 self.log.error('Failed to decrypt data')
+            except ChecksumMismatch as error:
+                self.log.error(f'Failed to download data: {bucket_path}: {error}')
             except Exception:
                 self.log.exception(f'Failed to download data: {bucket_path}')
         else:
             self.log.error(f'Failed to download data: {bucket_path}')
         return ''
 
+    @instrument()
+    def get_if_changed(self, bucket_path: str, known_generation: int = 0, passwd: bool = False) -> tuple:
+        """Download data from bucket only if the object changed since known_generation. The metadata request
+        carries an ifGenerationNotMatch precondition, so an unchanged object costs one small request and no body
+        transfer. The body is downloaded pinned to the generation of the metadata
+
+        Args:
+            bucket_path (str): bucket path to the object
+            known_generation (int, optional): generation of the last read, 0 to always download. Defaults to 0.
+            passwd (bool, optional): option to provide password for decrypt. Defaults to False.
+
+        Returns:
+            tuple: (data, generation) if changed, (None, known_generation) if unchanged, (None, 0) if the object does
+                not exist and (None, -1) on failure
+        """
+        try:
+            blob = self.client.bucket(self.bucket).blob(bucket_path)
+            buffer = BytesIO()
+            self.__download_to_stream(blob, buffer, passwd, None, known_generation or None, in_memory=True)
+            with buffer.getbuffer() as view:
+                return str(view, 'utf-8'), blob.generation
+        except NotModified:
+            return None, known_generation
+        except NotFound:
+            self.log.debug(f'File not found: {bucket_path}')
+            return None, 0
+        except UnicodeDecodeError:
+            self.log.error('Failed to decrypt data')
+        except ChecksumMismatch as error:
+            self.log.error(f'Failed to download data: {bucket_path}: {error}')
+        except Exception:
+            self.log.exception(f'Failed to download data: {bucket_path}')
+        return None, -1
+
+    @instrument()
+    def watch_object(self, bucket_path: str, interval: float = 5.0, passwd: bool = False) -> Watcher:
+        """Watch an object for changes with get_if_changed() every interval seconds. Iterate the watcher (or
+        async for it, or pass a callback to its start()) to get a {'name', 'event', 'generation', 'data'} event
+        with event 'created', 'updated' or 'deleted' whenever the object changes, starting with its current data.
+        With passwd the password is prompted once
+
+        Args:
+            bucket_path (str): bucket path to the object
+            interval (float, optional): seconds between polls. Defaults to 5.0.
+            passwd (bool, optional): option to provide password for decrypt. Defaults to False.
+
+        Returns:
+            Watcher: change feed of the object, stop it with stop()
+        """
+        manager = copy(self)
+        if passwd:
+            password = self._prompt_for_passwd(False)
+            manager._prompt_for_passwd = lambda verify=False: password
+        known = {'generation': 0}
+
+        def poll() -> list:
+            data, generation = manager.get_if_changed(bucket_path, known['generation'], passwd)
+            if generation < 0 or generation == known['generation']:
+                return []
+            event = 'deleted' if data is None else 'updated' if known['generation'] else 'created'
+            known['generation'] = generation
+            return [{'name': bucket_path, 'event': event, 'generation': generation, 'data': data}]
+
+        return Watcher(poll, interval, self.log, 'gstorage-watch-object')
+
+    @instrument()
+    def watch_prefix(self, prefix: str, interval: float = 30.0, include_existing: bool = False) -> Watcher:
+        """Watch the objects with a prefix for changes. Each poll lists the prefix with only the name, generation,
+        updated and size fields and reports the objects whose generation or updated time differ from the previous
+        listing, so metadata updates are reported too (the listing API has no server side time filter, the field
+        projection keeps each page small). Iterate the watcher (or async for it, or pass a callback to its start())
+        to get a {'name', 'event', 'generation', 'updated', 'size'} event with event 'created', 'updated' or
+        'deleted' for each changed object, in updated time order
+
+        Args:
+            prefix (str): object name prefix
+            interval (float, optional): seconds between polls. Defaults to 30.0.
+            include_existing (bool, optional): report the objects of the first listing as created, otherwise the
+                first listing is only the baseline. Defaults to False.
+
+        Returns:
+            Watcher: change feed of the prefix, stop it with stop()
+        """
+        known: dict = {}
+        baseline = {'done': include_existing}
+
+        def poll() -> list:
+            try:
+                listing = {blob.name: blob for blob in self.client.list_blobs(self.bucket, prefix=prefix,
+                                                                              fields=PREFIX_WATCH_FIELDS)}
+            except Exception as error:
+                self.log.warning(f'Failed to list {self.bucket}/{prefix}: {error}')
+                return []
+            events = []
+            versions = {name: (blob.generation, blob.updated.isoformat() if blob.updated else None)
+                        for name, blob in listing.items()}
+            for name, (generation, updated) in versions.items():
+                if known.get(name) != (generation, updated):
+                    events.append({'name': name, 'event': 'updated' if name in known else 'created',
+                                   'generation': generation, 'size': listing[name].size, 'updated': updated})
+            events.sort(key=lambda event: event['updated'] or '')
+            events.extend({'name': name, 'event': 'deleted', 'generation': 0, 'size': 0, 'updated': None}
+                          for name in known if name not in listing)
+            known.clear()
+            known.update(versions)
+            if not baseline['done']:
+                baseline['done'] = True
+                return []
+            return events
+
+        return Watcher(poll, interval, self.log, 'gstorage-watch-prefix')
+
+    def __download_into(self, blob: storage.Blob, buffer, offset: int = 0) -> int:
+        """Stream an object into a caller buffer starting at offset. Buffers up to the small read size take the fast
+        lane of the transfer scheduler. The received bytes are checksummed as they arrive and checked against the
+        checksums the service reports with the response
+
+        Args:
+            blob (storage.Blob): blob to download
+            buffer (bytearray | memoryview | numpy.ndarray): writable contiguous buffer
+            offset (int, optional): byte offset in the buffer. Defaults to 0.
+
+        Raises:
+            ValueError: if the object does not fit in the buffer
+            ChecksumMismatch: if the received data does not match the object checksums
+
+        Returns:
+            int: number of bytes written
+        """
+        wire = StreamChecksum()
+        with memoryview(buffer) as view, view.cast('B') as target:
+            writer = MemoryWriter(target[offset:], wire)
+            with scheduler.slot(self.priority, len(writer.buffer)), span('transfer'):
+                blob.download_to_file(writer, checksum=None)
+        wire.verify(f'Downloaded object {blob.name}', blob.crc32c, blob.md5_hash)
+        return writer.written
+
+    @instrument()
+    def download_into(self, bucket_path: str, buffer, offset: int = 0) -> int:
+        """Download an object straight into a caller provided buffer (bytearray, memoryview, NumPy array, ...).
+        Response chunks are copied into a memoryview of the buffer as they arrive, with no intermediate bytes
+        objects. Objects are written as stored, compressed or encrypted objects are not decoded
+
+        Args:
+            bucket_path (str): bucket path to the object
+            buffer (bytearray | memoryview | numpy.ndarray): writable contiguous buffer
+            offset (int, optional): byte offset in the buffer to write at. Defaults to 0.
+
+        Returns:
+            int: number of bytes written, 0 on failure
+        """
+        blob = self.get_blob(bucket_path)
+        if blob:
+            try:
+                written = self.__download_into(blob, buffer, offset)
+                metrics.add_bytes(written)
+                return written
+            except NotFound:
+                self.log.error(f'File not found: {bucket_path}')
+            except ChecksumMismatch as error:
+                self.log.error(f'Failed to download data: {bucket_path}: {error}')
+            except ValueError:
+                self.log.error(f'Buffer too small for {bucket_path}')
+            except Exception:
+                self.log.exception(f'Failed to download data: {bucket_path}')
+        else:
+            self.log.error(f'Failed to download data: {bucket_path}')
+        return 0
+
+    @instrument()
+    def download_many_into(self, items: list, workers: int = 8) -> list:
+        """Download many objects straight into caller provided buffers in parallel. The bucket is looked up once and
+        shared by the workers. Downloads run in the bulk class of the transfer scheduler
+
+        Args:
+            items (list): (bucket path, buffer) or (bucket path, buffer, offset) tuples. Several items can target
+                different offsets of the same buffer
+            workers (int, optional): parallel downloads. Defaults to 8.
+
+        Returns:
+            list: bytes written per item in item order, -1 for failed items
+        """
+        try:
+            bucket = self.client.get_bucket(self.bucket)
+        except Exception:
+            self.log.exception('Failed to get bucket')
+            return [-1] * len(items)
+
+        def download(item: tuple) -> int:
+            try:
+                with scheduler.slot('bulk'):
+                    return self.__download_into(bucket.blob(item[0]), *item[1:])
+            except NotFound:
+                self.log.error(f'File not found: {item[0]}')
+            except ChecksumMismatch as error:
+                self.log.error(f'Failed to download data: {item[0]}: {error}')
+            except Exception:
+                self.log.exception(f'Failed to download data: {item[0]}')
+            return -1
+
+        with ThreadPoolExecutor(max(1, workers), thread_name_prefix='gstorage-download') as pool:
+            results = list(pool.map(download, items))
+        metrics.add_bytes(sum(result for result in results if result > 0))
+        return results
+
+    def _ensure_pool(self, size: int):
+        """Grow the HTTP connection pool of the client so size worker threads reuse connections instead of opening
+        and discarding extra ones (the default pool keeps 10)
+
+        Args:
+            size (int): concurrent requests
+        """
+        if size > max(self.__pool_size, 10):
+            adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+            self.client._http.mount('https://', adapter)
+            self.client._http.mount('http://', adapter)
+            self.__pool_size = size
+
+    @instrument()
+    def download_many(self, names: Iterable[str], workers: int = 8, ordered: bool = False,
+                      max_bytes: int = 256 * 1024 * 1024, passwd: bool = False, decompress: bool = False):
+        """Download many objects into memory concurrently. Workers share one bucket object and the client
+        connection pool, and decrypt/decompress in the pool. Workers only start a download while the bytes
+        downloaded but not yet consumed are below max_bytes, so a slow consumer holds back the downloads. The bytes
+        are also charged to the process memory budget until consumed, and downloads wait while it is exhausted. Keep
+        max_bytes below the memory budget when the consumer holds budget itself (e.g. uploads the data). Downloads
+        run in the bulk class of the transfer scheduler
+
+        Args:
+            names (Iterable[str]): object names, consumed lazily
+            workers (int, optional): concurrent downloads. Defaults to 8.
+            ordered (bool, optional): yield results in name order instead of completion order. Defaults to False.
+            max_bytes (int, optional): in-flight byte budget. Defaults to 256MB.
+            passwd (bool, optional): prompt once for a password and decrypt every object. Defaults to False.
+            decompress (bool, optional): load each object's metadata, decompress objects uploaded with compress and
+                verify decoded data against the plaintext checksum recorded by the upload. Costs one metadata request
+                per object. Defaults to False.
+
+        yield:
+            tuple: (name, bytes) or (name, Exception) for failed objects
+        """
+        try:
+            bucket = self.client.bucket(self.bucket)
+            self._ensure_pool(workers)
+        except Exception as error:
+            self.log.exception('Failed to get bucket')
+            for name in names:
+                yield name, error
+            return None
+        password = self._prompt_for_passwd(False) if passwd else ''
+        budget = ByteBudget(max_bytes)
+
+        def fetch(name: str) -> bytes | Exception:
+            try:
+                budget.acquire(0)
+                memory_budget.acquire(0)
+                blob = bucket.blob(name)
+                stages = [PasswdXorStage(password)] if password else []
+                with scheduler.slot('bulk'):
+                    if decompress:
+                        blob.reload()
+                        codec = (blob.metadata or {}).get(CODEC_METADATA_KEY)
+                        if codec:
+                            stages.append(DecompressStage(codec))
+                    if stages:
+                        source = StreamChecksum()
+                        buffer = BytesIO()
+                        writer = TransformWriter(buffer, offloader.stages([*stages, source], blob.size or 0))
+                        blob.download_to_file(writer)
+                        writer.finish()
+                        data = buffer.getvalue()
+                        if decompress:
+                            source.verify_source(f'Decoded object {name}', blob.metadata)
+                    else:
+                        data = blob.download_as_bytes()
+                        scheduler.throttle(len(data))
+                budget.charge(len(data))
+                memory_budget.charge(len(data))
+                return data
+            except BudgetClosed as error:
+                return error
+            except Exception as error:
+                self.log.error(f'Failed to download data: {name}: {error.__class__.__name__}: {error}')
+                return error
+
+        names = iter(names)
+        window = max(1, workers) * 4
+        with ThreadPoolExecutor(max(1, workers), thread_name_prefix='gstorage-download') as pool:
+            pending = {}
+            completed = {}
+            submitted = next_index = 0
+            try:
+                while True:
+                    while len(pending) + len(completed) < window:
+                        name = next(names, None)
+                        if name is None:
+                            break
+                        pending[pool.submit(fetch, name)] = (submitted, name)
+                        submitted += 1
+                    if not pending and not completed:
+                        break
+                    if pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            completed[pending.pop(future)] = future.result()
+                    for key in sorted(completed) if ordered else list(completed):
+                        if ordered and key[0] != next_index:
+                            break
+                        result = completed.pop(key)
+                        next_index += 1
+                        if isinstance(result, bytes):
+                            metrics.add_bytes(len(result))
+                            budget.release(len(result))
+                            memory_budget.release(len(result))
+                        yield key[1], result
+            finally:
+                budget.close()
+                for result in completed.values():
+                    if isinstance(result, bytes):
+                        memory_budget.release(len(result))
+                for future in pending:
+                    future.cancel()
+                    future.add_done_callback(self.__release_download)
+        return None
+
+    @staticmethod
+    def __release_download(future):
+        """Return the bytes of a download nobody will consume to the memory budget"""
+        if not future.cancelled() and isinstance(future.result(), bytes):
+            memory_budget.release(len(future.result()))
+
+    @instrument()
+    def open_reader(self, bucket_path: str, block_size: int = 1024 * 1024, read_ahead: int = 4,
+                    cache_blocks: int = 32) -> RangeReader | None:
+        """Open a seekable reader over an object that fetches only the ranges read, for example the footer of a
+        Parquet or zip file. Wrap it in io.BufferedReader for line based reads
+
+        Args:
+            bucket_path (str): bucket path to the object
+            block_size (int, optional): cache block size. Defaults to 1MB.
+            read_ahead (int, optional): blocks fetched ahead of sequential reads. Defaults to 4.
+            cache_blocks (int, optional): maximum cached blocks. Defaults to 32.
+
+        Returns:
+            RangeReader | None: reader or None if failed
+        """
+        blob = self.get_blob(bucket_path)
+        if blob:
+            try:
+                blob.reload()
+                if (blob.metadata or {}).get(CODEC_METADATA_KEY):
+                    self.log.error(f'Object {bucket_path} is compressed, ranged reads need an uncompressed object')
+                    return None
+                return RangeReader(blob, blob.size, block_size, read_ahead, cache_blocks, self.priority)
+            except NotFound:
+                self.log.error(f'File not found: {bucket_path}')
+            except Exception:
+                self.log.exception(f'Failed to open reader: {bucket_path}')
+        else:
+            self.log.error(f'Failed to open reader: {bucket_path}')
+        return None
+
+    @staticmethod
+    def __rewrite_object(source: storage.Blob, destination: storage.Blob, overwrite: bool = True) -> storage.Blob:
+        """Copy an object server side. Large objects take several rewrite calls, each continuing from the token
+        returned by the previous call. The source generation is pinned so a source changed during the copy fails the
+        copy instead of mixing generations
+
+        Args:
+            source (storage.Blob): listed source object
+            destination (storage.Blob): destination object
+            overwrite (bool, optional): replace an existing destination object. Defaults to True.
+
+        Raises:
+            PreconditionFailed: if the source changed or the destination exists and overwrite is False
+            ValueError: if the copy does not match the source size and crc32c
+
+        Returns:
+            storage.Blob: the destination object with its new properties
+        """
+        token = None
+        while True:
+            token, _, _ = destination.rewrite(source, token=token, if_source_generation_match=source.generation,
+                                              if_generation_match=None if overwrite else 0)
+            if token is None:
+                break
+        if destination.size != source.size or destination.crc32c != source.crc32c:
+            raise ValueError(f'Copy of {source.name} does not match the source (size {destination.size}/{source.size}'
+                             f', crc32c {destination.crc32c}/{source.crc32c})')
+        return destination
+
+    @instrument()
+    def copy_prefix(self, prefix: str, destination_prefix: str, destination_bucket: str = '', workers: int = 8,
+                    overwrite: bool = True, move: bool = False) -> bool:
+        """Copy all objects with the prefix to the destination prefix, optionally in another bucket. Objects are
+        copied server side with rewrite requests on a worker pool, so no object data passes through this host. The
+        name part after the prefix is kept: copy_prefix('logs/2024/', 'archive/2024/') copies logs/2024/a.txt to
+        archive/2024/a.txt. Rewrites run in the bulk class of the transfer scheduler
+
+        Args:
+            prefix (str): source prefix (or a single object name)
+            destination_prefix (str): destination prefix replacing the source prefix
+            destination_bucket (str, optional): destination bucket. Defaults to '' (same bucket).
+            workers (int, optional): concurrent rewrites. Defaults to 8.
+            overwrite (bool, optional): replace existing destination objects, otherwise they are skipped.
+                Defaults to True.
+            move (bool, optional): delete each source object once its copy is verified. Defaults to False.
+
+        Returns:
+            bool: True if every object was copied (or skipped), False otherwise
+        """
+        destination_bucket = destination_bucket or self.bucket
+        if destination_bucket == self.bucket and destination_prefix == prefix:
+            self.log.error('Source and destination are the same')
+            return False
+        action, done_action = ('move', 'Moved') if move else ('copy', 'Copied')
+        try:
+            source_bucket = self.client.bucket(self.bucket)
+            target_bucket = self.client.bucket(destination_bucket)
+            self._ensure_pool(workers)
+            blobs = source_bucket.list_blobs(prefix=prefix)
+            if destination_bucket == self.bucket and destination_prefix.startswith(prefix):
+                # copies land under the listed prefix, list everything before the first copy is made
+                blobs = list(blobs)
+        except Exception:
+            self.log.exception(f'Failed to list objects to {action}: {prefix}')
+            return False
+
+        summary = LogSummary(self.log, done_action)
+
+        def run(blob: storage.Blob):
+            name = destination_prefix + blob.name[len(prefix):]
+            target = target_bucket.blob(name)
+            try:
+                with scheduler.slot('bulk'):
+                    try:
+                        self.__rewrite_object(blob, target, overwrite)
+                    except PreconditionFailed:
+                        # the destination exists, or the source changed during the copy
+                        if overwrite or not target.exists():
+                            raise
+                        summary.add(f'Skipped existing object: {destination_bucket}/{name}', status='skipped')
+                        return None
+                    if move:
+                        try:
+                            blob.delete(if_generation_match=blob.generation)
+                        except PreconditionFailed:
+                            self.log.error(f'Failed to move {blob.name}: source changed after it was copied, the '
+                                           'source was kept')
+                            summary.add(status='failed')
+                            return None
+                summary.add(f'{done_action} {self.bucket}/{blob.name} to {destination_bucket}/{name}', blob.size or 0)
+                return None
+            except PreconditionFailed:
+                self.log.error(f'Failed to {action} {blob.name}: source changed during the {action}')
+            except Exception:
+                self.log.exception(f'Failed to {action} {blob.name} to {destination_bucket}/{name}')
+            summary.add(status='failed')
+
+        pending = set()
+        with ThreadPoolExecutor(max(1, workers), thread_name_prefix=f'gstorage-{action}') as pool:
+            try:
+                for blob in blobs:
+                    pending.add(pool.submit(run, blob))
+                    if len(pending) >= workers * 2:
+                        _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                wait(pending)
+            except Exception:
+                self.log.exception(f'Failed to list objects to {action}: {prefix}')
+                for future in pending:
+                    future.cancel()
+                return False
+        counts = summary.finish(f'from {self.bucket}/{prefix} to {destination_bucket}/{destination_prefix}')
+        return counts['failed'] == 0
+
+    @instrument()
+    def move_prefix(self, prefix: str, destination_prefix: str, destination_bucket: str = '', workers: int = 8,
+                    overwrite: bool = True) -> bool:
+        """Move all objects with the prefix to the destination prefix, optionally in another bucket. Each source
+        object is deleted only after its server side copy matched the source size and crc32c
+
+        Args:
+            prefix (str): source prefix (or a single object name)
+            destination_prefix (str): destination prefix replacing the source prefix
+            destination_bucket (str, optional): destination bucket. Defaults to '' (same bucket).
+            workers (int, optional): concurrent rewrites. Defaults to 8.
+            overwrite (bool, optional): replace existing destination objects, otherwise they are skipped and the
+                source kept. Defaults to True.
+
+        Returns:
+            bool: True if every object was moved (or skipped), False otherwise
+        """
+        return self.copy_prefix(prefix, destination_prefix, destination_bucket, workers, overwrite, True)
+
+    @instrument()
     def delete_bucket_folder(self, folder_path: str, force: bool = False) -> bool:
         """Delete all files in a folder in the bucket. Really, just deletes all files with the prefix provided
-        as folders are not a thing in GCP buckets, but we will treat them as such for simplicity.
+        as folders are not a thing in GCP buckets, but we will treat them as such for simplicity. Deletes run in the
+        bulk class of the transfer scheduler.
 
         Args:
             folder_path (str): the path to the folder in the bucket
@@ -507,19 +2025,24 @@ class GCPCloudStorage():
             bool: True if successful, False otherwise
         """
         self.log.info(f'Deleting files in folder: {folder_path}')
+        summary = LogSummary(self.log, 'Deleted', per_object=not force)
         for blob in self.client.get_bucket(self.bucket).list_blobs(prefix=folder_path):
             blob: storage.Blob
             try:
                 if force or input(f'Delete object {blob.name}? (y/n): ').lower() == 'y':
-                    blob.delete()
-                    self.log.info(f'Deleted file: {blob.name}')
+                    with scheduler.slot('bulk'):
+                        blob.delete()
+                    summary.add(f'Deleted file: {blob.name}', blob.size or 0)
                 else:
-                    self.log.info(f'Skipped file: {blob.name}')
+                    summary.add(f'Skipped file: {blob.name}', status='skipped')
             except Exception:
                 self.log.exception(f'Failed to delete file: {blob.name}')
+                summary.finish(f'from folder {folder_path}')
                 return False
+        summary.finish(f'from folder {folder_path}')
         return True
 
+    @instrument()
     def delete_object(self, bucket_path: str, force: bool = False) -> bool:
         """Delete file from bucket that matches the provided path
 
@@ -551,6 +2074,7 @@ class GCPCloudStorage():
                 self.log.exception('Failed to delete file')
         return False
 
+    @instrument()
     def display_bucket_folder_files(self, folder_path: str = '') -> bool:
         """Display all files in a folder in the bucket
 
@@ -570,6 +2094,7 @@ class GCPCloudStorage():
             self.log.exception('Failed to get files')
         return False
 
+    @instrument()
     def display_object_info(self, object_name: str) -> bool:
         """Display the info of a file in the bucket. Some items may not be populated in GCP.
 
@@ -584,6 +2109,7 @@ class GCPCloudStorage():
             return self.display_success(f'Object Info:\n{json.dumps(info, indent=2)}')
         return self.display_error(f'Failed to get object info: {object_name}')
 
+    @instrument()
     def display_downloaded_object(self, object_name: str, passwd: bool = False) -> bool:
         """Display the downloaded data from the bucket to console
 
@@ -601,17 +2127,49 @@ class GCPCloudStorage():
         self.display_error(f'Failed to download data: {object_name}')
         return False
 
+    @instrument()
+    def display_watch(self, name: str, interval: float, passwd: bool = False, prefix: bool = False) -> bool:
+        """Display the changes of an object, or the change events of the objects with a prefix as JSON lines, until
+        interrupted with Ctrl+C
+
+        Args:
+            name (str): object name or prefix
+            interval (float): seconds between polls
+            passwd (bool, optional): option to provide password for decrypt. Defaults to False.
+            prefix (bool, optional): watch the objects with the name as prefix. Defaults to False.
+
+        Returns:
+            bool: True when interrupted
+        """
+        watcher = self.watch_prefix(name, interval) if prefix else self.watch_object(name, interval, passwd)
+        try:
+            for event in watcher:
+                if prefix:
+                    sys.stdout.write(json.dumps(event) + '\n')
+                    sys.stdout.flush()
+                elif event['event'] == 'deleted':
+                    self.display_error(f'Object deleted: {name}')
+                else:
+                    self.display_success(f'Object {event["event"]} (generation {event["generation"]}):\n'
+                                         f'{event["data"]}')
+        except KeyboardInterrupt:
+            watcher.stop()
+        return True
+
+    @instrument()
     def get_service_accounts(self) -> list:
         """Get a list of service accounts
 
         Returns:
             list: list of service accounts
         """
-        accounts = []
-        for file in Path(f'{Path(__file__).parent}/gcp_env/').glob('*.sa'):
-            accounts.append(file.name.split('.')[1])
-        return accounts
+        try:
+            return self.state.service_accounts()
+        except Exception:
+            self.log.exception('Failed to get service accounts')
+        return []
 
+    @instrument()
     def list_service_accounts(self) -> bool:
         """List all service accounts
 
@@ -624,6 +2182,7 @@ class GCPCloudStorage():
             payload += '  ' + sa + ' (default)\n' if sa == default else '  ' + sa + '\n'
         return self.display_success(payload.strip())
 
+    @instrument()
     def set_default_service_account(self, default: str) -> bool:
         """Set the default service account
 
@@ -635,8 +2194,7 @@ class GCPCloudStorage():
         """
         if default in self.get_service_accounts():
             try:
-                with open(self.default_sa, 'w') as file:
-                    file.write(default)
+                self.state.set_setting('default_sa', default)
                 self.display_success(f'Set default service account to {default}')
                 return self.list_service_accounts()
             except Exception:
@@ -645,6 +2203,7 @@ class GCPCloudStorage():
             self.log.error(f'Service account {default} not found')
         return False
 
+    @instrument()
     def remove_service_account(self, service_account: str) -> bool:
         """Remove a service account. Cannot remove the default service account.
 
@@ -659,6 +2218,7 @@ class GCPCloudStorage():
             return False
         if service_account in self.get_service_accounts():
             try:
+                self.state.remove_service_account(service_account)
                 remove(f'{Path(__file__).parent}/gcp_env/.{service_account}.sa')
                 self.display_success(f'Removed service account {service_account}')
                 return self.list_service_accounts()
@@ -668,6 +2228,7 @@ class GCPCloudStorage():
             self.log.error(f'Service account {service_account} not found')
         return False
 
+    @instrument()
     def add_service_account(self, sa_path: str) -> bool:
         """Add a service account
 
@@ -683,12 +2244,18 @@ class GCPCloudStorage():
             if sa:
                 name = sa.get('client_email', '').split('@')[0]
                 if self._create_service_account_file(f'{Path(__file__).parent}/gcp_env/.{name}.sa', sa):
+                    try:
+                        self.state.add_service_account(name)
+                    except Exception:
+                        self.log.exception(f'Failed to register service account {name}')
+                        return False
                     self.display_success(f'Added service account {name}')
                     return self.list_service_accounts()
         else:
             self.log.error(f'File not found: {sa_path}')
         return False
 
+    @instrument()
     def list_used_buckets(self) -> bool:
         """List all used bucket names
 
@@ -708,6 +2275,7 @@ class GCPCloudStorage():
             self.log.exception('Failed to list used buckets')
         return False
 
+    @instrument()
     def set_default_bucket(self, default: str) -> bool:
         """Set the default bucket
 
@@ -719,14 +2287,14 @@ class GCPCloudStorage():
         """
         self._add_bucket_to_used_buckets(default)
         try:
-            with open(self.default_bucket, 'w') as file:
-                file.write(default)
+            self.state.set_setting('default_bucket', default)
             self.display_success(f'Set default bucket to {default}')
             return self.list_used_buckets()
         except Exception:
             self.log.exception(f'Failed to set default bucket to {default}')
         return False
 
+    @instrument()
     def remove_used_bucket(self, bucket_name: str) -> bool:
         """Remove a bucket from the used bucket tracker
 
@@ -738,12 +2306,9 @@ class GCPCloudStorage():
         """
         if bucket_name == self.__get_default_bucket():
             return self.display_error('Cannot remove default bucket')
-        used_buckets = self.__get_used_buckets()
-        if bucket_name in used_buckets:
-            used_buckets.remove(bucket_name)
+        if bucket_name in self.__get_used_buckets():
             try:
-                with open(self.used_buckets_file, 'w') as file:
-                    json.dump(used_buckets, file)
+                self.state.remove_used_bucket(bucket_name)
                 self.display_success(f'Removed bucket {bucket_name}')
                 return self.list_used_buckets()
             except Exception:
@@ -0,0 +1,162 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CODEC_METADATA_KEY = 'gstorage-codec'
+CONTENT_TYPE_METADATA_KEY = 'gstorage-content-type'
+CODEC_CONTENT_TYPES = {'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+
+def available_codecs() -> list:
+    """Get the compression codecs usable in this environment. zstd needs the optional zstandard package
+
+    Returns:
+        list: codec names
+    """
+    return ['gzip', 'zstd'] if zstandard is not None else ['gzip']
+
+
+def resolve_codec(codec: str | None) -> str | None:
+    """Resolve a requested codec. 'auto' picks zstd when available and gzip otherwise
+
+    Args:
+        codec (str | None): codec name, 'auto' or None for no compression
+
+    Raises:
+        ValueError: if the codec is unknown or not installed
+
+    Returns:
+        str | None: codec name or None
+    """
+    if not codec:
+        return None
+    codec = codec.lower()
+    if codec == 'auto':
+        return available_codecs()[-1]
+    if codec not in CODEC_CONTENT_TYPES:
+        raise ValueError(f'Unknown compression codec: {codec}')
+    if codec not in available_codecs():
+        raise ValueError(f'Compression codec {codec} requires the zstandard package')
+    return codec
+
+
+def compress_chunk(data: bytes, codec: str, level: int) -> bytes:
+    """Compress a chunk as one complete gzip member or zstd frame. Chunks compressed independently and
+    concatenated form a valid gzip or zstd stream, which DecompressStage and the command line tools decode in
+    sequence, so the chunks of a stream can be compressed in parallel
+
+    Args:
+        data (bytes): uncompressed chunk
+        codec (str): 'gzip' or 'zstd'
+        level (int): compression level
+
+    Returns:
+        bytes: compressed chunk
+    """
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class CompressStage():
+    chunk_resizes = True
+
+    def __init__(self, codec: str, level: int | None = None):
+        """Streaming compressor stage. Chunks pass through update() and the stream is terminated by flush()
+
+        Args:
+            codec (str): 'gzip' or 'zstd'
+            level (int | None, optional): compression level. Defaults to None (codec default).
+        """
+        self.codec = codec
+        self.level = DEFAULT_LEVELS[codec] if level is None else level
+        if codec == 'zstd':
+            self.__compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+        else:
+            self.__compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+    def update(self, data: bytes) -> bytes:
+        """Compress a chunk
+
+        Args:
+            data (bytes): uncompressed chunk
+
+        Returns:
+            bytes: compressed output available so far (may be empty)
+        """
+        return self.__compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """Finish the compressed stream
+
+        Returns:
+            bytes: remaining compressed output
+        """
+        return self.__compressor.flush()
+
+    def chunk_task(self, nbytes: int) -> tuple:
+        """Get the task compressing the next chunk on its own, for the process pool of gcp_storage.offload
+
+        Args:
+            nbytes (int): chunk size
+
+        Returns:
+            tuple: compress_chunk task
+        """
+        return ('compress', self.codec, self.level)
+
+
+class DecompressStage():
+    def __init__(self, codec: str):
+        """Streaming decompressor stage. Concatenated gzip members and zstd frames are decompressed in sequence
+
+        Args:
+            codec (str): 'gzip' or 'zstd'
+
+        Raises:
+            ValueError: if the codec is unknown or not installed
+        """
+        self.codec = resolve_codec(codec)
+        self.__decompressor = self.__new()
+
+    def __new(self):
+        """Create a decompressor for the next gzip member or zstd frame
+
+        Returns:
+            object: decompressor object
+        """
+        if self.codec == 'zstd':
+            return zstandard.ZstdDecompressor().decompressobj()
+        return zlib.decompressobj(47)
+
+    def update(self, data: bytes) -> bytes:
+        """Decompress a chunk
+
+        Args:
+            data (bytes): compressed chunk
+
+        Returns:
+            bytes: decompressed output
+        """
+        output = []
+        while data:
+            output.append(self.__decompressor.decompress(data))
+            data = self.__decompressor.unused_data
+            if data or getattr(self.__decompressor, 'eof', False):
+                self.__decompressor = self.__new()
+        return b''.join(output)
+
+    def flush(self) -> bytes:
+        """Finish decompression
+
+        Returns:
+            bytes: remaining decompressed output
+        """
+        flush = getattr(self.__decompressor, 'flush', None)
+        return flush() if flush else b''
@@ -0,0 +1,469 @@
+import gzip
+import json
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from hashlib import sha256
+from os import fstat, pwrite, urandom
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.cloud import storage
+
+from gcp_storage.cloud_storage import GCPCloudStorage
+from gcp_storage.compress import CompressStage, DecompressStage, resolve_codec
+from gcp_storage.metrics import instrument, metrics
+from gcp_storage.progress import make_progress
+from gcp_storage.streams import apply_stages
+
+
+MANIFEST_VERSION = 1
+CODEC_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+class Chunker():
+    # Gear table (one pseudo random byte per byte value) and the 16 byte weights of the window, fixed so chunk
+    # boundaries are stable across runs
+    __window = 16
+    __gear = bytes(sha256(bytes([value])).digest()[0] for value in range(256))
+    __weights = int.from_bytes(sha256(b'gstorage-chunker-weights').digest()[:__window], 'little')
+
+    def __init__(self, min_size: int = 256 * 1024, avg_size: int = 1024 * 1024, max_size: int = 4 * 1024 * 1024):
+        """Content-defined chunker with FastCDC boundaries. Every byte gets the digest of the 16 bytes ending at it,
+        a gear hash with one random weight per window position, so a boundary depends only on the bytes right
+        before it and an insert or delete only changes the chunks around it. Digests of a whole buffer are
+        computed at once: bytes.translate maps the bytes to their gear values and one big integer multiplication
+        by the window weights sums every window, so the scan runs in C instead of a per byte loop. A boundary is
+        cut where the high bits of the digests ending at a byte are zero, found with bytes.find: a stricter mask
+        before avg_size and a looser one after it keep chunk sizes close to the average (normalized chunking). The
+        first min_size bytes of a chunk are skipped
+
+        Args:
+            min_size (int, optional): minimum chunk size. Defaults to 256KB.
+            avg_size (int, optional): approximate average chunk size. Defaults to 1MB.
+            max_size (int, optional): maximum chunk size. Defaults to 4MB.
+        """
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        bits = max(1, (avg_size - min_size).bit_length() - 1)
+        self.__mask_small = divmod(bits + 1, 8)
+        self.__mask_large = divmod(max(1, bits - 1), 8)
+
+    @property
+    def params(self) -> dict:
+        """Chunker parameters recorded in the manifest
+
+        Returns:
+            dict: chunk size parameters
+        """
+        return {'algorithm': 'gear-window', 'min_size': self.min_size, 'avg_size': self.avg_size,
+                'max_size': self.max_size}
+
+    def digest(self, data: bytes) -> bytes:
+        """Get the rolling digest of every byte of data, the low byte of the weighted sum of the gear values of
+        the 16 bytes ending at it (carries also bring in a little of the sums before it)
+
+        Args:
+            data (bytes): data to digest
+
+        Returns:
+            bytes: one digest byte per byte of data, followed by a few bytes past its end that are not digests
+        """
+        values = int.from_bytes(data.translate(self.__gear), 'little') * self.__weights
+        return values.to_bytes(len(data) + self.__window + 1, 'little')
+
+    @staticmethod
+    def __find(digest: bytes, mask: tuple, position: int, stop: int) -> int:
+        """Find the first boundary ending between position and stop: zero_bytes zero digests ending at a byte,
+        preceded by a digest with its high bits zero
+
+        Args:
+            digest (bytes): digests of the buffer
+            mask (tuple): (zero bytes, high bits of the byte before them)
+            position (int): smallest chunk end
+            stop (int): largest chunk end
+
+        Returns:
+            int: chunk end or -1 if there is no boundary
+        """
+        zero_bytes, bits = mask
+        high = (0xFF << (8 - bits)) & 0xFF
+        if not zero_bytes:
+            for end in range(max(1, position), stop + 1):
+                if not digest[end - 1] & high:
+                    return end
+            return -1
+        zeros = bytes(zero_bytes)
+        index = digest.find(zeros, max(1 if bits else 0, position - zero_bytes), stop)
+        while index >= 0:
+            if not bits or not digest[index - 1] & high:
+                return index + zero_bytes
+            index = digest.find(zeros, index + 1, stop)
+        return -1
+
+    def cut(self, data: bytes, start: int = 0, digest: bytes | None = None) -> int:
+        """Find the end of the chunk starting at start
+
+        Args:
+            data (bytes): buffered data, holding at least max_size bytes after start unless it is the end of the
+                stream
+            start (int, optional): chunk start. Defaults to 0.
+            digest (bytes | None, optional): digest() of data, computed around the chunk if not given.
+                Defaults to None.
+
+        Returns:
+            int: chunk end
+        """
+        end = min(len(data), start + self.max_size)
+        position = start + self.min_size
+        if position >= end:
+            return end
+        offset = 0
+        if digest is None:
+            offset = max(0, start - 2 * self.__window)
+            digest = self.digest(data[offset:end])
+        for mask, stop in ((self.__mask_small, min(end, start + self.avg_size)), (self.__mask_large, end)):
+            if position < stop:
+                found = self.__find(digest, mask, position - offset, stop - offset)
+                if found >= 0:
+                    return found + offset
+            position = max(position, stop)
+        return end
+
+    def split(self, file: BinaryIO, read_size: int = 16 * 1024 * 1024) -> Iterable[bytes]:
+        """Split a stream into content-defined chunks
+
+        Args:
+            file (BinaryIO): stream to split
+            read_size (int, optional): bytes read at a time. Defaults to 16MB.
+
+        Yields:
+            bytes: next chunk
+        """
+        read_size = max(read_size, self.max_size)
+        buffer = b''
+        start = 0
+        eof = False
+        while True:
+            if not eof and len(buffer) - start < self.max_size:
+                block = file.read(read_size)
+                if block:
+                    buffer += block
+                    continue
+                eof = True
+            if start >= len(buffer):
+                return
+            digest = self.digest(buffer)
+            while len(buffer) - start >= self.max_size or (eof and start < len(buffer)):
+                cut = self.cut(buffer, start, digest)
+                yield buffer[start:cut]
+                start = cut
+            # Keep the window before the next chunk, so its digests do not depend on where the reads ended
+            keep = max(0, start - 2 * self.__window)
+            buffer = buffer[keep:]
+            start -= keep
+
+
+class DedupStore(GCPCloudStorage):
+    def __init__(self, bucket: str = 'default', service_account: str = 'default', prefix: str = 'dedup',
+                 workers: int = 8, compress: str | None = None, level: int | None = None,
+                 chunker: Chunker | None = None):
+        """Deduplicated backup store. Files are split into content-defined chunks stored once under
+        prefix/chunks/<sha256> and every backup writes a compact manifest listing its chunks under
+        prefix/manifests/<name>/<snapshot>.json.gz. Only chunks not already in the store are uploaded
+
+        Args:
+            bucket (str, optional): bucket name to use. Defaults to 'default'.
+            service_account (str, optional): service account to use. Defaults to 'default'.
+            prefix (str, optional): object prefix of the store. Defaults to 'dedup'.
+            workers (int, optional): parallel chunk uploads/downloads. Defaults to 8.
+            compress (str | None, optional): codec to compress new chunks with. Defaults to None.
+            level (int | None, optional): compression level. Defaults to None (codec default).
+            chunker (Chunker | None, optional): chunker to split files with. Defaults to None (1MB average).
+        """
+        super().__init__(bucket, service_account)
+        self.prefix = prefix.strip('/')
+        self.workers = max(1, workers)
+        self.compress = compress
+        self.level = level
+        self.chunker = chunker or Chunker()
+        self.__bucket: storage.Bucket | None = None
+
+    @property
+    def store_bucket(self) -> storage.Bucket:
+        """Bucket object shared by the worker threads. Created without a lookup request
+
+        Returns:
+            storage.Bucket: bucket object
+        """
+        if self.__bucket is None:
+            self.__bucket = self.client.bucket(self.bucket)
+        return self.__bucket
+
+    def chunk_path(self, digest: str, codec: str | None = None) -> str:
+        """Get the object path of a chunk
+
+        Args:
+            digest (str): sha256 hex digest of the chunk
+            codec (str | None, optional): codec the chunk is stored with. Defaults to None.
+
+        Returns:
+            str: chunk object path
+        """
+        return f'{self.prefix}/chunks/{digest}{CODEC_SUFFIXES.get(codec, "")}'
+
+    def manifest_path(self, name: str, snapshot: str) -> str:
+        """Get the object path of a snapshot manifest
+
+        Args:
+            name (str): backup name
+            snapshot (str): snapshot id
+
+        Returns:
+            str: manifest object path
+        """
+        return f'{self.prefix}/manifests/{name}/{snapshot}.json.gz'
+
+    def _run_parallel(self, func: Callable, items: Iterable) -> int:
+        """Run func over items on the worker pool with at most two tasks per worker in flight, so items (chunks)
+        produced by a generator are never all held in memory
+
+        Args:
+            func (Callable): function called with each item, returns a byte count
+            items (Iterable): items to process
+
+        Raises:
+            Exception: the first exception raised by func
+
+        Returns:
+            int: sum of the returned byte counts
+        """
+        total = 0
+        pending: set[Future] = set()
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='gstorage-dedup') as pool:
+            try:
+                for item in items:
+                    pending.add(pool.submit(func, item))
+                    if len(pending) >= self.workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        total += sum(future.result() for future in done)
+                total += sum(future.result() for future in wait(pending).done)
+            except Exception:
+                for future in pending:
+                    future.cancel()
+                raise
+        return total
+
+    @instrument()
+    def stored_chunks(self) -> set:
+        """Get the chunk object names already in the store
+
+        Returns:
+            set: chunk object names
+        """
+        try:
+            return {blob.name for blob in self.client.list_blobs(self.store_bucket, prefix=f'{self.prefix}/chunks/',
+                                                                 fields='items(name),nextPageToken')}
+        except Exception:
+            self.log.exception('Failed to list stored chunks')
+        return set()
+
+    def __upload_chunk(self, item: tuple) -> int:
+        """Upload a chunk unless an object with its name exists
+
+        Args:
+            item (tuple): (object path, chunk bytes)
+
+        Returns:
+            int: bytes uploaded
+        """
+        path, data = item
+        if self.compress:
+            data = apply_stages([CompressStage(resolve_codec(self.compress), self.level)], data, final=True)
+        try:
+            self.store_bucket.blob(path).upload_from_string(data, content_type='application/octet-stream',
+                                                            if_generation_match=0)
+        except PreconditionFailed:
+            return 0
+        return len(data)
+
+    @instrument()
+    def backup(self, file_path: str, name: str, progress: Callable | None = None) -> str:
+        """Back up a file as a new snapshot of name. Only chunks missing from the store are uploaded and the
+        manifest is written after all of its chunks, so a snapshot never references missing chunks. Snapshot ids
+        are the UTC time with a random suffix and manifests are only created, never replaced, so backups of the same
+        name in the same second keep both snapshots
+
+        Args:
+            file_path (str): file to back up
+            name (str): backup name
+            progress (Callable | None, optional): progress callback or Progress object. Defaults to None.
+
+        Returns:
+            str: snapshot id or empty string on failure
+        """
+        try:
+            codec = resolve_codec(self.compress)
+        except ValueError as error:
+            self.log.error(str(error))
+            return ''
+        stored = self.stored_chunks()
+        chunks = []
+        stats = {'chunks': 0, 'new_chunks': 0, 'new_bytes': 0}
+
+        def new_chunks(file: BinaryIO, tracker) -> Iterable[tuple]:
+            for data in self.chunker.split(file):
+                digest = sha256(data).hexdigest()
+                chunks.append([digest, len(data)])
+                path = self.chunk_path(digest, codec)
+                if path not in stored:
+                    stored.add(path)
+                    stats['new_chunks'] += 1
+                    stats['new_bytes'] += len(data)
+                    yield path, data
+                if tracker:
+                    tracker.update(len(data))
+
+        try:
+            with open(file_path, 'rb') as file:
+                tracker = make_progress(progress, fstat(file.fileno()).st_size, name)
+                uploaded = self._run_parallel(self.__upload_chunk, new_chunks(file, tracker))
+            metrics.add_bytes(uploaded)
+            snapshot = f'{datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")}-{urandom(4).hex()}'
+            manifest = {
+                'version': MANIFEST_VERSION,
+                'name': name,
+                'snapshot': snapshot,
+                'file': Path(file_path).name,
+                'size': sum(size for _, size in chunks),
+                'codec': codec,
+                'chunker': self.chunker.params,
+                'chunks': chunks,
+            }
+            self.store_bucket.blob(self.manifest_path(name, snapshot)).upload_from_string(
+                gzip.compress(json.dumps(manifest, separators=(',', ':')).encode()), content_type='application/gzip',
+                if_generation_match=0)
+            if tracker:
+                tracker.finish()
+            self.log.info(f'Backed up {file_path} as {name}/{snapshot}: {len(chunks)} chunks, {stats["new_chunks"]} '
+                          f'new ({stats["new_bytes"]} of {manifest["size"]} bytes, {uploaded} bytes uploaded)')
+            return snapshot
+        except Exception:
+            self.log.exception(f'Failed to back up {file_path}')
+        return ''
+
+    @instrument()
+    def snapshots(self, name: str) -> list:
+        """Get the snapshot ids of a backup, oldest first
+
+        Args:
+            name (str): backup name
+
+        Returns:
+            list: snapshot ids
+        """
+        prefix = f'{self.prefix}/manifests/{name}/'
+        try:
+            return sorted(blob.name[len(prefix):].removesuffix('.json.gz')
+                          for blob in self.client.list_blobs(self.store_bucket, prefix=prefix,
+                                                             fields='items(name),nextPageToken'))
+        except Exception:
+            self.log.exception(f'Failed to list snapshots of {name}')
+        return []
+
+    @instrument()
+    def load_manifest(self, name: str, snapshot: str = '') -> dict:
+        """Load a snapshot manifest
+
+        Args:
+            name (str): backup name
+            snapshot (str, optional): snapshot id. Defaults to '' (latest snapshot).
+
+        Returns:
+            dict: manifest or empty dict on failure
+        """
+        if not snapshot:
+            snapshots = self.snapshots(name)
+            if not snapshots:
+                self.log.error(f'No snapshots found for {name}')
+                return {}
+            snapshot = snapshots[-1]
+        try:
+            data = self.store_bucket.blob(self.manifest_path(name, snapshot)).download_as_bytes()
+            return json.loads(gzip.decompress(data))
+        except NotFound:
+            self.log.error(f'Snapshot not found: {name}/{snapshot}')
+        except Exception:
+            self.log.exception(f'Failed to load manifest {name}/{snapshot}')
+        return {}
+
+    @instrument()
+    def restore(self, name: str, destination_path: str, snapshot: str = '', progress: Callable | None = None) -> bool:
+        """Restore a snapshot to a file. Unique chunks are fetched in parallel, verified against their sha256 and
+        written at each of their offsets. A partially written file is removed on failure
+
+        Args:
+            name (str): backup name
+            destination_path (str): save file to this path
+            snapshot (str, optional): snapshot id. Defaults to '' (latest snapshot).
+            progress (Callable | None, optional): progress callback or Progress object. Defaults to None.
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        manifest = self.load_manifest(name, snapshot)
+        if not manifest:
+            return False
+        offsets: dict[str, list] = {}
+        position = 0
+        for digest, size in manifest['chunks']:
+            offsets.setdefault(digest, []).append(position)
+            position += size
+        codec = manifest.get('codec')
+        tracker = make_progress(progress, manifest['size'], name)
+        try:
+            with open(destination_path, 'wb') as file:
+                file.truncate(manifest['size'])
+                fd = file.fileno()
+
+                def fetch(digest: str) -> int:
+                    data = self.store_bucket.blob(self.chunk_path(digest, codec)).download_as_bytes()
+                    if codec:
+                        data = apply_stages([DecompressStage(codec)], data, final=True)
+                    if sha256(data).hexdigest() != digest:
+                        raise ValueError(f'Chunk {digest} failed verification')
+                    for offset in offsets[digest]:
+                        pwrite(fd, data, offset)
+                    if tracker:
+                        tracker.update(len(data) * len(offsets[digest]))
+                    return len(data)
+
+                metrics.add_bytes(self._run_parallel(fetch, offsets))
+            if tracker:
+                tracker.finish()
+            self.log.info(f'Restored {name}/{manifest["snapshot"]} to {destination_path}')
+            return True
+        except Exception:
+            self.log.exception(f'Failed to restore {name} to {destination_path}')
+            if Path(destination_path).exists():
+                Path(destination_path).unlink()
+        return False
+
+    @instrument()
+    def display_snapshots(self, name: str) -> bool:
+        """Display the snapshots of a backup with their sizes
+
+        Args:
+            name (str): backup name
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        snapshots = self.snapshots(name)
+        if not snapshots:
+            return self.display_error(f'No snapshots found for {name}')
+        payload = f'Snapshots of {name}:\n'
+        for snapshot in snapshots:
+            payload += f'  {snapshot}\n'
+        return self.display_success(payload.strip())
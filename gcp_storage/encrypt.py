@@ -5,6 +5,7 @@ from hashlib import sha256
 from cryptography.fernet import Fernet
 
 from gcp_storage.logger import get_logger
+from gcp_storage.profiler import span
 
 
 class Cipher:
@@ -72,13 +73,45 @@ class Cipher:
             bytes: encrypted/decrypted data
         """
         try:
-            key = sha256(passwd.encode()).digest()
-            extended_key = (key * (len(data) // len(key) + 1))[:len(data)]
-            return bytes([b ^ extended_key[i % len(extended_key)] for i, b in enumerate(data)])
+            return self.xor_chunk(data, self.passwd_key(passwd))
         except Exception:
             self.log.exception('Failed to encrypt/decrypt data')
         return b''
 
+    @staticmethod
+    def passwd_key(passwd: str) -> bytes:
+        """Derive the XOR key of a password
+
+        Args:
+            passwd (str): password
+
+        Returns:
+            bytes: 32 byte XOR key
+        """
+        return sha256(passwd.encode()).digest()
+
+    @staticmethod
+    def xor_chunk(data: bytes, key: bytes, offset: int = 0) -> bytes:
+        """XOR a chunk of a stream with the repeating key. offset is the position of the chunk in the stream, so
+        chunks can be processed one at a time and give the same result as passwd_xor on the whole data. The XOR
+        runs on python integers so the work happens in C instead of a per byte loop
+
+        Args:
+            data (bytes): chunk to encrypt/decrypt
+            key (bytes): XOR key from passwd_key
+            offset (int, optional): stream position of the chunk. Defaults to 0.
+
+        Returns:
+            bytes: encrypted/decrypted chunk
+        """
+        size = len(data)
+        if not size:
+            return b''
+        with span('crypto'):
+            start = offset % len(key)
+            stream = (key[start:] + key[:start]) * (size // len(key) + 1)
+            return (int.from_bytes(data, 'little') ^ int.from_bytes(stream[:size], 'little')).to_bytes(size, 'little')
+
     @staticmethod
     def encrypt(data: bytes, key: bytes) -> bytes:
         """Encrypt data using Fernet
@@ -90,7 +123,8 @@ class Cipher:
         Returns:
             bytes: encrypted data
         """
-        return Fernet(key).encrypt(data)
+        with span('crypto'):
+            return Fernet(key).encrypt(data)
 
     @staticmethod
     def decrypt(data: bytes, key: bytes) -> bytes:
@@ -103,4 +137,53 @@ class Cipher:
         Returns:
             bytes: decrypted data
         """
-        return Fernet(key).decrypt(data)
+        with span('crypto'):
+            return Fernet(key).decrypt(data)
+
+
+class PasswdXorStage():
+    chunk_resizes = False
+
+    def __init__(self, passwd: str):
+        """Streaming stage applying the password XOR cipher chunk by chunk. The same stage encrypts and decrypts
+
+        Args:
+            passwd (str): password
+        """
+        self.key = Cipher.passwd_key(passwd)
+        self.offset = 0
+
+    def update(self, data: bytes) -> bytes:
+        """Encrypt/decrypt the next chunk of the stream
+
+        Args:
+            data (bytes): chunk
+
+        Returns:
+            bytes: transformed chunk
+        """
+        output = Cipher.xor_chunk(data, self.key, self.offset)
+        self.offset += len(data)
+        return output
+
+    def flush(self) -> bytes:
+        """The XOR cipher keeps no buffered data
+
+        Returns:
+            bytes: empty bytes
+        """
+        return b''
+
+    def chunk_task(self, nbytes: int) -> tuple:
+        """Get the task encrypting/decrypting the next nbytes of the stream, for the process pool of
+        gcp_storage.offload. The stream position moves past the chunk
+
+        Args:
+            nbytes (int): chunk size
+
+        Returns:
+            tuple: xor_chunk task
+        """
+        task = ('xor', self.key, self.offset)
+        self.offset += nbytes
+        return task
@@ -1,5 +1,4 @@
 from pathlib import Path
-from json import dump
 
 from gcp_storage.cloud_storage import GCPCloudStorage
 
@@ -40,8 +39,7 @@ class Init(GCPCloudStorage):
             bool: True if the service account was set successfully, False otherwise
         """
         try:
-            with open(self.default_sa, 'w') as file:
-                file.write(self.service_account)
+            self.state.set_setting('default_sa', self.service_account)
             return True
         except Exception:
             self.log.exception('Failed to set default service account')
@@ -56,28 +54,32 @@ class Init(GCPCloudStorage):
         sa = self._load_json_service_account(self.__sa_path)
         if sa:
             self.service_account = sa.get('client_email', '').split('@')[0]
-            if self.__force or not Path(self.default_sa).exists():
+            if self.__force or not self.state.get_setting('default_sa'):
                 if not self.__set_default_service_account():
                     return False
             if self.__force or not Path(self.sa_file).exists():
-                return self._create_service_account_file(self.sa_file, sa)
-            self.log.info('Credentials file already exists. Use --force to overwrite if needed')
-            return True
+                if not self._create_service_account_file(self.sa_file, sa):
+                    return False
+            else:
+                self.log.info('Credentials file already exists. Use --force to overwrite if needed')
+            try:
+                self.state.add_service_account(self.service_account)
+                return True
+            except Exception:
+                self.log.exception('Failed to register service account')
+            return False
         return False
 
     def __create_bucket_trackers(self) -> bool:
-        """Create the bucket tracker files to get default and used buckets
+        """Set the default bucket and add it to the used buckets in the state store
 
         Returns:
             bool: True if the bucket trackers were created successfully, False
         """
         try:
-            if self.__force or not Path(self.default_bucket).exists():
-                with open(self.default_bucket, 'w') as file:
-                    file.write(self.bucket)
-            if self.__force or not Path(self.used_buckets_file).exists():
-                with open(self.used_buckets_file, 'w') as file:
-                    dump([self.bucket], file)
+            if self.__force or not self.state.get_setting('default_bucket'):
+                self.state.set_setting('default_bucket', self.bucket)
+            self.state.add_used_bucket(self.bucket)
             return True
         except Exception:
             self.log.exception('Failed to create bucket trackers')
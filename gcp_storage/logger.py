@@ -1,10 +1,19 @@
+import atexit
+import copy
+import json
 import logging
-from os import makedirs
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from os import environ, makedirs
 from os.path import join
-from time import gmtime
+from queue import SimpleQueue
+from time import gmtime, monotonic, strftime
 from pathlib import Path
 
 
+_listeners: dict = {}
+
+
 def _log_mapping(level: str) -> int:
     """Maps the log level to the logging level. Will default to INFO if the level is not found.
 
@@ -40,6 +49,88 @@ def _create_log_dir(dir_name: str) -> bool:
     return False
 
 
+def _env_flag(name: str) -> bool:
+    """Check if an environment variable is set to a true value
+
+    Args:
+        name (str): variable name
+
+    Returns:
+        bool: True for 1, true, yes or on
+    """
+    return environ.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line. Structured values passed with extra={'fields': {...}} are added
+    to the object"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Format the record as JSON
+
+        Args:
+            record (logging.LogRecord): log record
+
+        Returns:
+            str: JSON line
+        """
+        entry = {
+            'time': strftime('%Y-%m-%dT%H:%M:%S', gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        fields = getattr(record, 'fields', None)
+        if isinstance(fields, dict):
+            entry.update(fields)
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Prepare a record for the queue. The message is merged with its arguments and the traceback rendered to
+        exc_text, so the formatters of the listener thread still see the exception separately from the message. A copy
+        is changed, other handlers of the logger still get the original record
+
+        Args:
+            record (logging.LogRecord): log record
+
+        Returns:
+            logging.LogRecord: record safe to hand to another thread
+        """
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        record.exc_text = exc_text
+        record.exc_info = None
+        return record
+
+
+def stop_logging():
+    """Stop the background writer threads of queued loggers after writing out the queued records. Registered to
+    run at exit"""
+    while _listeners:
+        _, (listener, handler) = _listeners.popitem()
+        listener.stop()
+        for target in listener.handlers:
+            target.close()
+        handler.close()
+
+
+atexit.register(stop_logging)
+
+
 def _set_stream_handler(logger: logging.Logger, level: int, formatter: logging.Formatter) -> bool:
     """Set the stream handler for the logger.
 
@@ -96,23 +187,129 @@ def _set_file_handler(logger: logging.Logger, name: str, dir_name: str, level: i
     return False
 
 
-def get_logger(name: str, level: str = 'info', dir_name: str = ''):
-    """Get the logger or create it if it does not exist.
+def _set_queue_handler(logger: logging.Logger, name: str, level: int) -> bool:
+    """Move the handlers of the logger behind a queue. The logging threads only put records on the queue and a
+    background listener thread formats them and does the console and file writes
+
+    Args:
+        logger (logging.Logger): logging object with its handlers set
+        name (str): name of the logger
+        level (int): the logging level
+
+    Returns:
+        bool: True if the queue handler was set, False otherwise
+    """
+    try:
+        log_queue = SimpleQueue()
+        handlers = list(logger.handlers)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        queue_handler = _QueueHandler(log_queue)
+        queue_handler.setLevel(level)
+        logger.addHandler(queue_handler)
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners[name] = (listener, queue_handler)
+        return True
+    except Exception as error:
+        print(f'Failed to set queue handler: {error}')
+    return False
+
+
+def get_logger(name: str, level: str = 'info', dir_name: str = '', queued: bool | None = None,
+               json_format: bool | None = None):
+    """Get the logger or create it if it does not exist. GSTORAGE_LOG_LEVEL overrides the level,
+    GSTORAGE_LOG_QUEUE=1 enables queued logging and GSTORAGE_LOG_FORMAT=json the JSON formatter when the options
+    are not passed.
 
     Args:
         name (str): The name of the logger
         level (str, optional): logging level. Defaults to 'info'.
         dir_name (str, optional): directory to store logs. Defaults to ''.
+        queued (bool | None, optional): write the records from a background thread, so logging threads never wait
+            on the console or disk. Defaults to None (GSTORAGE_LOG_QUEUE).
+        json_format (bool | None, optional): format records as JSON lines. Defaults to None (GSTORAGE_LOG_FORMAT).
 
     Returns:
         logging.Logger: The logger object
     """
     logger = logging.getLogger(name)
-    level = _log_mapping(level)
+    level = _log_mapping(environ.get('GSTORAGE_LOG_LEVEL', level))
     logger.setLevel(level)
     if not logger.hasHandlers():
-        formatter = logging.Formatter('[%(asctime)s][%(levelname)s][%(module)s,%(lineno)d]: %(message)s')
-        formatter.converter = gmtime
+        if json_format is None:
+            json_format = environ.get('GSTORAGE_LOG_FORMAT', '').lower() == 'json'
+        if json_format:
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter('[%(asctime)s][%(levelname)s][%(module)s,%(lineno)d]: %(message)s')
+            formatter.converter = gmtime
         _set_stream_handler(logger, level, formatter)
         _set_file_handler(logger, name, dir_name, level, formatter)
+        if queued if queued is not None else _env_flag('GSTORAGE_LOG_QUEUE'):
+            _set_queue_handler(logger, name, level)
     return logger
+
+
+class LogSummary():
+    def __init__(self, log: logging.Logger, action: str, interval: float = 10.0, per_object: bool = False):
+        """Rate limited logging for bulk operations. Each object is logged at debug level, and a running summary at
+        info level at most once per interval, instead of one info line per object. finish() logs the final summary
+
+        Args:
+            log (logging.Logger): logger to write to
+            action (str): past tense action for the summary, e.g. 'Deleted'
+            interval (float, optional): seconds between running summaries. Defaults to 10.0.
+            per_object (bool, optional): log each object at info level as well. Defaults to False.
+        """
+        self.log = log
+        self.action = action
+        self.interval = interval
+        self.per_object = per_object
+        self.counts = {'done': 0, 'skipped': 0, 'failed': 0}
+        self.bytes = 0
+        self.__lock = threading.Lock()
+        self.__start = self.__last = monotonic()
+
+    def add(self, message: str = '', nbytes: int = 0, status: str = 'done'):
+        """Count an object, thread safe
+
+        Args:
+            message (str, optional): per object message. Defaults to ''.
+            nbytes (int, optional): bytes processed. Defaults to 0.
+            status (str, optional): 'done', 'skipped' or 'failed'. Defaults to 'done'.
+        """
+        now = monotonic()
+        with self.__lock:
+            self.counts[status] += 1
+            self.bytes += nbytes
+            due = now - self.__last >= self.interval
+            if due:
+                self.__last = now
+        if message:
+            self.log.log(logging.INFO if self.per_object else logging.DEBUG, message, stacklevel=2)
+        if due:
+            self.log.info(self.__summary('so far'), extra={'fields': self.__fields()}, stacklevel=2)
+
+    def __fields(self) -> dict:
+        return {'action': self.action, 'bytes': self.bytes, 'seconds': round(monotonic() - self.__start, 3),
+                **self.counts}
+
+    def __summary(self, detail: str) -> str:
+        detail = f' {detail}' if detail else ''
+        return (f'{self.action} {self.counts["done"]} objects ({self.bytes} bytes){detail}, '
+                f'{self.counts["skipped"]} skipped, {self.counts["failed"]} failed in '
+                f'{monotonic() - self.__start:.1f}s')
+
+    def finish(self, detail: str = '') -> dict:
+        """Log the final summary
+
+        Args:
+            detail (str, optional): text added after the byte count, e.g. the source and destination.
+                Defaults to ''.
+
+        Returns:
+            dict: object counts by status
+        """
+        self.log.info(self.__summary(detail), extra={'fields': self.__fields()}, stacklevel=2)
+        return dict(self.counts)
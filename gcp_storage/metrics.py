@@ -0,0 +1,547 @@
+import atexit
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from inspect import isgeneratorfunction
+from os import environ
+from time import perf_counter, time
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class _Sample():
+    def __init__(self, operation: str):
+        """A single in-flight operation measurement
+
+        Args:
+            operation (str): operation name
+        """
+        self.operation = operation
+        self.start = perf_counter()
+        self.bytes = 0
+        self.error = ''
+
+
+class _ErrorClassFilter(logging.Filter):
+    def __init__(self, metrics: 'Metrics'):
+        """Logger filter that tags the active operation samples with the class of any logged exception. The storage
+        methods catch and log their exceptions instead of raising, so this is where the error class is seen. A filter
+        is used instead of a handler so get_logger() still attaches its own handlers.
+
+        Args:
+            metrics (Metrics): metrics registry to tag samples in
+        """
+        super().__init__()
+        self.metrics = metrics
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Set the error class on every active sample of the current thread. Never drops the record
+
+        Args:
+            record (logging.LogRecord): log record
+
+        Returns:
+            bool: True
+        """
+        if record.levelno < logging.ERROR:
+            return True
+        error = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else record.levelname.lower()
+        for sample in self.metrics._active():
+            if not sample.error:
+                sample.error = error
+        return True
+
+
+class _Histogram():
+    def __init__(self, buckets: tuple):
+        """Cumulative latency histogram
+
+        Args:
+            buckets (tuple): bucket upper bounds in seconds
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Add a value to the histogram
+
+        Args:
+            value (float): observed value in seconds
+        """
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """Get the cumulative bucket counts including the +Inf bucket
+
+        Returns:
+            list: list of (upper bound, cumulative count) tuples
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation inside the matching bucket
+
+        Args:
+            q (float): quantile between 0 and 1
+
+        Returns:
+            float: estimated value in seconds
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        lower = 0.0
+        previous = 0
+        for bound, total in self.cumulative():
+            if total >= rank:
+                if bound == float('inf'):
+                    return lower
+                inside = total - previous
+                return lower + (bound - lower) * ((rank - previous) / inside if inside else 0)
+            lower, previous = bound, total
+        return lower
+
+
+class Metrics():
+    def __init__(self, enabled: bool = False, buckets: tuple = DEFAULT_BUCKETS):
+        """Process wide registry of operation counts, bytes, latency histograms and error classes. When disabled
+        the instrumented methods skip all bookkeeping.
+
+        Args:
+            enabled (bool, optional): start with metrics collection enabled. Defaults to False.
+            buckets (tuple, optional): latency histogram bucket bounds in seconds. Defaults to DEFAULT_BUCKETS.
+        """
+        self.enabled = False
+        self.buckets = buckets
+        self.started = time()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__filter = _ErrorClassFilter(self)
+        self.__operations: dict = {}
+        self.__counters: dict = {}
+        self.__gauges: dict = {}
+        self.__histograms: dict = {}
+        if enabled:
+            self.enable()
+
+    def enable(self, logger_name: str = 'gcp-storage'):
+        """Enable metrics collection
+
+        Args:
+            logger_name (str, optional): logger to watch for error classes. Defaults to 'gcp-storage'.
+        """
+        logger = logging.getLogger(logger_name)
+        if self.__filter not in logger.filters:
+            logger.addFilter(self.__filter)
+        self.enabled = True
+
+    def disable(self, logger_name: str = 'gcp-storage'):
+        """Disable metrics collection. Recorded values are kept until reset
+
+        Args:
+            logger_name (str, optional): logger watched for error classes. Defaults to 'gcp-storage'.
+        """
+        logging.getLogger(logger_name).removeFilter(self.__filter)
+        self.enabled = False
+
+    def reset(self):
+        """Clear all recorded values"""
+        with self.__lock:
+            self.__operations.clear()
+            self.__counters.clear()
+            self.__gauges.clear()
+            self.__histograms.clear()
+            self.started = time()
+
+    def _active(self) -> list:
+        """Get the stack of samples being measured on the current thread
+
+        Returns:
+            list: active samples, innermost last
+        """
+        stack = getattr(self.__local, 'stack', None)
+        if stack is None:
+            stack = self.__local.stack = []
+        return stack
+
+    def _begin(self, operation: str) -> _Sample:
+        """Start measuring an operation on the current thread
+
+        Args:
+            operation (str): operation name
+
+        Returns:
+            _Sample: the started sample
+        """
+        sample = _Sample(operation)
+        self._active().append(sample)
+        return sample
+
+    @contextmanager
+    def _resumed(self, sample: _Sample):
+        """Make a sample active on the current thread for the enclosed block only, for generators measured one
+        resume step at a time so the work of their consumer is not charged to them
+
+        Args:
+            sample (_Sample): sample to activate
+
+        Yields:
+            _Sample: the sample
+        """
+        stack = self._active()
+        stack.append(sample)
+        try:
+            yield sample
+        finally:
+            if sample in stack:
+                stack.remove(sample)
+
+    def _end(self, sample: _Sample, error: str = ''):
+        """Finish measuring an operation and record it
+
+        Args:
+            sample (_Sample): sample returned by _begin
+            error (str, optional): error class of a failed operation. Defaults to '' (succeeded).
+        """
+        stack = self._active()
+        if sample in stack:
+            stack.remove(sample)
+        self.observe(sample.operation, perf_counter() - sample.start, sample.bytes, error)
+
+    def add_bytes(self, nbytes: int):
+        """Add transferred bytes to every operation being measured on the current thread
+
+        Args:
+            nbytes (int): number of bytes moved
+        """
+        if self.enabled:
+            for sample in self._active():
+                sample.bytes += nbytes
+
+    def observe(self, operation: str, seconds: float, nbytes: int = 0, error: str = ''):
+        """Record a completed operation
+
+        Args:
+            operation (str): operation name
+            seconds (float): operation latency
+            nbytes (int, optional): bytes transferred. Defaults to 0.
+            error (str, optional): error class if the operation failed. Defaults to ''.
+        """
+        with self.__lock:
+            stats = self.__operations.get(operation)
+            if stats is None:
+                stats = self.__operations[operation] = {
+                    'count': 0, 'bytes': 0, 'errors': {}, 'latency': _Histogram(self.buckets)}
+            stats['count'] += 1
+            stats['bytes'] += nbytes
+            stats['latency'].observe(seconds)
+            if error:
+                stats['errors'][error] = stats['errors'].get(error, 0) + 1
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Increment a free-form counter
+
+        Args:
+            name (str): counter name
+            value (float, optional): amount to add. Defaults to 1.
+        """
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            with self.__lock:
+                self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """Set a free-form gauge
+
+        Args:
+            name (str): gauge name
+            value (float): gauge value
+        """
+        if self.enabled:
+            with self.__lock:
+                self.__gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def max_gauge(self, name: str, value: float, **labels):
+        """Raise a free-form gauge to value if it is higher than the current value (high-water marks)
+
+        Args:
+            name (str): gauge name
+            value (float): candidate value
+        """
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            with self.__lock:
+                if value > self.__gauges.get(key, float('-inf')):
+                    self.__gauges[key] = value
+
+    def histogram(self, name: str, value: float, **labels):
+        """Add a value to a free-form histogram, for durations that are not storage operations (queue waits)
+
+        Args:
+            name (str): histogram name
+            value (float): observed value in seconds
+        """
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            with self.__lock:
+                histogram = self.__histograms.get(key)
+                if histogram is None:
+                    histogram = self.__histograms[key] = _Histogram(self.buckets)
+                histogram.observe(value)
+
+    def track(self, operation: str):
+        """Context manager measuring the enclosed block as operation
+
+        Args:
+            operation (str): operation name
+
+        Returns:
+            _Track: context manager yielding the active sample or None when disabled
+        """
+        return _Track(self, operation)
+
+    def snapshot(self) -> dict:
+        """Get a JSON serializable snapshot of all recorded values
+
+        Returns:
+            dict: metrics snapshot
+        """
+        with self.__lock:
+            operations = {}
+            for operation, stats in sorted(self.__operations.items()):
+                latency: _Histogram = stats['latency']
+                operations[operation] = {
+                    'count': stats['count'],
+                    'bytes': stats['bytes'],
+                    'errors': dict(stats['errors']),
+                    'latency_seconds': {
+                        'sum': round(latency.sum, 6),
+                        'mean': round(latency.sum / latency.count, 6) if latency.count else 0.0,
+                        'p50': round(latency.quantile(0.5), 6),
+                        'p90': round(latency.quantile(0.9), 6),
+                        'p99': round(latency.quantile(0.99), 6),
+                        'buckets': {str(bound): total for bound, total in latency.cumulative()},
+                    },
+                }
+            return {
+                'started': self.started,
+                'captured': time(),
+                'operations': operations,
+                'counters': [{'name': n, 'labels': dict(lb), 'value': v} for (n, lb), v in self.__counters.items()],
+                'gauges': [{'name': n, 'labels': dict(lb), 'value': v} for (n, lb), v in self.__gauges.items()],
+                'histograms': [{'name': n, 'labels': dict(lb), 'count': h.count, 'sum': round(h.sum, 6),
+                                'p50': round(h.quantile(0.5), 6), 'p99': round(h.quantile(0.99), 6),
+                                'buckets': {str(bound): total for bound, total in h.cumulative()}}
+                               for (n, lb), h in self.__histograms.items()],
+            }
+
+    @staticmethod
+    def __labels(labels: dict) -> str:
+        """Format prometheus labels
+
+        Args:
+            labels (dict): label names and values
+
+        Returns:
+            str: formatted label set including braces or empty string
+        """
+        if not labels:
+            return ''
+        escaped = [f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                   for k, v in labels.items()]
+        return '{' + ','.join(escaped) + '}'
+
+    def to_prometheus(self) -> str:
+        """Render all recorded values in the Prometheus text exposition format
+
+        Returns:
+            str: prometheus text
+        """
+        snap = self.snapshot()
+        lines = [
+            '# HELP gstorage_operations_total Number of storage operations',
+            '# TYPE gstorage_operations_total counter',
+        ]
+        for op, stats in snap['operations'].items():
+            lines.append(f'gstorage_operations_total{self.__labels({"operation": op})} {stats["count"]}')
+        lines += ['# HELP gstorage_operation_bytes_total Bytes transferred by storage operations',
+                  '# TYPE gstorage_operation_bytes_total counter']
+        for op, stats in snap['operations'].items():
+            lines.append(f'gstorage_operation_bytes_total{self.__labels({"operation": op})} {stats["bytes"]}')
+        lines += ['# HELP gstorage_operation_errors_total Failed storage operations by error class',
+                  '# TYPE gstorage_operation_errors_total counter']
+        for op, stats in snap['operations'].items():
+            for error, count in stats['errors'].items():
+                lines.append(
+                    f'gstorage_operation_errors_total{self.__labels({"operation": op, "error": error})} {count}')
+        lines += ['# HELP gstorage_operation_duration_seconds Storage operation latency',
+                  '# TYPE gstorage_operation_duration_seconds histogram']
+        for op, stats in snap['operations'].items():
+            latency = stats['latency_seconds']
+            for bound, total in latency['buckets'].items():
+                le = '+Inf' if bound == 'inf' else bound
+                lines.append(
+                    f'gstorage_operation_duration_seconds_bucket{self.__labels({"operation": op, "le": le})} {total}')
+            lines.append(f'gstorage_operation_duration_seconds_sum{self.__labels({"operation": op})} '
+                         f'{latency["sum"]}')
+            lines.append(f'gstorage_operation_duration_seconds_count{self.__labels({"operation": op})} '
+                         f'{stats["count"]}')
+        for kind, entries in (('counter', snap['counters']), ('gauge', snap['gauges'])):
+            declared = set()
+            for entry in entries:
+                name = f'gstorage_{entry["name"]}'
+                if name not in declared:
+                    lines.append(f'# TYPE {name} {kind}')
+                    declared.add(name)
+                lines.append(f'{name}{self.__labels(entry["labels"])} {entry["value"]}')
+        declared = set()
+        for entry in snap['histograms']:
+            name = f'gstorage_{entry["name"]}'
+            if name not in declared:
+                lines.append(f'# TYPE {name} histogram')
+                declared.add(name)
+            for bound, total in entry['buckets'].items():
+                labels = {**entry['labels'], 'le': '+Inf' if bound == 'inf' else bound}
+                lines.append(f'{name}_bucket{self.__labels(labels)} {total}')
+            lines.append(f'{name}_sum{self.__labels(entry["labels"])} {entry["sum"]}')
+            lines.append(f'{name}_count{self.__labels(entry["labels"])} {entry["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path: str) -> bool:
+        """Write the metrics to file. Files ending with .prom or .txt get the Prometheus text format, anything else
+        gets a JSON snapshot
+
+        Args:
+            path (str): file path to write
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            with open(path, 'w') as file:
+                if path.endswith(('.prom', '.txt')):
+                    file.write(self.to_prometheus())
+                else:
+                    json.dump(self.snapshot(), file, indent=2)
+            return True
+        except Exception as error:
+            print(f'Failed to export metrics: {error}')
+        return False
+
+
+class _Track():
+    def __init__(self, metrics: Metrics, operation: str):
+        """Context manager measuring a block of code as an operation
+
+        Args:
+            metrics (Metrics): metrics registry
+            operation (str): operation name
+        """
+        self.metrics = metrics
+        self.operation = operation
+        self.sample: _Sample | None = None
+
+    def __enter__(self) -> _Sample | None:
+        if self.metrics.enabled:
+            self.sample = self.metrics._begin(self.operation)
+        return self.sample
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.sample is not None:
+            self.metrics._end(self.sample, exc_type.__name__ if exc_type else self.sample.error)
+        return False
+
+
+def instrument(operation: str = ''):
+    """Decorator recording count, latency, bytes and error class of every call to the decorated method. A call
+    returning False, or an empty result after logging an error, is recorded as failed with the logged error class.
+    Only the outermost measured call of a thread is recorded: an instrumented call made while another operation is
+    measured on the same thread is part of that operation, so its count and bytes are not recorded twice.
+
+    Args:
+        operation (str, optional): operation name. Defaults to '' and uses the function name.
+    """
+    def decorator(func):
+        name = operation or func.__name__
+        if isgeneratorfunction(func):
+            @wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                if not metrics.enabled or metrics._active():
+                    return (yield from func(*args, **kwargs))
+                # The sample is only active while the generator runs, not while it is suspended in its consumer
+                sample = _Sample(name)
+                generator = func(*args, **kwargs)
+                resume, value = generator.send, None
+                error = ''
+                try:
+                    while True:
+                        with metrics._resumed(sample):
+                            try:
+                                item = resume(value)
+                            except StopIteration as stop:
+                                error = sample.error
+                                return stop.value
+                        try:
+                            value = yield item
+                            resume = generator.send
+                        except GeneratorExit:
+                            with metrics._resumed(sample):
+                                generator.close()
+                            raise
+                        except BaseException as exc:
+                            resume, value = generator.throw, exc
+                except GeneratorExit:
+                    raise
+                except BaseException as exc:
+                    error = type(exc).__name__
+                    raise
+                finally:
+                    metrics._end(sample, error)
+            return generator_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled or metrics._active():
+                return func(*args, **kwargs)
+            sample = metrics._begin(name)
+            error = ''
+            try:
+                result = func(*args, **kwargs)
+                if result is False or (result is not True and not result and sample.error):
+                    error = sample.error or 'failed'
+                return result
+            except BaseException as exc:
+                error = type(exc).__name__
+                raise
+            finally:
+                metrics._end(sample, error)
+        return wrapper
+    return decorator
+
+
+def _export_at_exit():
+    """Write the metrics to the GSTORAGE_METRICS path when the process exits"""
+    path = environ.get('GSTORAGE_METRICS', '')
+    if path:
+        metrics.export(path)
+
+
+metrics = Metrics(enabled=bool(environ.get('GSTORAGE_METRICS')))
+atexit.register(_export_at_exit)
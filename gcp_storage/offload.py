@@ -0,0 +1,398 @@
+import atexit
+import multiprocessing
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from os import environ
+
+from gcp_storage.budget import memory_budget
+from gcp_storage.compress import compress_chunk
+from gcp_storage.encrypt import Cipher
+from gcp_storage.metrics import metrics
+from gcp_storage.streams import apply_stages
+
+
+OFFLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+OFFLOAD_MIN_SIZE = 32 * 1024 * 1024
+CHUNK_TASKS = {'xor': Cipher.xor_chunk, 'compress': compress_chunk}
+
+
+def run_tasks(data: bytes, tasks: list) -> bytes:
+    """Run chunk tasks (from the chunk_task() of stages) on a chunk in order
+
+    Args:
+        data (bytes): chunk
+        tasks (list): (task name, *arguments) tuples
+
+    Returns:
+        bytes: transformed chunk
+    """
+    for name, *args in tasks:
+        data = CHUNK_TASKS[name](data, *args)
+    return data
+
+
+def _run_chunk(segment_name: str, length: int, tasks: list) -> int:
+    """Run chunk tasks in a worker process on the chunk at the start of a shared memory segment and write the result
+    back in its place. Only the segment name and the tasks are pickled, never the payload
+
+    Args:
+        segment_name (str): shared memory segment name
+        length (int): chunk size
+        tasks (list): (task name, *arguments) tuples
+
+    Raises:
+        ValueError: if the result does not fit in the segment
+
+    Returns:
+        int: result size
+    """
+    segment = shared_memory.SharedMemory(segment_name)
+    try:
+        with segment.buf[:length] as view:
+            data = run_tasks(view, tasks)
+        if len(data) > segment.size:
+            raise ValueError(f'Transformed chunk of {len(data)} bytes does not fit in {segment.size} bytes')
+        segment.buf[:len(data)] = data
+        return len(data)
+    finally:
+        segment.close()
+
+
+def _init_worker():
+    """Keep worker processes from exporting metrics over the file of the parent process when they exit"""
+    environ.pop('GSTORAGE_METRICS', None)
+
+
+def _release_segments(segments: list, capacity: int):
+    """Close and unlink shared memory segments and return them to the memory budget
+
+    Args:
+        segments (list): segments to release, emptied
+        capacity (int): size of each segment
+    """
+    for segment in segments:
+        segment.close()
+        segment.unlink()
+    memory_budget.release(capacity * len(segments))
+    segments.clear()
+
+
+class _Chunk():
+    __slots__ = ('index', 'group', 'data', 'length', 'segment', 'future')
+
+    def __init__(self, index: int):
+        """Chunk moving through the stage groups of an OffloadStages. The chunk is either in data (on the calling
+        thread) or in the first length bytes of its shared memory segment
+
+        Args:
+            index (int): chunk position in the stream
+        """
+        self.index = index
+        self.group = 0
+        self.data: bytes | None = None
+        self.length = 0
+        self.segment: shared_memory.SharedMemory | None = None
+        self.future: Future | None = None
+
+
+class ProcessOffloader():
+    def __init__(self, workers: int = 0, min_size: int = OFFLOAD_MIN_SIZE, chunk_size: int = OFFLOAD_CHUNK_SIZE):
+        """Process pool running the CPU bound transform stages (compression, encryption) of large transfers on several
+        cores instead of one thread holding the GIL. The pool is started on first use with the forkserver start
+        method, so worker processes are not forked from a process running transfer threads, and shut down at exit
+
+        Args:
+            workers (int, optional): worker processes, less than 2 keeps every transfer on its thread. Defaults to 0.
+            min_size (int, optional): smallest transfer sent to the pool. Defaults to OFFLOAD_MIN_SIZE.
+            chunk_size (int, optional): chunk size sent to a worker. Defaults to OFFLOAD_CHUNK_SIZE.
+        """
+        self.workers = workers
+        self.min_size = min_size
+        self.chunk_size = max(1, chunk_size)
+        self.__lock = threading.Lock()
+        self.__pool: ProcessPoolExecutor | None = None
+        self.__exit_registered = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 1
+
+    def __get_pool(self) -> ProcessPoolExecutor:
+        with self.__lock:
+            if self.__pool is None:
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload(['gcp_storage.offload'])
+                else:
+                    context = multiprocessing.get_context('spawn')
+                self.__pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker)
+                if not self.__exit_registered:
+                    atexit.register(self.shutdown)
+                    self.__exit_registered = True
+            return self.__pool
+
+    def submit(self, segment_name: str, length: int, tasks: list) -> Future:
+        """Run chunk tasks on a shared memory chunk in the pool. A pool broken by a dead worker is replaced
+
+        Args:
+            segment_name (str): shared memory segment name
+            length (int): chunk size
+            tasks (list): (task name, *arguments) tuples
+
+        Returns:
+            Future: future of the result size
+        """
+        pool = self.__get_pool()
+        try:
+            return pool.submit(_run_chunk, segment_name, length, tasks)
+        except BrokenProcessPool:
+            with self.__lock:
+                if self.__pool is pool:
+                    self.__pool = None
+            return self.__get_pool().submit(_run_chunk, segment_name, length, tasks)
+
+    def shutdown(self):
+        """Stop the worker processes. The pool is started again by the next offloaded transfer"""
+        with self.__lock:
+            pool, self.__pool = self.__pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def stages(self, stages: list, size: int) -> list:
+        """Get the stages to use for a transfer. Transfers of at least min_size with a stage that can run on chunks
+        get one OffloadStages running the chain, smaller transfers keep the stages on their thread
+
+        Args:
+            stages (list): transform stages in order
+            size (int): transfer size in bytes
+
+        Returns:
+            list: stages to pass to apply_stages, TransformReader or TransformWriter
+        """
+        if self.enabled and size >= self.min_size and any(hasattr(stage, 'chunk_task') for stage in stages):
+            return [OffloadStages(stages, self)]
+        return stages
+
+
+class OffloadStages():
+    def __init__(self, stages: list, offloader: ProcessOffloader):
+        """Transform stage running a chain of stages on fixed size chunks. Runs of stages with a chunk_task()
+        (compression, encryption) process each chunk in a worker process, the chunk is copied into a shared memory
+        segment once and the workers transform it in place. The other stages (checksums, decompression) run on the
+        calling thread in stream order. A stage changing the chunk size ends its run, so the stream position of the
+        stages after it is known before a chunk is sent to them. Output is returned in stream order. Compressed
+        chunks are separate gzip members or zstd frames. The segments are released by flush() or close(), or by a
+        finalizer when an abandoned transfer is collected or the process exits
+
+        Args:
+            stages (list): transform stages in order
+            offloader (ProcessOffloader): process pool
+        """
+        self.stages = stages
+        self.offloader = offloader
+        self.chunk_size = offloader.chunk_size
+        self.capacity = self.chunk_size + self.chunk_size // 64 + 64 * 1024
+        self.depth = max(2, offloader.workers * 2)
+        self.groups = self.__group(stages)
+        self.__input = bytearray()
+        self.__chunks: deque = deque()
+        self.__entered = [0] * len(self.groups)
+        self.__started = 0
+        self.__output: list = []
+        self.__segments: list = []
+        self.__free: list = []
+        weakref.finalize(self, _release_segments, self.__segments, self.capacity)
+
+    @staticmethod
+    def __group(stages: list) -> list:
+        """Split the stages into runs of offloaded and calling thread stages
+
+        Args:
+            stages (list): transform stages in order
+
+        Returns:
+            list: (offloaded, stages) tuples
+        """
+        groups = []
+        for stage in stages:
+            offloaded = hasattr(stage, 'chunk_task')
+            if groups and groups[-1][0] == offloaded and not (offloaded and groups[-1][1][-1].chunk_resizes):
+                groups[-1][1].append(stage)
+            else:
+                groups.append((offloaded, [stage]))
+        return groups
+
+    def __segment(self) -> shared_memory.SharedMemory:
+        """Get a free shared memory segment, creating one charged to the memory budget if none is free
+
+        Returns:
+            shared_memory.SharedMemory: segment
+        """
+        if self.__free:
+            return self.__free.pop()
+        memory_budget.charge(self.capacity)
+        segment = shared_memory.SharedMemory(create=True, size=self.capacity)
+        self.__segments.append(segment)
+        return segment
+
+    def __start(self, chunk):
+        """Add a chunk to the stream. It goes straight into a segment if the first stage group is offloaded
+
+        Args:
+            chunk (bytes | memoryview): chunk of at most chunk_size bytes
+        """
+        record = _Chunk(self.__started)
+        self.__started += 1
+        if self.groups[0][0]:
+            record.segment = self.__segment()
+            record.segment.buf[:len(chunk)] = chunk
+            record.length = len(chunk)
+        else:
+            record.data = bytes(chunk)
+        self.__chunks.append(record)
+        self.__pump(self.depth)
+
+    def __enter(self, record: _Chunk):
+        """Pass a chunk to its next stage group, in a worker process or on the calling thread
+
+        Args:
+            record (_Chunk): chunk
+        """
+        offloaded, stages = self.groups[record.group]
+        if not offloaded:
+            data = record.data if record.data is not None else bytes(record.segment.buf[:record.length])
+            record.data = apply_stages(stages, data)
+            record.group += 1
+            return None
+        if record.data is not None:
+            if record.segment is None:
+                record.segment = self.__segment()
+            record.length = len(record.data)
+        tasks = [stage.chunk_task(record.length) for stage in stages]
+        if record.data is not None:
+            if record.length > self.capacity:
+                record.data = run_tasks(record.data, tasks)
+                record.group += 1
+                return None
+            record.segment.buf[:record.length] = record.data
+            record.data = None
+        metrics.inc('offload_chunks')
+        record.future = self.offloader.submit(record.segment.name, record.length, tasks)
+
+    def __advance(self):
+        """Move every chunk as far through the stage groups as possible without waiting. A chunk enters a group
+        after the chunks before it, so stages see the stream in order, and finished chunks leave in order"""
+        for record in self.__chunks:
+            while record.group < len(self.groups):
+                if record.future is not None:
+                    if not record.future.done():
+                        break
+                    record.length = record.future.result()
+                    record.future = None
+                    record.group += 1
+                elif self.__entered[record.group] == record.index:
+                    self.__entered[record.group] += 1
+                    self.__enter(record)
+                else:
+                    break
+        while self.__chunks and self.__chunks[0].group == len(self.groups):
+            record = self.__chunks.popleft()
+            if record.data is None:
+                record.data = bytes(record.segment.buf[:record.length])
+            self.__output.append(record.data)
+            if record.segment is not None:
+                self.__free.append(record.segment)
+
+    def __pump(self, limit: int):
+        """Advance the chunks, waiting for the workers while more than limit chunks are in flight
+
+        Args:
+            limit (int): chunks allowed in flight
+        """
+        self.__advance()
+        while len(self.__chunks) > limit:
+            running = [record.future for record in self.__chunks if record.future is not None]
+            if not running:
+                break
+            wait(running, return_when=FIRST_COMPLETED)
+            self.__advance()
+
+    def __take(self) -> bytes:
+        output = b''.join(self.__output)
+        self.__output.clear()
+        return output
+
+    def update(self, data: bytes) -> bytes:
+        """Add data to the stream. Full chunks are sent through the stages, waiting only while the workers are busy
+        with the chunks before them
+
+        Args:
+            data (bytes): chunk of any size
+
+        Returns:
+            bytes: output of the chunks finished so far, in order (may be empty)
+        """
+        view = memoryview(data).cast('B')
+        position = 0
+        if self.__input:
+            position = min(len(view), self.chunk_size - len(self.__input))
+            self.__input += view[:position]
+            if len(self.__input) == self.chunk_size:
+                self.__start(self.__input)
+                self.__input = bytearray()
+        while len(view) - position >= self.chunk_size:
+            self.__start(view[position:position + self.chunk_size])
+            position += self.chunk_size
+        self.__input += view[position:]
+        return self.__take()
+
+    def flush(self) -> bytes:
+        """Finish the stream: send the last partial chunk, wait for all chunks and flush the calling thread stages
+        through the stages after them. The shared memory segments are released
+
+        Returns:
+            bytes: remaining output
+        """
+        try:
+            if self.__input:
+                self.__start(self.__input)
+                self.__input = bytearray()
+            self.__pump(0)
+            data = b''
+            for offloaded, stages in self.groups:
+                if not offloaded:
+                    data = apply_stages(stages, data, final=True)
+                elif data:
+                    data = run_tasks(data, [stage.chunk_task(len(data)) for stage in stages])
+            self.__output.append(data)
+            return self.__take()
+        finally:
+            self.close()
+
+    def close(self):
+        """Release the shared memory segments. Chunks still in flight are abandoned"""
+        for record in self.__chunks:
+            if record.future is not None:
+                record.future.cancel()
+        self.__chunks.clear()
+        self.__free.clear()
+        _release_segments(self.__segments, self.capacity)
+
+
+def _env_offloader() -> ProcessOffloader:
+    try:
+        workers = int(environ.get('GSTORAGE_OFFLOAD_WORKERS', 0))
+    except ValueError:
+        workers = 0
+    try:
+        min_size = int(float(environ.get('GSTORAGE_OFFLOAD_MIN_MB', OFFLOAD_MIN_SIZE / 1024 / 1024)) * 1024 * 1024)
+    except ValueError:
+        min_size = OFFLOAD_MIN_SIZE
+    return ProcessOffloader(workers, min_size)
+
+
+offloader = _env_offloader()
@@ -0,0 +1,534 @@
+import gzip
+import json
+import struct
+from datetime import datetime, timezone
+from io import BytesIO
+from os import urandom
+from pathlib import Path
+from typing import Iterable
+
+import google_crc32c
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.cloud import storage
+
+from gcp_storage.cloud_storage import GCPCloudStorage
+from gcp_storage.metrics import instrument, metrics
+
+
+PACK_MAGIC = b'GSPACK01'
+PACK_TRAILER = struct.Struct('>Q8s')
+INDEX_VERSION = 1
+
+
+class PackStore(GCPCloudStorage):
+    def __init__(self, bucket: str = 'default', service_account: str = 'default', prefix: str = 'packs',
+                 pack_size: int = 64 * 1024 * 1024):
+        """Store for many small files. Files are concatenated into pack objects of about pack_size bytes under
+        prefix/data/. Each pack ends with a footer index (name, offset, length, crc32c) followed by the footer
+        length and a magic trailer, so the index can always be rebuilt from the packs. The store index at
+        prefix/index.json.gz maps logical names to (pack, offset, length, crc32c) and is cached locally, keyed by
+        the index object generation, so reading a logical file is a single ranged GET
+
+        Args:
+            bucket (str, optional): bucket name to use. Defaults to 'default'.
+            service_account (str, optional): service account to use. Defaults to 'default'.
+            prefix (str, optional): object prefix of the store. Defaults to 'packs'.
+            pack_size (int, optional): target pack object size. Defaults to 64MB.
+        """
+        super().__init__(bucket, service_account)
+        self.prefix = prefix.strip('/')
+        self.pack_size = pack_size
+        self.__bucket: storage.Bucket | None = None
+        self.__index: dict | None = None
+        self.__generation = 0
+
+    @property
+    def store_bucket(self) -> storage.Bucket:
+        """Bucket object created without a lookup request
+
+        Returns:
+            storage.Bucket: bucket object
+        """
+        if self.__bucket is None:
+            self.__bucket = self.client.bucket(self.bucket)
+        return self.__bucket
+
+    @property
+    def index_path(self) -> str:
+        """Get the object path of the store index
+
+        Returns:
+            str: index object path
+        """
+        return f'{self.prefix}/index.json.gz'
+
+    @property
+    def index_cache_file(self) -> str:
+        """Get the local index cache file path
+
+        Returns:
+            str: index cache file path
+        """
+        return f'{Path(__file__).parent}/gcp_env/.pack-{self.bucket}-{self.prefix.replace("/", "_")}.json.gz'
+
+    @property
+    def index(self) -> dict:
+        """Get the store index. Loaded on first use
+
+        Returns:
+            dict: index with 'files' {name: [pack, offset, length, crc32c]} and 'packs' {pack: size}
+        """
+        if self.__index is None:
+            self.__index = self.__load_index()
+        return self.__index
+
+    @staticmethod
+    def __empty_index() -> dict:
+        return {'version': INDEX_VERSION, 'files': {}, 'packs': {}}
+
+    def __index_blob(self) -> storage.Blob | None:
+        """Load the index object metadata and remember its generation for the conditional index upload
+
+        Returns:
+            storage.Blob | None: index blob or None if the store has no index yet
+        """
+        blob = self.store_bucket.blob(self.index_path)
+        try:
+            blob.reload()
+        except NotFound:
+            self.__generation = 0
+            return None
+        self.__generation = blob.generation
+        return blob
+
+    def __load_index(self) -> dict:
+        """Load the store index. The local cache is used when its generation matches the index object, which costs
+        a metadata request instead of downloading the index
+
+        Returns:
+            dict: store index
+
+        Raises:
+            Exception: if the index exists but cannot be loaded
+        """
+        blob = self.__index_blob()
+        if blob is None:
+            return self.__empty_index()
+        try:
+            with open(self.index_cache_file, 'rb') as file:
+                cached = json.loads(gzip.decompress(file.read()))
+            if cached.get('generation') == blob.generation:
+                return cached['index']
+        except FileNotFoundError:
+            pass
+        except Exception:
+            self.log.exception('Failed to load local pack index cache')
+        index = json.loads(gzip.decompress(blob.download_as_bytes(if_generation_match=blob.generation)))
+        self.__save_index_cache(index)
+        return index
+
+    def __save_index_cache(self, index: dict):
+        """Save the index to the local cache
+
+        Args:
+            index (dict): store index
+        """
+        try:
+            with open(self.index_cache_file, 'wb') as file:
+                file.write(gzip.compress(json.dumps({'generation': self.__generation, 'index': index},
+                                                    separators=(',', ':')).encode()))
+        except Exception:
+            self.log.exception('Failed to save local pack index cache')
+
+    def __save_index(self):
+        """Upload the store index. The upload only succeeds if nobody else changed the index since it was loaded
+
+        Raises:
+            PreconditionFailed: if the index was changed by another writer
+        """
+        blob = self.store_bucket.blob(self.index_path)
+        blob.upload_from_string(gzip.compress(json.dumps(self.index, separators=(',', ':')).encode()),
+                                content_type='application/gzip', if_generation_match=self.__generation)
+        self.__generation = blob.generation
+        self.__save_index_cache(self.index)
+
+    @staticmethod
+    def build_pack(entries: list) -> tuple:
+        """Build a pack object from (name, data) entries
+
+        Args:
+            entries (list): (name, bytes) tuples
+
+        Returns:
+            tuple: (pack bytes, footer entries [name, offset, length, crc32c])
+        """
+        buffer = BytesIO()
+        footer = []
+        for name, data in entries:
+            footer.append([name, buffer.tell(), len(data), google_crc32c.value(data)])
+            buffer.write(data)
+        encoded = gzip.compress(json.dumps({'version': INDEX_VERSION, 'entries': footer},
+                                           separators=(',', ':')).encode())
+        buffer.write(encoded)
+        buffer.write(PACK_TRAILER.pack(len(encoded), PACK_MAGIC))
+        return buffer.getvalue(), footer
+
+    def __write_pack(self, entries: list) -> str:
+        """Upload a pack and add its entries to the index. Entries replace existing files of the same name
+
+        Args:
+            entries (list): (name, bytes) tuples
+
+        Returns:
+            str: pack object path
+        """
+        data, footer = self.build_pack(entries)
+        pack = f'{self.prefix}/data/{datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")}-{urandom(4).hex()}.pack'
+        self.store_bucket.blob(pack).upload_from_string(data, content_type='application/octet-stream',
+                                                        if_generation_match=0)
+        metrics.add_bytes(len(data))
+        self.index['packs'][pack] = len(data)
+        for name, offset, length, crc in footer:
+            self.index['files'][name] = [pack, offset, length, crc]
+        self.log.info(f'Wrote pack {pack} with {len(entries)} files ({len(data)} bytes)')
+        return pack
+
+    def __pack_entries(self, entries: Iterable[tuple]) -> list:
+        """Group entries into packs of about pack_size bytes and upload them. Packs already written are deleted
+        again when a later one fails
+
+        Args:
+            entries (Iterable[tuple]): (name, bytes) tuples
+
+        Returns:
+            list: written pack object paths
+        """
+        packs = []
+        batch = []
+        batch_size = 0
+        try:
+            for name, data in entries:
+                batch.append((name, data))
+                batch_size += len(data)
+                if batch_size >= self.pack_size:
+                    packs.append(self.__write_pack(batch))
+                    batch = []
+                    batch_size = 0
+            if batch:
+                packs.append(self.__write_pack(batch))
+        except Exception:
+            self.__delete_packs(packs)
+            raise
+        return packs
+
+    def __commit(self, packs: list):
+        """Save the index after writing packs. The packs are deleted again if the index cannot be saved, so failed
+        writes leave no orphaned packs behind for rebuild_index() to pick up
+
+        Args:
+            packs (list): pack object paths written since the index was loaded
+        """
+        try:
+            self.__save_index()
+        except Exception:
+            self.__delete_packs(packs)
+            raise
+
+    def __delete_packs(self, packs: Iterable[str]):
+        """Delete pack objects, ignoring packs that are already gone
+
+        Args:
+            packs (Iterable[str]): pack object paths
+        """
+        for pack in packs:
+            try:
+                self.store_bucket.blob(pack).delete()
+            except NotFound:
+                pass
+
+    @instrument()
+    def add_files(self, paths: list, base_dir: str = '') -> bool:
+        """Pack files and directories (recursively). Logical names are the paths relative to base_dir, or to each
+        given directory when base_dir is not set
+
+        Args:
+            paths (list): file and directory paths
+            base_dir (str, optional): directory logical names are relative to. Defaults to ''.
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        def read_files() -> Iterable[tuple]:
+            for path in map(Path, paths):
+                files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+                root = Path(base_dir) if base_dir else path if path.is_dir() else path.parent
+                for file in files:
+                    yield file.relative_to(root).as_posix(), file.read_bytes()
+
+        try:
+            packs = self.__pack_entries(read_files())
+            self.__commit(packs)
+            self.log.info(f'Packed files into {len(packs)} packs')
+            return True
+        except PreconditionFailed:
+            self.log.error('Pack index was changed by another writer, reload and retry')
+        except Exception:
+            self.log.exception('Failed to pack files')
+        self.__index = None
+        return False
+
+    @instrument()
+    def add_data(self, entries: dict) -> bool:
+        """Pack in-memory data
+
+        Args:
+            entries (dict): logical name to str or bytes data
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            self.__commit(self.__pack_entries((name, data.encode() if isinstance(data, str) else data)
+                                              for name, data in entries.items()))
+            return True
+        except PreconditionFailed:
+            self.log.error('Pack index was changed by another writer, reload and retry')
+        except Exception:
+            self.log.exception('Failed to pack data')
+        self.__index = None
+        return False
+
+    @instrument()
+    def read(self, name: str) -> bytes:
+        """Read a logical file with one ranged GET of its pack and verify its crc32c
+
+        Args:
+            name (str): logical file name
+
+        Returns:
+            bytes: file data or empty bytes on failure
+        """
+        try:
+            entry = self.index['files'].get(name)
+            if entry is None:
+                self.log.error(f'File not found in pack index: {name}')
+                return b''
+            pack, offset, length, crc = entry
+            if not length:
+                return b''
+            data = self.store_bucket.blob(pack).download_as_bytes(start=offset, end=offset + length - 1,
+                                                                  checksum=None)
+            metrics.add_bytes(len(data))
+            if google_crc32c.value(data) != crc:
+                self.log.error(f'Checksum mismatch for {name} in {pack}')
+                return b''
+            return data
+        except Exception:
+            self.log.exception(f'Failed to read {name} from pack')
+        return b''
+
+    @instrument()
+    def read_to_file(self, name: str, destination_path: str) -> bool:
+        """Read a logical file and save it to destination path
+
+        Args:
+            name (str): logical file name
+            destination_path (str): save file to this path
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            entry = self.index['files'].get(name)
+            data = self.read(name)
+            if entry is None or (entry[2] and not data):
+                return False
+            with open(destination_path, 'wb') as file:
+                file.write(data)
+            self.log.info(f'Successfully read {name} to file {destination_path}')
+            return True
+        except Exception:
+            self.log.exception('Failed to save file')
+        return False
+
+    @instrument()
+    def list_files(self, prefix: str = '') -> list:
+        """List logical file names from the index
+
+        Args:
+            prefix (str, optional): name prefix filter. Defaults to ''.
+
+        Returns:
+            list: sorted logical file names
+        """
+        try:
+            return sorted(name for name in self.index['files'] if name.startswith(prefix))
+        except Exception:
+            self.log.exception('Failed to load pack index')
+        return []
+
+    @instrument()
+    def delete_files(self, names: list) -> bool:
+        """Remove logical files from the index. Their bytes stay in the packs until repack()
+
+        Args:
+            names (list): logical file names
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            missing = [name for name in names if name not in self.index['files']]
+            for name in missing:
+                self.log.error(f'File not found in pack index: {name}')
+            for name in names:
+                self.index['files'].pop(name, None)
+            self.__save_index()
+            return not missing
+        except PreconditionFailed:
+            self.log.error('Pack index was changed by another writer, reload and retry')
+        except Exception:
+            self.log.exception('Failed to delete files from pack index')
+        self.__index = None
+        return False
+
+    @instrument()
+    def pack_usage(self) -> dict:
+        """Get the live (still indexed) bytes of every pack
+
+        Returns:
+            dict: pack path to live bytes
+        """
+        live = {pack: 0 for pack in self.index['packs']}
+        for pack, _, length, _ in self.index['files'].values():
+            live[pack] = live.get(pack, 0) + length
+        return live
+
+    @instrument()
+    def repack(self, min_live_ratio: float = 0.5) -> bool:
+        """Compact packs whose live bytes fell below min_live_ratio of their size. Their live files are copied into
+        new packs, the index is saved and then the old packs are deleted
+
+        Args:
+            min_live_ratio (float, optional): live byte ratio below which a pack is compacted. Defaults to 0.5.
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            live = self.pack_usage()
+            sparse = {pack for pack, size in self.index['packs'].items() if live.get(pack, 0) < size * min_live_ratio}
+            if not sparse:
+                self.log.info('No packs to compact')
+                return True
+
+            def live_entries() -> Iterable[tuple]:
+                for pack in sorted(sparse):
+                    files = [(name, entry) for name, entry in self.index['files'].items() if entry[0] == pack]
+                    if not files:
+                        continue
+                    data = self.store_bucket.blob(pack).download_as_bytes()
+                    metrics.add_bytes(len(data))
+                    for name, (_, offset, length, crc) in files:
+                        chunk = data[offset:offset + length]
+                        if google_crc32c.value(chunk) != crc:
+                            raise ValueError(f'Checksum mismatch for {name} in {pack}')
+                        yield name, chunk
+
+            packs = self.__pack_entries(live_entries())
+            for pack in sparse:
+                self.index['packs'].pop(pack, None)
+            self.__commit(packs)
+            self.__delete_packs(sparse)
+            self.log.info(f'Compacted {len(sparse)} packs into {len(packs)} packs')
+            return True
+        except PreconditionFailed:
+            self.log.error('Pack index was changed by another writer, reload and retry')
+        except Exception:
+            self.log.exception('Failed to repack')
+        self.__index = None
+        return False
+
+    @instrument()
+    def read_footer(self, pack: str, size: int) -> list:
+        """Read the footer index of a pack with two ranged GETs (trailer, then footer)
+
+        Args:
+            pack (str): pack object path
+            size (int): pack object size
+
+        Raises:
+            ValueError: if the object is not a pack
+
+        Returns:
+            list: footer entries [name, offset, length, crc32c]
+        """
+        blob = self.store_bucket.blob(pack)
+        length, magic = PACK_TRAILER.unpack(blob.download_as_bytes(start=size - PACK_TRAILER.size, end=size - 1,
+                                                                   checksum=None))
+        if magic != PACK_MAGIC:
+            raise ValueError(f'Not a pack object: {pack}')
+        end = size - PACK_TRAILER.size
+        footer = blob.download_as_bytes(start=end - length, end=end - 1, checksum=None)
+        return json.loads(gzip.decompress(footer))['entries']
+
+    @instrument()
+    def rebuild_index(self) -> bool:
+        """Rebuild the store index from the pack footers. When a name is in several packs the newest pack wins.
+        Files deleted since the last repack() come back, as deletes are only recorded in the index
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            self.__index_blob()
+            index = self.__empty_index()
+            blobs = self.client.list_blobs(self.store_bucket, prefix=f'{self.prefix}/data/',
+                                           fields='items(name,size),nextPageToken')
+            for blob in sorted(blobs, key=lambda b: b.name):
+                index['packs'][blob.name] = blob.size
+                for name, offset, length, crc in self.read_footer(blob.name, blob.size):
+                    index['files'][name] = [blob.name, offset, length, crc]
+            self.__index = index
+            self.__save_index()
+            self.log.info(f'Rebuilt pack index: {len(index["files"])} files in {len(index["packs"])} packs')
+            return True
+        except PreconditionFailed:
+            self.log.error('Pack index was changed by another writer, reload and retry')
+        except Exception:
+            self.log.exception('Failed to rebuild pack index')
+        self.__index = None
+        return False
+
+    @instrument()
+    def display_files(self, prefix: str = '') -> bool:
+        """Display logical file names from the index
+
+        Args:
+            prefix (str, optional): name prefix filter. Defaults to ''.
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        payload = 'Contents:\n'
+        for name in self.list_files(prefix):
+            payload += f'  {name}\n'
+        return self.display_success(payload.strip())
+
+    @instrument()
+    def display_file(self, name: str) -> bool:
+        """Display a logical file to console
+
+        Args:
+            name (str): logical file name
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        data = self.read(name)
+        if data:
+            try:
+                return self.display_success(f'Downloaded data:\n{data.decode()}')
+            except UnicodeDecodeError:
+                self.log.error(f'File is not text: {name}')
+        return self.display_error(f'Failed to read file: {name}')
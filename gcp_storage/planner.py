@@ -0,0 +1,308 @@
+import math
+import threading
+from os import environ
+
+from gcp_storage.scheduler import scheduler
+
+
+UPLOAD_STRATEGIES = ('single', 'resumable', 'composite')
+DOWNLOAD_STRATEGIES = ('single', 'sliced')
+SINGLE_UPLOAD_MAX_SIZE = 8 * 1024 * 1024
+CHUNK_ALIGNMENT = 256 * 1024
+MIN_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+CHUNK_SECONDS = 2.0
+MIN_SLICE_SIZE = 32 * 1024 * 1024
+MAX_COMPOSE_PARTS = 32
+PARALLEL_GAIN = 0.75
+DEFAULT_BANDWIDTH = 32 * 1024 * 1024
+DEFAULT_RTT = 0.05
+MIN_SAMPLE_SIZE = 1024 * 1024
+
+
+class PlanError(ValueError):
+    """Raised when a requested transfer strategy is unknown or not possible for the transfer"""
+
+
+class TransferPlan():
+    def __init__(self, direction: str, strategy: str, size: int, chunk_size: int = 0, parts: int = 1,
+                 estimates: dict | None = None, reason: str = ''):
+        """Strategy picked for one transfer
+
+        Args:
+            direction (str): 'upload' or 'download'
+            strategy (str): 'single', 'resumable', 'composite' or 'sliced'
+            size (int): source size in bytes
+            chunk_size (int, optional): resumable chunk size, 0 if not chunked. Defaults to 0.
+            parts (int, optional): parallel parts of a composite upload or slices of a sliced download. Defaults to 1.
+            estimates (dict | None, optional): strategy to estimated seconds. Defaults to None.
+            reason (str, optional): why the strategy was picked. Defaults to ''.
+        """
+        self.direction = direction
+        self.strategy = strategy
+        self.size = size
+        self.chunk_size = chunk_size
+        self.parts = parts
+        self.estimates = estimates or {}
+        self.reason = reason
+
+    def slices(self) -> list:
+        """Split the source into the parts of the plan. Parts are chunk aligned so composite parts go up as whole
+        resumable chunks
+
+        Returns:
+            list: (start, length) tuples in data order
+        """
+        if self.parts <= 1:
+            return [(0, self.size)]
+        length = math.ceil(math.ceil(self.size / self.parts) / CHUNK_ALIGNMENT) * CHUNK_ALIGNMENT
+        return [(start, min(length, self.size - start)) for start in range(0, self.size, length)]
+
+    def as_dict(self) -> dict:
+        return {'direction': self.direction, 'strategy': self.strategy, 'size': self.size,
+                'chunk_size': self.chunk_size, 'parts': self.parts,
+                'estimates': {name: round(seconds, 3) for name, seconds in self.estimates.items()},
+                'reason': self.reason}
+
+    def explain(self) -> str:
+        """Describe the plan for --explain
+
+        Returns:
+            str: one line per decision
+        """
+        lines = [f'{self.direction} of {self.size} bytes: {self.strategy}']
+        if self.chunk_size:
+            lines.append(f'  chunk size: {self.chunk_size} bytes')
+        if self.parts > 1:
+            lines.append(f'  parallel parts: {self.parts}')
+        for name, seconds in sorted(self.estimates.items(), key=lambda item: item[1]):
+            lines.append(f'  estimate {name}: {seconds:.3f}s')
+        if self.reason:
+            lines.append(f'  reason: {self.reason}')
+        return '\n'.join(lines)
+
+
+class TransferPlanner():
+    def __init__(self, workers: int = 8, smoothing: float = 0.3, composite: bool = False):
+        """Pick the strategy and chunk size of each upload and download from the object size, the bandwidth and
+        round trip time measured on recent transfers and the worker budget. Every strategy gets a time estimate,
+        requests cost one round trip and bytes move at the measured per stream bandwidth, or the sum of the streams
+        up to the bandwidth limit of the transfer scheduler when they run in parallel. Parallel strategies cost more
+        requests and are only picked when they save a quarter of the time. Composite uploads leave objects without
+        an md5 and write temporary part objects, so they are only picked when enabled or requested
+
+        Args:
+            workers (int, optional): parallel parts or slices a transfer may use. Defaults to 8.
+            smoothing (float, optional): weight of a new measurement in the moving averages. Defaults to 0.3.
+            composite (bool, optional): let 'auto' pick composite uploads. Defaults to False.
+        """
+        self.workers = max(1, workers)
+        self.composite = composite
+        self.smoothing = min(max(0.01, smoothing), 1.0)
+        self.__bandwidth = 0.0
+        self.__rtt = 0.0
+        self.__samples = 0
+        self.__lock = threading.Lock()
+        self.restored = False
+
+    @property
+    def bandwidth(self) -> float:
+        """Get the measured bytes per second of one stream
+
+        Returns:
+            float: bandwidth, DEFAULT_BANDWIDTH until a transfer was measured
+        """
+        return self.__bandwidth or DEFAULT_BANDWIDTH
+
+    @property
+    def rtt(self) -> float:
+        """Get the measured round trip time of a request
+
+        Returns:
+            float: seconds, DEFAULT_RTT until a request was measured
+        """
+        return self.__rtt or DEFAULT_RTT
+
+    def __average(self, current: float, value: float) -> float:
+        return value if not current else current + self.smoothing * (value - current)
+
+    def observe_request(self, seconds: float):
+        """Record the time of a request without payload, e.g. a metadata request
+
+        Args:
+            seconds (float): request time
+        """
+        if seconds > 0:
+            with self.__lock:
+                self.__rtt = self.__average(self.__rtt, seconds)
+
+    def observe_transfer(self, nbytes: int, seconds: float) -> bool:
+        """Record the bytes one stream moved and the time it took. Transfers under MIN_SAMPLE_SIZE are dominated by
+        the round trip and are not counted
+
+        Args:
+            nbytes (int): bytes moved
+            seconds (float): transfer time
+
+        Returns:
+            bool: True if the transfer was counted
+        """
+        if nbytes < MIN_SAMPLE_SIZE or seconds <= 0:
+            return False
+        with self.__lock:
+            self.__bandwidth = self.__average(self.__bandwidth, nbytes / max(seconds - self.rtt, seconds / 2))
+            self.__samples += 1
+        return True
+
+    def measurements(self) -> dict:
+        """Get the measurements to keep for the next process
+
+        Returns:
+            dict: bandwidth, rtt and samples
+        """
+        with self.__lock:
+            return {'bandwidth': self.__bandwidth, 'rtt': self.__rtt, 'samples': self.__samples}
+
+    def restore(self, measurements: dict):
+        """Start from the measurements of a previous process. Measurements already taken by this process are kept
+
+        Args:
+            measurements (dict): output of measurements()
+        """
+        with self.__lock:
+            self.restored = True
+            if not self.__samples:
+                self.__bandwidth = float(measurements.get('bandwidth') or 0)
+                self.__samples = int(measurements.get('samples') or 0)
+            self.__rtt = self.__rtt or float(measurements.get('rtt') or 0)
+
+    def __aggregate(self, streams: int) -> float:
+        total = self.bandwidth * streams
+        return min(total, scheduler.bandwidth) if scheduler.bandwidth else total
+
+    def chunk_size(self, max_chunk_size: int = MAX_CHUNK_SIZE) -> int:
+        """Get the resumable chunk size: about CHUNK_SECONDS of transfer at the measured bandwidth, so each chunk
+        request amortizes its round trip while a failed chunk costs little to resend
+
+        Args:
+            max_chunk_size (int, optional): upper bound, e.g. the memory window of transformed uploads.
+                Defaults to MAX_CHUNK_SIZE.
+
+        Returns:
+            int: chunk size aligned to CHUNK_ALIGNMENT
+        """
+        size = min(max(self.bandwidth * CHUNK_SECONDS, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE, max_chunk_size)
+        return max(1, int(size) // CHUNK_ALIGNMENT) * CHUNK_ALIGNMENT
+
+    def __parts(self, size: int, workers: int, limit: int) -> int:
+        return max(1, min(workers, limit, size // MIN_SLICE_SIZE))
+
+    @staticmethod
+    def __pick(direction: str, estimates: dict, forced: str, allowed: tuple, parallel: str,
+               opt_in: str = '') -> tuple:
+        """Pick the fastest strategy, or check a forced one. The parallel strategy is only picked if opt_in is empty
+
+        Raises:
+            PlanError: if the forced strategy is unknown or not possible for the transfer
+
+        Returns:
+            tuple: (strategy, reason)
+        """
+        if forced and forced != 'auto':
+            if forced not in allowed:
+                raise PlanError(f'Unknown {direction} strategy: {forced}. Use auto or one of {", ".join(allowed)}')
+            if forced not in estimates:
+                raise PlanError(f'Cannot use the {forced} strategy for this {direction}')
+            return forced, 'requested'
+        serial = min((name for name in estimates if name != parallel), key=estimates.get)
+        if parallel in estimates and opt_in:
+            return serial, f'{parallel} is not enabled ({opt_in})'
+        if parallel in estimates and estimates[parallel] <= estimates[serial] * PARALLEL_GAIN:
+            return parallel, f'{parallel} saves {1 - estimates[parallel] / estimates[serial]:.0%} over {serial}'
+        if parallel in estimates:
+            return serial, f'{parallel} would save less than {1 - PARALLEL_GAIN:.0%} over {serial}'
+        return serial, (f'{parallel} needs an untransformed object of at least {2 * MIN_SLICE_SIZE} bytes and '
+                        'several workers')
+
+    def plan_upload(self, size: int, transformed: bool = False, strategy: str = 'auto', chunk_size: int = 0,
+                    max_chunk_size: int = MAX_CHUNK_SIZE, workers: int = 0,
+                    composite: bool | None = None) -> TransferPlan:
+        """Plan an upload. Objects up to SINGLE_UPLOAD_MAX_SIZE can go up in one request, larger ones as a
+        resumable upload in chunks. Untransformed files of at least two slices can also go up as parallel parts
+        composed into the object, when composite uploads are enabled or requested
+
+        Args:
+            size (int): source size in bytes, -1 if unknown
+            transformed (bool, optional): the data is compressed or encrypted, its size is unknown until it was
+                sent and it can only go up as one stream. Defaults to False.
+            strategy (str, optional): 'auto', 'single', 'resumable' or 'composite'. Defaults to 'auto'.
+            chunk_size (int, optional): resumable chunk size instead of the planned one, rounded down to a multiple of
+                CHUNK_ALIGNMENT. Defaults to 0.
+            max_chunk_size (int, optional): upper bound of the planned chunk size. Defaults to MAX_CHUNK_SIZE.
+            workers (int, optional): parallel parts instead of the planner workers. Defaults to 0.
+            composite (bool | None, optional): let 'auto' pick composite uploads. Defaults to None (the planner
+                setting).
+
+        Raises:
+            PlanError: if the strategy is unknown or not possible for the upload
+
+        Returns:
+            TransferPlan: upload plan
+        """
+        workers = workers or self.workers
+        chunk = self.chunk_size(max_chunk_size)
+        if chunk_size:
+            chunk = max(1, chunk_size // CHUNK_ALIGNMENT) * CHUNK_ALIGNMENT
+        rtt, bandwidth = self.rtt, self.bandwidth
+        estimates = {}
+        if 0 <= size <= (min(SINGLE_UPLOAD_MAX_SIZE, chunk) if transformed else SINGLE_UPLOAD_MAX_SIZE):
+            estimates['single'] = rtt + size / bandwidth
+        estimates['resumable'] = rtt * (1 + math.ceil(max(size, 1) / chunk)) + max(size, 0) / bandwidth
+        parts = self.__parts(size, workers, MAX_COMPOSE_PARTS)
+        if not transformed and parts > 1:
+            estimates['composite'] = rtt * 4 + size / self.__aggregate(parts)
+        composite = self.composite if composite is None else composite
+        name, reason = self.__pick('upload', estimates, strategy, UPLOAD_STRATEGIES, 'composite',
+                                   '' if composite else 'set GSTORAGE_COMPOSITE_UPLOADS=1 or request it')
+        return TransferPlan('upload', name, size, chunk if name != 'single' else 0,
+                            parts if name == 'composite' else 1, estimates, reason)
+
+    def plan_download(self, size: int, transformed: bool = False, strategy: str = 'auto',
+                      workers: int = 0) -> TransferPlan:
+        """Plan a download. Objects are streamed with one request, untransformed objects of at least two slices
+        can also be fetched as parallel ranged requests written in place
+
+        Args:
+            size (int): object size in bytes
+            transformed (bool, optional): the object is compressed or encrypted and must be decoded as one stream.
+                Defaults to False.
+            strategy (str, optional): 'auto', 'single' or 'sliced'. Defaults to 'auto'.
+            workers (int, optional): parallel slices instead of the planner workers. Defaults to 0.
+
+        Raises:
+            PlanError: if the strategy is unknown or not possible for the download
+
+        Returns:
+            TransferPlan: download plan
+        """
+        workers = workers or self.workers
+        estimates = {'single': self.rtt * 2 + size / self.bandwidth}
+        parts = self.__parts(size, workers, workers)
+        if not transformed and parts > 1:
+            estimates['sliced'] = self.rtt * 2 + size / self.__aggregate(parts)
+        name, reason = self.__pick('download', estimates, strategy, DOWNLOAD_STRATEGIES, 'sliced')
+        return TransferPlan('download', name, size, 0, parts if name == 'sliced' else 1, estimates, reason)
+
+
+def _env_workers() -> int:
+    try:
+        return int(environ.get('GSTORAGE_PLAN_WORKERS', 8))
+    except ValueError:
+        return 8
+
+
+def _env_composite() -> bool:
+    return environ.get('GSTORAGE_COMPOSITE_UPLOADS', '').lower() in ('1', 'true', 'yes', 'on')
+
+
+planner = TransferPlanner(workers=_env_workers(), composite=_env_composite())
@@ -0,0 +1,191 @@
+import cProfile
+import json
+import sys
+import threading
+from collections import Counter
+from time import perf_counter
+
+from gcp_storage.color import Color
+
+
+class _Spans():
+    def __init__(self):
+        """Registry of named timing spans. Spans are only recorded while a Profiler is running"""
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.totals: dict = {}
+
+    def record(self, name: str, seconds: float):
+        """Add a finished span
+
+        Args:
+            name (str): span name
+            seconds (float): span duration
+        """
+        with self.lock:
+            total = self.totals.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            total['count'] += 1
+            total['seconds'] += seconds
+            total['max_seconds'] = max(total['max_seconds'], seconds)
+
+
+class _Span():
+    def __init__(self, name: str):
+        """Context manager timing a named phase
+
+        Args:
+            name (str): span name
+        """
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _spans.record(self.name, perf_counter() - self.start)
+        return False
+
+
+class _NoSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_spans = _Spans()
+_no_span = _NoSpan()
+
+
+def span(name: str) -> _Span | _NoSpan:
+    """Time a named phase (creds, client, bucket_lookup, transfer, crypto, ...) while profiling. Returns a shared
+    no-op context manager when no profiler is running
+
+    Args:
+        name (str): span name
+
+    Returns:
+        _Span | _NoSpan: context manager
+    """
+    return _Span(name) if _spans.enabled else _no_span
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval: float = 0.005):
+        """Background thread sampling the stacks of all other threads for collapsed-stack (flamegraph) output
+
+        Args:
+            interval (float, optional): seconds between samples. Defaults to 0.005.
+        """
+        super().__init__(name='gstorage-profiler', daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.__stop = threading.Event()
+
+    def run(self):
+        names = {}
+        while not self.__stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_filename.rsplit("/", 1)[-1]}:{code.co_name}')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        """Stop sampling and wait for the thread to exit"""
+        self.__stop.set()
+        self.join()
+
+
+class Profiler():
+    __active = False
+
+    def __init__(self, path: str = 'gstorage-profile', interval: float = 0.005):
+        """Profile a command with cProfile plus a stack sampler and time the named spans. Writes path.pstats
+        (load with pstats or snakeviz), path.folded (collapsed stacks for flamegraph.pl or speedscope) and
+        path.spans.json, and prints the span breakdown. Nested profilers are no-ops.
+
+        Args:
+            path (str, optional): output path prefix. Defaults to 'gstorage-profile'.
+            interval (float, optional): sampling interval in seconds. Defaults to 0.005.
+        """
+        self.path = path
+        self.interval = interval
+        self.profile: cProfile.Profile | None = None
+        self.sampler: _Sampler | None = None
+        self.started = 0.0
+        self.owner = False
+
+    def start(self) -> bool:
+        """Start profiling
+
+        Returns:
+            bool: True if this profiler started, False if another one is already running
+        """
+        if Profiler.__active:
+            return False
+        Profiler.__active = self.owner = True
+        _spans.totals.clear()
+        _spans.enabled = True
+        self.sampler = _Sampler(self.interval)
+        self.sampler.start()
+        self.profile = cProfile.Profile()
+        self.started = perf_counter()
+        self.profile.enable()
+        return True
+
+    def stop(self) -> bool:
+        """Stop profiling and write the output files
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not self.owner:
+            return True
+        self.profile.disable()
+        elapsed = perf_counter() - self.started
+        self.sampler.stop()
+        _spans.enabled = False
+        Profiler.__active = self.owner = False
+        try:
+            self.profile.dump_stats(f'{self.path}.pstats')
+            with open(f'{self.path}.folded', 'w') as file:
+                for stack, count in sorted(self.sampler.stacks.items()):
+                    file.write(f'{stack} {count}\n')
+            with open(f'{self.path}.spans.json', 'w') as file:
+                json.dump({'elapsed_seconds': elapsed, 'spans': _spans.totals}, file, indent=2)
+        except Exception as error:
+            print(f'Failed to write profile: {error}')
+            return False
+        self.display(elapsed)
+        return True
+
+    def display(self, elapsed: float):
+        """Print the span breakdown to stderr
+
+        Args:
+            elapsed (float): total profiled seconds
+        """
+        lines = [f'Profile ({elapsed * 1000:.1f} ms total), written to {self.path}.pstats and {self.path}.folded:']
+        for name, total in sorted(_spans.totals.items(), key=lambda item: -item[1]['seconds']):
+            share = total['seconds'] * 100 / elapsed if elapsed else 0.0
+            lines.append(f'  {name:16} {total["seconds"] * 1000:10.1f} ms {share:5.1f}%  ({total["count"]} calls)')
+        print(Color().format_message('\n'.join(lines), 'cyan'), file=sys.stderr)
+
+    def __enter__(self) -> 'Profiler':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
@@ -0,0 +1,313 @@
+import sys
+import threading
+from logging import Logger
+from time import monotonic
+from typing import Callable
+
+from gcp_storage.logger import get_logger
+
+
+def format_bytes(size: float) -> str:
+    """Format a byte count for display
+
+    Args:
+        size (float): number of bytes
+
+    Returns:
+        str: human readable size
+    """
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if abs(size) < 1024 or unit == 'TB':
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{int(size)} B'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+def format_eta(seconds: float | None) -> str:
+    """Format an ETA in seconds for display
+
+    Args:
+        seconds (float | None): seconds remaining or None if unknown
+
+    Returns:
+        str: ETA as H:MM:SS or '--:--' if unknown
+    """
+    if seconds is None:
+        return '--:--'
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes:02d}:{seconds:02d}'
+
+
+def make_progress(progress: Callable | None, total: int | None = None, name: str = '') -> 'Progress | None':
+    """Turn a progress argument of a transfer method into a Progress object. A Progress object (for example a child of
+    an AggregateProgress) is used as is, any other callable becomes the callback of a new Progress object.
+
+    Args:
+        progress (Callable | None): Progress object, progress callback or None
+        total (int | None, optional): total bytes of the transfer. Defaults to None.
+        name (str, optional): name of the transfer. Defaults to ''.
+
+    Returns:
+        Progress | None: progress object or None if no progress reporting was requested
+    """
+    if progress is None:
+        return None
+    if isinstance(progress, Progress):
+        if progress.total is None:
+            progress.set_total(total)
+        return progress
+    return Progress(total, progress, name)
+
+
+class Progress():
+    def __init__(self, total: int | None = None, callback: Callable | None = None, name: str = '',
+                 interval: float = 0.5):
+        """Track the progress of a transfer. The callback is called with this object at most every interval seconds
+        while bytes are reported with update() and always once more on finish()
+
+        Args:
+            total (int | None, optional): total bytes expected. Defaults to None (unknown).
+            callback (Callable | None, optional): function called with the Progress object. Defaults to None.
+            name (str, optional): name of the transfer for display. Defaults to ''.
+            interval (float, optional): minimum seconds between callbacks. Defaults to 0.5.
+        """
+        self.total = total
+        self.callback = callback
+        self.name = name
+        self.interval = interval
+        self.done = 0
+        self.finished = False
+        self.started = monotonic()
+        self.rate = 0.0
+        self.__last_time = self.started
+        self.__last_done = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the transfer started
+
+        Returns:
+            float: elapsed seconds
+        """
+        return monotonic() - self.started
+
+    @property
+    def average_rate(self) -> float:
+        """Average transfer rate since the transfer started
+
+        Returns:
+            float: bytes per second
+        """
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def percent(self) -> float | None:
+        """Percentage of the total transferred
+
+        Returns:
+            float | None: percent done or None if the total is unknown
+        """
+        if not self.total:
+            return 100.0 if self.finished else None
+        return min(100.0, self.done * 100 / self.total)
+
+    @property
+    def eta(self) -> float | None:
+        """Estimated seconds remaining using the instantaneous rate, falling back to the average rate
+
+        Returns:
+            float | None: seconds remaining or None if unknown
+        """
+        if self.finished:
+            return 0.0
+        rate = self.rate or self.average_rate
+        if not self.total or not rate:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+    def set_total(self, total: int | None):
+        """Set the total bytes once they are known
+
+        Args:
+            total (int | None): total bytes expected
+        """
+        self.total = total
+
+    def update(self, nbytes: int):
+        """Report transferred bytes
+
+        Args:
+            nbytes (int): bytes transferred since the last update
+        """
+        with self.__lock:
+            self.done += nbytes
+            now = monotonic()
+            window = now - self.__last_time
+            if window < self.interval:
+                return
+            current = (self.done - self.__last_done) / window
+            self.rate = current if not self.rate else 0.3 * current + 0.7 * self.rate
+            self.__last_time, self.__last_done = now, self.done
+        self._notify()
+
+    def finish(self):
+        """Mark the transfer as complete and send the final callback"""
+        with self.__lock:
+            if self.finished:
+                return
+            self.finished = True
+            if self.total is None:
+                self.total = self.done
+            if not self.rate:
+                self.rate = self.average_rate
+        self._notify()
+
+    def _notify(self):
+        """Call the callback, never letting a display failure break the transfer"""
+        if self.callback:
+            try:
+                self.callback(self)
+            except Exception:
+                pass
+
+
+class AggregateProgress(Progress):
+    def __init__(self, total: int | None = None, callback: Callable | None = None, name: str = '',
+                 interval: float = 0.5, files: int = 0):
+        """Progress of a multi-file operation. Each file gets a child Progress from child() whose updates roll up
+        into this object, so a single callback sees the combined bytes, rate and ETA.
+
+        Args:
+            total (int | None, optional): total bytes of all files. Defaults to None (unknown).
+            callback (Callable | None, optional): function called with this object. Defaults to None.
+            name (str, optional): name of the operation for display. Defaults to ''.
+            interval (float, optional): minimum seconds between callbacks. Defaults to 0.5.
+            files (int, optional): number of files expected. Defaults to 0 (unknown).
+        """
+        super().__init__(total, callback, name, interval)
+        self.files = files
+        self.files_done = 0
+        self.__sum_totals = total is None
+        self.__lock = threading.Lock()
+
+    def child(self, total: int | None = None, name: str = '') -> Progress:
+        """Create a child progress for one file of the operation
+
+        Args:
+            total (int | None, optional): total bytes of the file. Defaults to None.
+            name (str, optional): file name. Defaults to ''.
+
+        Returns:
+            Progress: child progress object
+        """
+        child = _ChildProgress(self, None, name)
+        child.set_total(total)
+        return child
+
+    def _add_total(self, total: int | None):
+        """Add the size of a child to the total when no total was given for the whole operation
+
+        Args:
+            total (int | None): size of the child transfer
+        """
+        if self.__sum_totals and total:
+            with self.__lock:
+                self.total = (self.total or 0) + total
+
+    def _child_finished(self):
+        """Count a finished child and finish this object when all expected files are done"""
+        with self.__lock:
+            self.files_done += 1
+            complete = self.files and self.files_done >= self.files
+        if complete:
+            self.finish()
+
+
+class _ChildProgress(Progress):
+    def __init__(self, parent: AggregateProgress, total: int | None, name: str):
+        """Per-file progress forwarding its bytes to the parent AggregateProgress
+
+        Args:
+            parent (AggregateProgress): aggregate progress of the operation
+            total (int | None): total bytes of the file
+            name (str): file name
+        """
+        super().__init__(total, None, name, parent.interval)
+        self.parent = parent
+
+    def set_total(self, total: int | None):
+        if self.total is None:
+            self.parent._add_total(total)
+        super().set_total(total)
+
+    def update(self, nbytes: int):
+        super().update(nbytes)
+        self.parent.update(nbytes)
+
+    def finish(self):
+        if not self.finished:
+            super().finish()
+            self.parent._child_finished()
+
+
+class ProgressBar():
+    def __init__(self, stream=None, logger: Logger | None = None, log_interval: float = 10.0, width: int = 30):
+        """Progress callback for the CLI. Renders a single updating line when the stream is a TTY, otherwise logs a
+        progress line every log_interval seconds.
+
+        Args:
+            stream (TextIO, optional): output stream. Defaults to sys.stderr.
+            logger (Logger | None, optional): logger for non TTY output. Defaults to the gcp-storage logger.
+            log_interval (float, optional): seconds between log lines on non TTY output. Defaults to 10.0.
+            width (int, optional): bar width in characters. Defaults to 30.
+        """
+        self.stream = stream or sys.stderr
+        self.log = logger or get_logger('gcp-storage')
+        self.log_interval = log_interval
+        self.width = width
+        self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.__last_log = 0.0
+
+    def describe(self, progress: Progress) -> str:
+        """Describe the state of a transfer on one line
+
+        Args:
+            progress (Progress): progress object
+
+        Returns:
+            str: progress description
+        """
+        done = format_bytes(progress.done)
+        size = f'{done}/{format_bytes(progress.total)}' if progress.total else done
+        percent = progress.percent
+        files = ''
+        if isinstance(progress, AggregateProgress) and progress.files:
+            files = f' {progress.files_done}/{progress.files} files'
+        return (f'{progress.name + " " if progress.name else ""}'
+                f'{f"{percent:5.1f}% " if percent is not None else ""}{size}{files} '
+                f'{format_bytes(progress.rate)}/s (avg {format_bytes(progress.average_rate)}/s) '
+                f'ETA {format_eta(progress.eta)}')
+
+    def __call__(self, progress: Progress):
+        """Render the progress of a transfer
+
+        Args:
+            progress (Progress): progress object
+        """
+        if self.tty:
+            percent = progress.percent or 0.0
+            filled = int(self.width * percent / 100)
+            bar = '#' * filled + '-' * (self.width - filled)
+            self.stream.write(f'\r[{bar}] {self.describe(progress)}\033[K')
+            if progress.finished:
+                self.stream.write('\n')
+            self.stream.flush()
+            return
+        now = monotonic()
+        if progress.finished or now - self.__last_log >= self.log_interval:
+            self.__last_log = now
+            self.log.info(f'Progress: {self.describe(progress)}')
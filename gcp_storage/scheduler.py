@@ -0,0 +1,264 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from os import environ
+from time import monotonic, perf_counter, sleep
+
+from gcp_storage.metrics import metrics
+
+
+PRIORITIES = ('interactive', 'normal', 'bulk')
+SMALL_READ_MAX_SIZE = 1024 * 1024
+BANDWIDTH_BURST = 1.0
+
+
+class TransferClass():
+    def __init__(self, name: str, rank: int, concurrency: int, share: float, reserved: int = 0):
+        """Limits of a transfer priority class
+
+        Args:
+            name (str): class name
+            rank (int): priority rank, lower ranks get free slots first
+            concurrency (int): maximum transfers of the class running at once
+            share (float): bandwidth weight of the class against the other active classes
+            reserved (int, optional): slots only the class can use, on top of the shared slots. Defaults to 0.
+        """
+        self.name = name
+        self.rank = rank
+        self.concurrency = max(1, concurrency)
+        self.share = max(0.01, share)
+        self.reserved = min(max(0, reserved), self.concurrency)
+
+
+def default_classes() -> dict:
+    """Get the default transfer classes. Interactive transfers have two reserved slots, the fast lane bulk traffic
+    can never fill, and get 60% of the bandwidth while all classes are active
+
+    Returns:
+        dict: class name to TransferClass
+    """
+    return {transfer_class.name: transfer_class for transfer_class in (
+        TransferClass('interactive', 0, concurrency=4, share=6, reserved=2),
+        TransferClass('normal', 1, concurrency=8, share=3),
+        TransferClass('bulk', 2, concurrency=8, share=1))}
+
+
+class TransferSlot():
+    def __init__(self, name: str):
+        """Place of a transfer in the scheduler, queued until a slot of its class is granted
+
+        Args:
+            name (str): transfer class name
+        """
+        self.name = name
+        self.queued = perf_counter()
+
+
+class TransferScheduler():
+    def __init__(self, slots: int = 16, bandwidth: float = 0, classes: dict | None = None,
+                 small_read_size: int = SMALL_READ_MAX_SIZE):
+        """Priority aware transfer scheduler shared by all managers of the process. A transfer holds a slot of its
+        class while it runs. Free shared slots go to the waiting transfer of the highest priority class that is
+        below its concurrency limit, and reserved slots stay free for their class, so small interactive reads never
+        queue behind bulk jobs. With a bandwidth limit, the bytes each class moves are paced to its share of the
+        classes currently running, unused shares are lent to the active classes
+
+        Args:
+            slots (int, optional): shared slots plus the reserved slots of all classes. Defaults to 16.
+            bandwidth (float, optional): bytes per second for all transfers, 0 for no limit. Defaults to 0.
+            classes (dict | None, optional): class name to TransferClass for the interactive, normal and bulk
+                classes. Defaults to None (default_classes()).
+            small_read_size (int, optional): reads up to this size outside bulk jobs use the interactive class.
+                Defaults to SMALL_READ_MAX_SIZE.
+        """
+        self.classes: dict = classes or default_classes()
+        missing = set(PRIORITIES) - set(self.classes)
+        if missing:
+            raise ValueError(f'Missing transfer classes: {", ".join(sorted(missing))}')
+        reserved = sum(transfer_class.reserved for transfer_class in self.classes.values())
+        self.slots = max(slots, reserved + 1)
+        self.bandwidth = max(0.0, bandwidth)
+        self.small_read_size = small_read_size
+        self.__shared_slots = self.slots - reserved
+        self.__waiting: dict = {name: deque() for name in self.classes}
+        self.__running: dict = {name: 0 for name in self.classes}
+        self.__clock: dict = {name: 0.0 for name in self.classes}
+        self.__condition = threading.Condition()
+        self.__local = threading.local()
+
+    def classify(self, priority: str = 'normal', read_size: int = -1) -> str:
+        """Get the class of a transfer. Reads of a known size up to small_read_size take the interactive fast lane
+        unless they are part of a bulk job
+
+        Args:
+            priority (str, optional): requested class. Defaults to 'normal'.
+            read_size (int, optional): size of a read, -1 for writes and unknown sizes. Defaults to -1.
+
+        Raises:
+            ValueError: if the priority is not a known class
+
+        Returns:
+            str: class name
+        """
+        if priority not in self.classes:
+            raise ValueError(f'Unknown transfer priority: {priority}. Use one of {", ".join(PRIORITIES)}')
+        if priority != 'bulk' and 0 <= read_size <= self.small_read_size:
+            return 'interactive'
+        return priority
+
+    @property
+    def current(self) -> TransferSlot | None:
+        """Get the slot held by the current thread
+
+        Returns:
+            TransferSlot | None: held slot or None
+        """
+        return getattr(self.__local, 'ticket', None)
+
+    @contextmanager
+    def slot(self, priority: str = 'normal', read_size: int = -1):
+        """Context manager holding a transfer slot for the enclosed block. A thread already holding a slot keeps
+        using it, so nested calls never wait on their own job
+
+        Args:
+            priority (str, optional): transfer class. Defaults to 'normal'.
+            read_size (int, optional): size of a read, small reads take the fast lane. Defaults to -1.
+
+        Yields:
+            TransferSlot: held slot
+        """
+        held = self.current
+        if held is not None:
+            yield held
+            return None
+        ticket = self.__acquire(self.classify(priority, read_size))
+        self.__local.ticket = ticket
+        try:
+            yield ticket
+        finally:
+            self.__local.ticket = None
+            self.__release(ticket)
+
+    @contextmanager
+    def attach(self, ticket: TransferSlot | None):
+        """Context manager running the enclosed block of another thread under a held slot, for helper threads of one
+        transfer that must all run at once (a tee feeding several uploads)
+
+        Args:
+            ticket (TransferSlot | None): slot held by the transfer
+
+        Yields:
+            TransferSlot | None: the attached slot
+        """
+        previous = self.current
+        self.__local.ticket = ticket
+        try:
+            yield ticket
+        finally:
+            self.__local.ticket = previous
+
+    def __can_run(self, name: str) -> bool:
+        transfer_class: TransferClass = self.classes[name]
+        running = self.__running[name]
+        if running >= transfer_class.concurrency:
+            return False
+        if running < transfer_class.reserved:
+            return True
+        shared = sum(max(0, count - self.classes[key].reserved) for key, count in self.__running.items())
+        return shared < self.__shared_slots
+
+    def __may_start(self, ticket: TransferSlot) -> bool:
+        """Check if a queued transfer can take a slot: it is first in its class queue, its class can run and no
+        higher priority class waits for a slot it could take
+
+        Args:
+            ticket (TransferSlot): queued transfer
+
+        Returns:
+            bool: True if the transfer can start
+        """
+        queue = self.__waiting[ticket.name]
+        if queue[0] is not ticket or not self.__can_run(ticket.name):
+            return False
+        rank = self.classes[ticket.name].rank
+        return not any(self.__waiting[name] and self.classes[name].rank < rank and self.__can_run(name)
+                       for name in self.classes)
+
+    def __acquire(self, name: str) -> TransferSlot:
+        ticket = TransferSlot(name)
+        with self.__condition:
+            self.__waiting[name].append(ticket)
+            self.__report(name)
+            while not self.__may_start(ticket):
+                self.__condition.wait()
+            self.__waiting[name].popleft()
+            self.__running[name] += 1
+            self.__report(name)
+            self.__condition.notify_all()
+        if metrics.enabled:
+            metrics.histogram('scheduler_wait_seconds', perf_counter() - ticket.queued, priority=name)
+        return ticket
+
+    def __release(self, ticket: TransferSlot):
+        with self.__condition:
+            self.__running[ticket.name] -= 1
+            self.__report(ticket.name)
+            self.__condition.notify_all()
+
+    def __report(self, name: str):
+        """Publish the queue depth and running transfers of a class to metrics
+
+        Args:
+            name (str): class name
+        """
+        if metrics.enabled:
+            depth = len(self.__waiting[name])
+            metrics.set_gauge('scheduler_queue_depth', depth, priority=name)
+            metrics.max_gauge('scheduler_queue_depth_peak', depth, priority=name)
+            metrics.set_gauge('scheduler_running', self.__running[name], priority=name)
+
+    def throttle(self, nbytes: int):
+        """Pace the bytes moved by the slot of the current thread to the bandwidth share of its class. Each class
+        keeps a clock of when its bytes may be sent, so all transfers of a class share its rate. An idle class
+        builds up at most BANDWIDTH_BURST seconds of credit. No-op without a bandwidth limit or slot
+
+        Args:
+            nbytes (int): bytes just moved
+        """
+        ticket = self.current
+        if not self.bandwidth or ticket is None or nbytes <= 0:
+            return None
+        name = ticket.name
+        with self.__condition:
+            share = self.classes[name].share
+            active = sum(self.classes[key].share for key, count in self.__running.items() if count and key != name)
+            rate = self.bandwidth * share / (share + active)
+            now = monotonic()
+            self.__clock[name] = max(self.__clock[name], now - BANDWIDTH_BURST) + nbytes / rate
+            delay = self.__clock[name] - now
+        if delay > 0:
+            metrics.inc('scheduler_throttled_seconds', delay, priority=name)
+            sleep(delay)
+
+    def stats(self) -> dict:
+        """Get the current state of every class
+
+        Returns:
+            dict: class name to waiting, running, concurrency, reserved and share
+        """
+        with self.__condition:
+            return {name: {'waiting': len(self.__waiting[name]), 'running': self.__running[name],
+                           'concurrency': transfer_class.concurrency, 'reserved': transfer_class.reserved,
+                           'share': transfer_class.share}
+                    for name, transfer_class in self.classes.items()}
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(environ.get(name, default))
+    except ValueError:
+        return default
+
+
+scheduler = TransferScheduler(slots=int(_env_number('GSTORAGE_TRANSFER_SLOTS', 16)),
+                              bandwidth=_env_number('GSTORAGE_BANDWIDTH_MB', 0) * 1024 * 1024)
@@ -0,0 +1,264 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from time import time
+
+
+SCHEMA_VERSION = 2
+TABLES = (
+    'settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+    'used_buckets (name TEXT PRIMARY KEY, added REAL NOT NULL)',
+    'service_accounts (name TEXT PRIMARY KEY, added REAL NOT NULL)',
+    'checkpoints (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)',
+    'tokens (key TEXT PRIMARY KEY, value BLOB NOT NULL, expiry REAL NOT NULL)',
+)
+_stores: dict = {}
+_stores_lock = threading.Lock()
+
+
+class StateStore():
+    def __init__(self, path: str = ''):
+        """Local state of the tool (default service account and bucket, used buckets, service account registry and
+        transfer checkpoints) in a SQLite database in WAL mode. Readers never block each other or the writer, and
+        every write is one transaction, so parallel processes and threads can share the state safely. Each thread
+        gets its own connection. The flat files of older versions are migrated on first use
+
+        Args:
+            path (str, optional): database path. Defaults to '' (gcp_env/.state.db).
+        """
+        self.env_dir = Path(__file__).parent / 'gcp_env'
+        self.path = path or str(self.env_dir / '.state.db')
+        self.__local = threading.local()
+        self.__setup()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Get the connection of the current thread
+
+        Returns:
+            sqlite3.Connection: database connection
+        """
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.__local.connection = connection
+        return connection
+
+    def __write(self, statements: list) -> None:
+        """Run statements in one write transaction. BEGIN IMMEDIATE takes the write lock up front so concurrent
+        writers queue on the busy timeout instead of failing on lock upgrade
+
+        Args:
+            statements (list): (sql, parameters) tuples
+        """
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, parameters in statements:
+                connection.execute(sql, parameters)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def __setup(self):
+        """Create missing tables and migrate the flat files of older versions when the database is new"""
+        connection = self.connection
+        if connection.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+            return None
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version < SCHEMA_VERSION:
+                for table in TABLES:
+                    connection.execute(f'CREATE TABLE IF NOT EXISTS {table}')
+                if not version:
+                    self.__migrate(connection)
+                connection.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def __migrate(self, connection: sqlite3.Connection):
+        """Import the default_sa, default_bucket and .used_buckets files and the registered .sa credential files.
+        The files are left in place
+
+        Args:
+            connection (sqlite3.Connection): connection inside the setup transaction
+        """
+        now = time()
+        for key in ('default_sa', 'default_bucket'):
+            file = self.env_dir / key
+            if file.exists() and file.read_text().strip():
+                connection.execute('INSERT OR IGNORE INTO settings VALUES (?, ?)', (key, file.read_text().strip()))
+        file = self.env_dir / '.used_buckets'
+        if file.exists():
+            try:
+                buckets = json.loads(file.read_text() or '[]')
+            except ValueError:
+                buckets = []
+            connection.executemany('INSERT OR IGNORE INTO used_buckets VALUES (?, ?)',
+                                   [(name, now) for name in buckets if isinstance(name, str)])
+        for file in self.env_dir.glob('.*.sa'):
+            connection.execute('INSERT OR IGNORE INTO service_accounts VALUES (?, ?)', (file.name[1:-3], now))
+
+    def get_setting(self, key: str) -> str:
+        """Get a setting
+
+        Args:
+            key (str): setting name
+
+        Returns:
+            str: value or empty string if not set
+        """
+        row = self.connection.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else ''
+
+    def set_setting(self, key: str, value: str):
+        """Set a setting
+
+        Args:
+            key (str): setting name
+            value (str): value
+        """
+        self.__write([('INSERT OR REPLACE INTO settings VALUES (?, ?)', (key, value))])
+
+    def used_buckets(self) -> list:
+        """Get the used bucket names in the order they were first used
+
+        Returns:
+            list: bucket names
+        """
+        return [row[0] for row in self.connection.execute('SELECT name FROM used_buckets ORDER BY added, name')]
+
+    def add_used_bucket(self, name: str) -> bool:
+        """Add a bucket to the used buckets. Known buckets only cost a read
+
+        Args:
+            name (str): bucket name
+
+        Returns:
+            bool: True if the bucket was added, False if it was already known
+        """
+        if self.connection.execute('SELECT 1 FROM used_buckets WHERE name = ?', (name,)).fetchone():
+            return False
+        self.__write([('INSERT OR IGNORE INTO used_buckets VALUES (?, ?)', (name, time()))])
+        return True
+
+    def remove_used_bucket(self, name: str):
+        """Remove a bucket from the used buckets
+
+        Args:
+            name (str): bucket name
+        """
+        self.__write([('DELETE FROM used_buckets WHERE name = ?', (name,))])
+
+    def service_accounts(self) -> list:
+        """Get the registered service account names
+
+        Returns:
+            list: service account names
+        """
+        return [row[0] for row in self.connection.execute('SELECT name FROM service_accounts ORDER BY name')]
+
+    def add_service_account(self, name: str):
+        """Register a service account
+
+        Args:
+            name (str): service account name
+        """
+        self.__write([('INSERT OR IGNORE INTO service_accounts VALUES (?, ?)', (name, time()))])
+
+    def remove_service_account(self, name: str):
+        """Unregister a service account
+
+        Args:
+            name (str): service account name
+        """
+        self.__write([('DELETE FROM service_accounts WHERE name = ?', (name,))])
+
+    def get_checkpoint(self, key: str) -> dict | None:
+        """Get a transfer checkpoint
+
+        Args:
+            key (str): checkpoint key
+
+        Returns:
+            dict | None: checkpoint data or None if there is none
+        """
+        row = self.connection.execute('SELECT value FROM checkpoints WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_checkpoint(self, key: str, value: dict):
+        """Save a transfer checkpoint, replacing the previous one
+
+        Args:
+            key (str): checkpoint key
+            value (dict): JSON serializable checkpoint data
+        """
+        self.__write([('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)', (key, json.dumps(value), time()))])
+
+    def delete_checkpoint(self, key: str):
+        """Delete a transfer checkpoint
+
+        Args:
+            key (str): checkpoint key
+        """
+        self.__write([('DELETE FROM checkpoints WHERE key = ?', (key,))])
+
+    def checkpoints(self, prefix: str = '') -> dict:
+        """Get the transfer checkpoints with a key prefix
+
+        Args:
+            prefix (str, optional): key prefix. Defaults to '' (all).
+
+        Returns:
+            dict: key to checkpoint data
+        """
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        rows = self.connection.execute("SELECT key, value FROM checkpoints WHERE key LIKE ? ESCAPE '\\' ORDER BY key",
+                                       (pattern,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def get_token(self, key: str) -> tuple:
+        """Get a cached access token
+
+        Args:
+            key (str): token key
+
+        Returns:
+            tuple: (encrypted token, expiry timestamp) or (b'', 0.0) if there is none
+        """
+        row = self.connection.execute('SELECT value, expiry FROM tokens WHERE key = ?', (key,)).fetchone()
+        return (bytes(row[0]), row[1]) if row else (b'', 0.0)
+
+    def set_token(self, key: str, value: bytes, expiry: float):
+        """Cache an access token. A token expiring before the cached one is ignored, so processes refreshing at
+        the same time keep the freshest token
+
+        Args:
+            key (str): token key
+            value (bytes): encrypted token
+            expiry (float): expiry timestamp
+        """
+        self.__write([('INSERT INTO tokens VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value, '
+                       'expiry = excluded.expiry WHERE excluded.expiry > tokens.expiry', (key, value, expiry))])
+
+
+def state_store(path: str = '') -> StateStore:
+    """Get the state store of the process for a database path, creating it on first use
+
+    Args:
+        path (str, optional): database path. Defaults to '' (gcp_env/.state.db).
+
+    Returns:
+        StateStore: shared state store
+    """
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = StateStore(path)
+        return _stores[path]
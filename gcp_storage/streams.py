@@ -0,0 +1,802 @@
+import io
+import mmap
+import queue
+import threading
+from collections import OrderedDict, deque
+from os import fstat, pread, pwrite
+
+from gcp_storage.checksum import StreamChecksum
+from gcp_storage.metrics import metrics
+from gcp_storage.progress import Progress
+from gcp_storage.scheduler import scheduler
+
+
+class ChunkReader(io.RawIOBase):
+    def __init__(self, source: io.IOBase, progress: Progress | None = None, checksum: StreamChecksum | None = None):
+        """Readable stream handed to the upload methods of the storage library. Reads are passed to the source
+        stream chunk by chunk as the upload consumes them and reported to progress and metrics.
+
+        Args:
+            source (io.IOBase): stream to read from
+            progress (Progress | None, optional): progress to report read bytes to. Defaults to None.
+            checksum (StreamChecksum | None, optional): checksum to update with each new byte read. Defaults to None.
+        """
+        super().__init__()
+        self.source = source
+        self.progress = progress
+        self.checksum = checksum
+        self.__position = 0
+        self.__high_water = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self.source.seekable()
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Seek the source stream. The upload only seeks back to resend a chunk after a retryable failure, so bytes
+        read again are not reported twice
+
+        Args:
+            offset (int): seek offset
+            whence (int, optional): seek reference point. Defaults to io.SEEK_SET.
+
+        Returns:
+            int: new position
+        """
+        self.__position = self.source.seek(offset, whence)
+        return self.__position
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes from the source
+
+        Args:
+            size (int, optional): maximum bytes to read. Defaults to -1 (read all).
+
+        Returns:
+            bytes: data read
+        """
+        data = self.source.read(size)
+        self.__position += len(data)
+        if self.__position > self.__high_water:
+            new = self.__position - self.__high_water
+            if self.checksum is not None:
+                self.checksum.update(data[len(data) - new:])
+            self._report(new)
+            self.__high_water = self.__position
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _report(self, nbytes: int):
+        """Report new bytes to progress and metrics and pace them to the bandwidth share of the transfer
+
+        Args:
+            nbytes (int): number of new bytes
+        """
+        metrics.add_bytes(nbytes)
+        if self.progress:
+            self.progress.update(nbytes)
+        scheduler.throttle(nbytes)
+
+
+class ChunkWriter(io.RawIOBase):
+    def __init__(self, sink: io.IOBase, progress: Progress | None = None, checksum: StreamChecksum | None = None):
+        """Writable stream handed to the download methods of the storage library. Each response chunk is written
+        to the sink as it arrives and reported to progress and metrics.
+
+        Args:
+            sink (io.IOBase): stream to write to
+            progress (Progress | None, optional): progress to report written bytes to. Defaults to None.
+            checksum (StreamChecksum | None, optional): checksum to update with each new byte written.
+                Defaults to None.
+        """
+        super().__init__()
+        self.sink = sink
+        self.progress = progress
+        self.checksum = checksum
+        self.__position = 0
+        self.__high_water = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self.sink.seekable()
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Seek the sink stream. The download only seeks back to restart after a retryable failure, so bytes
+        written again are not reported twice
+
+        Args:
+            offset (int): seek offset
+            whence (int, optional): seek reference point. Defaults to io.SEEK_SET.
+
+        Returns:
+            int: new position
+        """
+        self.__position = self.sink.seek(offset, whence)
+        return self.__position
+
+    def truncate(self, size: int | None = None) -> int:
+        return self.sink.truncate(size)
+
+    def write(self, data) -> int:
+        """Write a chunk to the sink
+
+        Args:
+            data (bytes): chunk to write
+
+        Returns:
+            int: number of bytes written
+        """
+        self.sink.write(data)
+        nbytes = len(data)
+        self.__position += nbytes
+        if self.__position > self.__high_water:
+            new = self.__position - self.__high_water
+            self.__high_water = self.__position
+            if self.checksum is not None:
+                self.checksum.update(data[nbytes - new:])
+            metrics.add_bytes(new)
+            if self.progress:
+                self.progress.update(new)
+            scheduler.throttle(new)
+        return nbytes
+
+
+class MappedReader(io.RawIOBase):
+    def __init__(self, file: io.IOBase, window: int = 16 * 1024 * 1024):
+        """Readable stream over a file that maps one page aligned window of it at a time with mmap. Reads are
+        served from the page cache without a read() buffer per call and the mapped memory stays bounded by window
+        whatever the file size
+
+        Args:
+            file (io.IOBase): file opened for binary reading
+            window (int, optional): mapped window size, rounded up to the mmap allocation granularity.
+                Defaults to 16MB.
+        """
+        super().__init__()
+        self.fileno = file.fileno()
+        self.size = fstat(self.fileno).st_size
+        self.window = max(1, -(-window // mmap.ALLOCATIONGRANULARITY)) * mmap.ALLOCATIONGRANULARITY
+        self.__map: mmap.mmap | None = None
+        self.__map_start = 0
+        self.__position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move the read position. The window is remapped on the next read if needed
+
+        Args:
+            offset (int): seek offset
+            whence (int, optional): seek reference point. Defaults to io.SEEK_SET.
+
+        Returns:
+            int: new position
+        """
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.__position = max(0, offset)
+        return self.__position
+
+    def _map(self, position: int) -> mmap.mmap:
+        """Map the window containing position, unmapping the previous one. The file size is checked before every
+        read, as touching mapped pages past the end of a file truncated meanwhile kills the process with SIGBUS
+
+        Args:
+            position (int): file offset
+
+        Raises:
+            OSError: if the file shrank since the reader was opened
+
+        Returns:
+            mmap.mmap: mapped window
+        """
+        current = fstat(self.fileno).st_size
+        if current < self.size:
+            raise OSError(f'File shrank from {self.size} to {current} bytes while it was read')
+        start = position - position % self.window
+        if self.__map is None or self.__map_start != start:
+            if self.__map is not None:
+                self.__map.close()
+            self.__map = mmap.mmap(self.fileno, min(self.window, self.size - start), access=mmap.ACCESS_READ,
+                                   offset=start)
+            if hasattr(self.__map, 'madvise'):
+                self.__map.madvise(mmap.MADV_SEQUENTIAL)
+            self.__map_start = start
+        return self.__map
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes. A read returns at most the rest of the current window
+
+        Args:
+            size (int, optional): maximum bytes to read. Defaults to -1 (read all).
+
+        Returns:
+            bytes: data read, empty at the end of the file
+        """
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(self.window), b''))
+        position = self.__position
+        if position >= self.size or not size:
+            return b''
+        window = self._map(position)
+        offset = position - self.__map_start
+        data = window[offset:offset + size]
+        self.__position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        super().close()
+
+
+class FileSlice(io.RawIOBase):
+    def __init__(self, fd: int, start: int, length: int):
+        """Readable and writable stream over a byte range of a file, positioned relative to the start of the range.
+        Reads and writes use pread and pwrite, so threads can share one file descriptor for the slices of a
+        composite upload or a sliced download
+
+        Args:
+            fd (int): file descriptor
+            start (int): first byte of the range
+            length (int): size of the range
+        """
+        super().__init__()
+        self.fd = fd
+        self.start = start
+        self.length = length
+        self.__position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Seek within the range
+
+        Args:
+            offset (int): seek offset
+            whence (int, optional): seek reference point. Defaults to io.SEEK_SET.
+
+        Returns:
+            int: new position
+        """
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        self.__position = min(max(0, offset), self.length)
+        return self.__position
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes of the range
+
+        Args:
+            size (int, optional): maximum bytes to read. Defaults to -1 (rest of the range).
+
+        Returns:
+            bytes: data read
+        """
+        remaining = self.length - self.__position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = pread(self.fd, size, self.start + self.__position) if size else b''
+        self.__position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def write(self, data) -> int:
+        """Write a chunk at the current position of the range
+
+        Args:
+            data (bytes): chunk to write
+
+        Raises:
+            ValueError: if the chunk does not fit in the range
+
+        Returns:
+            int: number of bytes written
+        """
+        nbytes = len(data)
+        if self.__position + nbytes > self.length:
+            raise ValueError('Download is larger than the requested range')
+        with memoryview(data) as view:
+            written = 0
+            while written < nbytes:
+                written += pwrite(self.fd, view[written:], self.start + self.__position + written)
+        self.__position += nbytes
+        return nbytes
+
+
+def apply_stages(stages: list, data: bytes, final: bool = False) -> bytes:
+    """Pass data through a chain of transform stages (objects with update() and flush()). With final the stages
+    are flushed in order so the output of each flush still passes through the stages after it
+
+    Args:
+        stages (list): transform stages in order
+        data (bytes): input chunk
+        final (bool, optional): end of the stream. Defaults to False.
+
+    Returns:
+        bytes: output of the last stage
+    """
+    for stage in stages:
+        data = stage.update(data) if data else b''
+        if final:
+            data += stage.flush()
+    return data
+
+
+class TransformReader(io.RawIOBase):
+    def __init__(self, source: io.IOBase, stages: list, progress: Progress | None = None,
+                 chunk_size: int = 1024 * 1024, rewind: int = 0):
+        """Readable stream producing the transformed (compressed, encrypted, ...) bytes of a source stream chunk by
+        chunk as the upload consumes them. The last rewind bytes are kept so a resumable upload can seek back to
+        resend a chunk after a retryable failure.
+
+        Args:
+            source (io.IOBase): stream to read the untransformed data from
+            stages (list): transform stages in order
+            progress (Progress | None, optional): progress to report source bytes to. Defaults to None.
+            chunk_size (int, optional): bytes read from the source at a time. Defaults to 1MB.
+            rewind (int, optional): bytes kept for seeking back. Defaults to 0.
+        """
+        super().__init__()
+        self.source = source
+        self.stages = stages
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.rewind = rewind
+        self.source_bytes = 0
+        self.__buffer = bytearray()
+        self.__history: deque = deque()
+        self.__history_size = 0
+        self.__position = 0
+        self.__high_water = 0
+        self.__eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Seek within the kept history of the stream
+
+        Args:
+            offset (int): seek offset
+            whence (int, optional): only io.SEEK_SET and io.SEEK_CUR are supported. Defaults to io.SEEK_SET.
+
+        Raises:
+            io.UnsupportedOperation: if the position is outside of the kept history
+
+        Returns:
+            int: new position
+        """
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('TransformReader only seeks within its rewind history')
+        if offset == self.__position:
+            return offset
+        back = self.__position - offset
+        if back < 0 or back > self.__history_size:
+            raise io.UnsupportedOperation(f'Cannot seek to {offset}, rewind history starts at '
+                                          f'{self.__position - self.__history_size}')
+        replay = []
+        while back > 0:
+            chunk = self.__history.pop()
+            self.__history_size -= len(chunk)
+            if len(chunk) > back:
+                self.__history.append(chunk[:len(chunk) - back])
+                self.__history_size += len(chunk) - back
+                chunk = chunk[len(chunk) - back:]
+            replay.append(chunk)
+            back -= len(chunk)
+        self.__buffer[:0] = b''.join(reversed(replay))
+        self.__position = offset
+        return offset
+
+    def _fill(self, size: int):
+        """Read and transform source chunks until size output bytes are buffered or the source is exhausted
+
+        Args:
+            size (int): wanted buffered bytes, negative for everything
+        """
+        while (size < 0 or len(self.__buffer) < size) and not self.__eof:
+            chunk = self.source.read(self.chunk_size)
+            if chunk:
+                self.source_bytes += len(chunk)
+                if self.progress:
+                    self.progress.update(len(chunk))
+                self.__buffer += apply_stages(self.stages, chunk)
+            else:
+                self.__buffer += apply_stages(self.stages, b'', final=True)
+                self.__eof = True
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size transformed bytes
+
+        Args:
+            size (int, optional): maximum bytes to read. Defaults to -1 (read all).
+
+        Returns:
+            bytes: transformed data
+        """
+        self._fill(size if size is not None else -1)
+        if size is None or size < 0 or size >= len(self.__buffer):
+            data = bytes(self.__buffer)
+            self.__buffer.clear()
+        else:
+            with memoryview(self.__buffer) as view:
+                data = view[:size].tobytes()
+            del self.__buffer[:size]
+        self.__position += len(data)
+        if self.rewind:
+            # The returned chunks are kept by reference rather than copied into a history buffer
+            self.__history.append(data)
+            self.__history_size += len(data)
+            while self.__history_size - len(self.__history[0]) >= self.rewind:
+                self.__history_size -= len(self.__history.popleft())
+        if self.__position > self.__high_water:
+            metrics.add_bytes(self.__position - self.__high_water)
+            scheduler.throttle(self.__position - self.__high_water)
+            self.__high_water = self.__position
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class TransformWriter(io.RawIOBase):
+    def __init__(self, sink: io.IOBase, stages: list, progress: Progress | None = None):
+        """Writable stream handed to the download methods of the storage library. Each response chunk is passed
+        through the transform stages (decrypt, decompress, ...) and the output written to the sink. finish() must
+        be called after the download to flush the stages.
+
+        Args:
+            sink (io.IOBase): stream to write the transformed data to
+            stages (list): transform stages in order
+            progress (Progress | None, optional): progress to report downloaded bytes to. Defaults to None.
+        """
+        super().__init__()
+        self.sink = sink
+        self.stages = stages
+        self.progress = progress
+        self.written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        """Transform a downloaded chunk and write the output to the sink
+
+        Args:
+            data (bytes): downloaded chunk
+
+        Returns:
+            int: number of downloaded bytes consumed
+        """
+        nbytes = len(data)
+        metrics.add_bytes(nbytes)
+        if self.progress:
+            self.progress.update(nbytes)
+        scheduler.throttle(nbytes)
+        output = apply_stages(self.stages, bytes(data))
+        if output:
+            self.sink.write(output)
+            self.written += len(output)
+        return nbytes
+
+    def finish(self):
+        """Flush the stages and write the remaining output to the sink"""
+        output = apply_stages(self.stages, b'', final=True)
+        if output:
+            self.sink.write(output)
+            self.written += len(output)
+
+
+class MemoryWriter(io.RawIOBase):
+    def __init__(self, buffer: memoryview, checksum: StreamChecksum | None = None):
+        """Writable stream filling a caller provided buffer, so downloads land in it without an intermediate copy
+
+        Args:
+            buffer (memoryview): buffer to fill
+            checksum (StreamChecksum | None, optional): checksum to update with each chunk written. Defaults to None.
+        """
+        super().__init__()
+        self.buffer = buffer
+        self.checksum = checksum
+        self.written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        """Copy a downloaded chunk into the buffer
+
+        Args:
+            data (bytes): downloaded chunk
+
+        Raises:
+            ValueError: if the chunk does not fit in the buffer
+
+        Returns:
+            int: number of bytes written
+        """
+        nbytes = len(data)
+        if self.written + nbytes > len(self.buffer):
+            raise ValueError('Download is larger than the requested range')
+        self.buffer[self.written:self.written + nbytes] = data
+        if self.checksum is not None:
+            self.checksum.update(data)
+        self.written += nbytes
+        scheduler.throttle(nbytes)
+        return nbytes
+
+
+class QueueSource():
+    def __init__(self, depth: int = 2):
+        """Source stream fed with chunks by another thread, one per destination of a tee. Wrapped in a
+        TransformReader without stages it gives an upload a rewindable stream of the shared chunks. The bounded queue
+        makes the producer wait for the slowest destination instead of buffering ahead
+
+        Args:
+            depth (int, optional): chunks queued ahead of the reader. Defaults to 2.
+        """
+        self.__queue = queue.Queue(max(1, depth))
+        self.__abandoned = threading.Event()
+        self.__done = False
+
+    @property
+    def abandoned(self) -> bool:
+        return self.__abandoned.is_set()
+
+    def put(self, chunk: bytes | Exception | None) -> bool:
+        """Queue a chunk, waiting for room while the reader is still consuming
+
+        Args:
+            chunk (bytes | Exception | None): data, an error to raise in the reader or None for end of stream
+
+        Returns:
+            bool: True if queued, False if the reader abandoned the stream
+        """
+        while not self.__abandoned.is_set():
+            try:
+                self.__queue.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def abandon(self):
+        """Stop consuming (the upload failed) so the producer no longer waits for this reader"""
+        self.__abandoned.set()
+        while not self.__queue.empty():
+            self.__queue.get_nowait()
+
+    def read(self, size: int = -1) -> bytes:
+        """Get the next queued chunk, whatever its size
+
+        Raises:
+            Exception: the error queued by the producer
+
+        Returns:
+            bytes: chunk or b'' at the end of the stream
+        """
+        if self.__done:
+            return b''
+        chunk = self.__queue.get()
+        if isinstance(chunk, Exception):
+            self.__done = True
+            raise chunk
+        if chunk is None:
+            self.__done = True
+            return b''
+        return chunk
+
+
+# Reads of this many blocks or more bypass the cache. A smaller read spans at most one block more when it is not
+# aligned, so the cache always holds every block of a read plus its read ahead
+DIRECT_READ_BLOCKS = 4
+
+
+class RangeReader(io.RawIOBase):
+    def __init__(self, blob, size: int, block_size: int = 1024 * 1024, read_ahead: int = 4,
+                 cache_blocks: int = 32, priority: str = 'normal'):
+        """Seekable reader over an object issuing ranged GETs. Small reads go through an LRU cache of block_size
+        blocks: the missing blocks of a read are fetched together in one ranged GET (so adjacent small reads are
+        coalesced into block sized requests) and sequential reads extend that request by read_ahead blocks. Reads of
+        at least 4 blocks bypass the cache and are downloaded straight into the caller buffer by readinto(). Reads
+        are pinned to the object generation the reader was opened on. The cache holds at least the blocks one read
+        can span plus read_ahead. Ranges are not verified, the service only reports checksums of whole objects
+
+        Args:
+            blob (storage.Blob): loaded blob to read
+            size (int): object size
+            block_size (int, optional): cache block size. Defaults to 1MB.
+            read_ahead (int, optional): blocks fetched ahead of sequential reads. Defaults to 4.
+            cache_blocks (int, optional): maximum cached blocks. Defaults to 32.
+            priority (str, optional): scheduler class of the owning client. Defaults to 'normal'.
+        """
+        super().__init__()
+        self.blob = blob
+        self.priority = priority
+        self.size = size
+        self.block_size = block_size
+        self.read_ahead = read_ahead
+        self.cache_blocks = max(cache_blocks, DIRECT_READ_BLOCKS + 1 + read_ahead)
+        self.requests = 0
+        self.fetched = 0
+        self.__cache: OrderedDict = OrderedDict()
+        self.__position = 0
+        self.__last_end = -1
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move the read position. Seeking issues no request
+
+        Args:
+            offset (int): seek offset
+            whence (int, optional): seek reference point. Defaults to io.SEEK_SET.
+
+        Raises:
+            ValueError: if the new position is negative
+
+        Returns:
+            int: new position
+        """
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f'Negative seek position {offset}')
+        self.__position = offset
+        return offset
+
+    def _fetch(self, start: int, buffer: memoryview):
+        """Download the range starting at start into buffer with one ranged GET in the scheduler class of the
+        owning client. Ranges up to the small read size take the fast lane unless the client is bulk
+
+        Args:
+            start (int): object offset
+            buffer (memoryview): buffer to fill, its length is the range length
+        """
+        writer = MemoryWriter(buffer)
+        with scheduler.slot(self.priority, len(buffer)):
+            self.blob.download_to_file(writer, start=start, end=start + len(buffer) - 1, raw_download=True,
+                                       checksum=None)
+        if writer.written != len(buffer):
+            raise IOError(f'Short ranged read at {start}: {writer.written} of {len(buffer)} bytes')
+        self.requests += 1
+        self.fetched += len(buffer)
+        metrics.add_bytes(len(buffer))
+
+    def _load(self, first: int, last: int, sequential: bool):
+        """Make sure blocks first to last are cached. Runs of missing blocks are fetched with one request each.
+        Nothing is evicted here, so the blocks of the current read stay cached until readinto() copied them
+
+        Args:
+            first (int): first block index
+            last (int): last block index
+            sequential (bool): the read continues the previous one, so a miss also fetches read_ahead blocks
+        """
+        if sequential and any(index not in self.__cache for index in range(first, last + 1)):
+            last = min(last + self.read_ahead, (self.size - 1) // self.block_size)
+        block = first
+        while block <= last:
+            if block in self.__cache:
+                self.__cache.move_to_end(block)
+                block += 1
+                continue
+            end = block
+            while end + 1 <= last and end + 1 not in self.__cache:
+                end += 1
+            start = block * self.block_size
+            data = memoryview(bytearray(min(self.size, (end + 1) * self.block_size) - start))
+            self._fetch(start, data)
+            for index in range(block, end + 1):
+                offset = (index - block) * self.block_size
+                self.__cache[index] = data[offset:offset + self.block_size]
+            block = end + 1
+
+    def _evict(self):
+        """Drop the least recently used blocks over cache_blocks"""
+        while len(self.__cache) > self.cache_blocks:
+            self.__cache.popitem(last=False)
+
+    def readinto(self, buffer) -> int:
+        """Read into a caller buffer
+
+        Args:
+            buffer (bytearray | memoryview): buffer to fill
+
+        Returns:
+            int: number of bytes read, 0 at the end of the object
+        """
+        view = memoryview(buffer).cast('B')
+        position = self.__position
+        nbytes = min(len(view), self.size - position)
+        if nbytes <= 0:
+            return 0
+        if nbytes >= DIRECT_READ_BLOCKS * self.block_size:
+            self._fetch(position, view[:nbytes])
+        else:
+            first = position // self.block_size
+            last = (position + nbytes - 1) // self.block_size
+            self._load(first, last, position == self.__last_end)
+            done = 0
+            for index in range(first, last + 1):
+                block = self.__cache[index]
+                offset = position + done - index * self.block_size
+                count = min(len(block) - offset, nbytes - done)
+                view[done:done + count] = block[offset:offset + count]
+                done += count
+            self._evict()
+        self.__position = self.__last_end = position + nbytes
+        return nbytes
+
+    def readall(self) -> bytes:
+        """Read from the position to the end of the object
+
+        Returns:
+            bytes: data read
+        """
+        buffer = bytearray(max(0, self.size - self.__position))
+        return bytes(buffer[:self.readinto(buffer)]) if buffer else b''
@@ -0,0 +1,158 @@
+import threading
+import weakref
+from datetime import datetime, timezone
+from logging import Logger
+from time import time
+
+from google.auth.credentials import Credentials
+from google.auth.transport.requests import Request
+
+from gcp_storage.encrypt import Cipher
+from gcp_storage.state import StateStore
+
+
+REFRESH_MARGIN = 300
+MIN_TOKEN_LIFETIME = 60
+
+
+class TokenCache():
+    def __init__(self, state: StateStore, cipher: Cipher, service_account: str):
+        """Access token cache shared between processes. Tokens are encrypted with the cipher key and kept in the
+        state store, keyed by service account and scopes
+
+        Args:
+            state (StateStore): state store to keep the tokens in
+            cipher (Cipher): cipher to encrypt the tokens with
+            service_account (str): service account name
+        """
+        self.state = state
+        self.cipher = cipher
+        self.service_account = service_account
+        self.__key = b''
+
+    def __cipher_key(self) -> bytes:
+        if not self.__key:
+            self.__key = self.cipher.load_key()
+        return self.__key
+
+    def token_key(self, credentials: Credentials) -> str:
+        """Get the cache key of the credentials
+
+        Args:
+            credentials (Credentials): scoped credentials
+
+        Returns:
+            str: cache key
+        """
+        return f'{self.service_account}:{",".join(sorted(getattr(credentials, "scopes", None) or []))}'
+
+    def load(self, credentials: Credentials, min_lifetime: float = MIN_TOKEN_LIFETIME) -> bool:
+        """Set the cached token on the credentials if it is valid for at least min_lifetime seconds
+
+        Args:
+            credentials (Credentials): scoped credentials
+            min_lifetime (float, optional): seconds the token must still be valid. Defaults to 60.
+
+        Returns:
+            bool: True if a cached token was set, False otherwise
+        """
+        value, expiry = self.state.get_token(self.token_key(credentials))
+        if not value or expiry - time() < min_lifetime:
+            return False
+        try:
+            token = self.cipher.decrypt(value, self.__cipher_key())
+        except Exception:
+            # encrypted with a previous cipher key
+            return False
+        credentials.token = token.decode()
+        credentials.expiry = datetime.fromtimestamp(expiry, timezone.utc).replace(tzinfo=None)
+        return True
+
+    def save(self, credentials: Credentials) -> bool:
+        """Cache the token of the credentials
+
+        Args:
+            credentials (Credentials): scoped credentials with a token
+
+        Returns:
+            bool: True if the token was cached, False otherwise
+        """
+        if not credentials.token or not credentials.expiry:
+            return False
+        value = self.cipher.encrypt(credentials.token.encode(), self.__cipher_key())
+        if not value:
+            return False
+        expiry = credentials.expiry.replace(tzinfo=timezone.utc).timestamp()
+        self.state.set_token(self.token_key(credentials), value, expiry)
+        return True
+
+
+class TokenRefresher(threading.Thread):
+    def __init__(self, credentials: Credentials, cache: TokenCache, log: Logger, margin: float = REFRESH_MARGIN):
+        """Daemon thread refreshing the access token margin seconds before it expires, so requests never wait on a
+        token exchange. A fresher token cached by another process is used instead of refreshing, and refreshed tokens
+        are cached for other processes. Only a weak reference to the credentials is held, the thread ends within a
+        minute after the client is released
+
+        Args:
+            credentials (Credentials): scoped credentials used by the client
+            cache (TokenCache): token cache
+            log (Logger): logger
+            margin (float, optional): seconds before expiry to refresh. Defaults to 300.
+        """
+        super().__init__(name='gstorage-token-refresh', daemon=True)
+        self.__credentials = weakref.ref(credentials)
+        self.cache = cache
+        self.log = log
+        self.margin = margin
+        self.__stop = threading.Event()
+
+    @property
+    def credentials(self) -> Credentials | None:
+        return self.__credentials()
+
+    def ensure_token(self) -> bool:
+        """Make sure the credentials hold a token valid for longer than the margin, from the cache or by refreshing
+
+        Returns:
+            bool: True if the token was refreshed, False if it was valid, loaded from the cache or released
+        """
+        credentials = self.credentials
+        if credentials is None or self.__remaining(credentials) > self.margin:
+            return False
+        if self.cache.load(credentials, self.margin):
+            return False
+        credentials.refresh(Request())
+        try:
+            self.cache.save(credentials)
+        except Exception:
+            self.log.exception('Failed to cache access token')
+        return True
+
+    @staticmethod
+    def __remaining(credentials: Credentials) -> float:
+        if not credentials.token or not credentials.expiry:
+            return 0.0
+        return credentials.expiry.replace(tzinfo=timezone.utc).timestamp() - time()
+
+    def __wait_time(self) -> float:
+        credentials = self.credentials
+        if credentials is None:
+            return 0.0
+        return min(60.0, max(1.0, self.__remaining(credentials) - self.margin))
+
+    def run(self):
+        """Refresh the token ahead of expiry until stopped or the credentials are released. Failed refreshes are
+        retried every 30 seconds, requests still refresh on their own once the token expired"""
+        while self.credentials is not None and not self.__stop.wait(self.__wait_time()):
+            try:
+                if self.ensure_token():
+                    self.log.debug('Refreshed access token ahead of expiry')
+            except Exception as error:
+                self.log.warning(f'Failed to refresh access token: {error}')
+                if self.__stop.wait(30):
+                    break
+
+    def stop(self):
+        """Stop refreshing"""
+        self.__stop.set()
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from logging import Logger
+from typing import Callable
+
+
+class Watcher():
+    def __init__(self, poll: Callable[[], list], interval: float, log: Logger, name: str = 'gstorage-watch'):
+        """Polling change feed. Each poll returns the change events since the previous one, the events are
+        delivered by iterating the watcher, by iterating it with async for, or to a callback on a background thread.
+        Polling stops once stop() is called
+
+        Args:
+            poll (Callable[[], list]): function returning the new change events
+            interval (float): seconds between polls
+            log (Logger): logger
+            name (str, optional): name of the callback thread. Defaults to 'gstorage-watch'.
+        """
+        self.poll = poll
+        self.interval = max(0.0, interval)
+        self.log = log
+        self.name = name
+        self.__stop = threading.Event()
+
+    @property
+    def stopped(self) -> bool:
+        return self.__stop.is_set()
+
+    def stop(self):
+        """Stop polling. Iterations end after their current poll"""
+        self.__stop.set()
+
+    def __iter__(self):
+        """Poll every interval seconds until stopped
+
+        Yields:
+            dict: change event
+        """
+        while not self.stopped:
+            yield from self.poll()
+            if self.__stop.wait(self.interval):
+                return None
+
+    async def __aiter__(self):
+        """Poll every interval seconds until stopped without blocking the event loop, polls run in a worker thread
+
+        Yields:
+            dict: change event
+        """
+        while not self.stopped:
+            for event in await asyncio.to_thread(self.poll):
+                yield event
+            waited = 0.0
+            while not self.stopped and waited < self.interval:
+                step = min(0.5, self.interval - waited)
+                await asyncio.sleep(step)
+                waited += step
+
+    def start(self, callback: Callable[[dict], None]) -> threading.Thread:
+        """Deliver the events to a callback on a daemon thread. Exceptions raised by the callback are logged and do
+        not stop the watcher
+
+        Args:
+            callback (Callable[[dict], None]): function called with each change event
+
+        Returns:
+            threading.Thread: the started thread
+        """
+        def run():
+            for event in self:
+                try:
+                    callback(event)
+                except Exception:
+                    self.log.exception(f'Watch callback failed for {event.get("name")}')
+
+        thread = threading.Thread(target=run, name=self.name, daemon=True)
+        thread.start()
+        return thread
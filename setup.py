@@ -13,6 +13,10 @@ try:
             'gstorage-create = gcp_storage.cli:storage_create',
             'gstorage-get = gcp_storage.cli:storage_get',
             'gstorage-delete = gcp_storage.cli:storage_delete',
+            'gstorage-copy = gcp_storage.cli:storage_copy',
+            'gstorage-backup = gcp_storage.cli:storage_backup',
+            'gstorage-pack = gcp_storage.cli:storage_pack',
+            'gstorage-batch = gcp_storage.cli:storage_batch',
         ]},
     )
     exit(0)